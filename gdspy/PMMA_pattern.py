@@ -2,6 +2,7 @@
 # DESCRIPTION
 ###############################
 ## Construct patterns for a fabrication process with PMMA.
+## The layout is described in fab_pattern.json and built with layout_spec.py.
 ## Author: Ryan Thy Huynh
 ## Last updated: 4/3/2024
 ###############################
@@ -12,10 +13,11 @@
 ###############################
 
 # Import packages
+import functools
 import gdspy
+import numpy as np
 import os
-# Directory
-os.chdir('/Users/thuynh/Documents/ross-group/gdspy/hexagonal_patterns')
+import polygon_store
 
 ###############################
 # FUNCTIONS
@@ -41,16 +43,62 @@ def hexagon_pattern(x_center, y_center, num_of_hexagon, radius, trench_width, pa
         + Odd: the middle part will be white --> PMMA will not be exposed
     radius: intial radius
     trench_width: the spacing between two hexagons
-    pattern: the current pattern
+    pattern: the current pattern, or a polygon store (see polygon_store.py) that gets the rings of hexagon_ring_polygons
+        directly (the XOR with the polygons already in the store is not computed)
 
     Return: the pattern with multiple hexagons
     """
+    if polygon_store.is_polygon_store(pattern):
+        rings, middle_hexagon = hexagon_ring_polygons(x_center, y_center, num_of_hexagon, radius, trench_width)
+        polygon_store.add_polygons(pattern, rings)
+        if middle_hexagon is not None:
+            polygon_store.add_polygons(pattern, middle_hexagon[np.newaxis])
+        return pattern
     if num_of_hexagon == 0:
         return hexagon(x_center, y_center, radius, pattern)
     else:
         pattern = hexagon(x_center, y_center, radius, pattern)
         return hexagon_pattern(x_center, y_center, num_of_hexagon - 1, radius + trench_width, trench_width, pattern)
-    
+
+def hexagon_ring_polygons(x_center, y_center, num_of_hexagon, radius, trench_width):
+    """
+    Same pattern as hexagon_pattern starting from an empty pattern, computed without boolean operations.
+    The XOR of num_of_hexagon + 1 nested hexagons covers every second ring counted from the outermost one,
+    plus the middle hexagon when num_of_hexagon is even.
+
+    Return: an array of shape (number of rings, 14, 2) with one polygon per ring and the middle hexagon (or None)
+    """
+    # Corners of the unit hexagon, same as gdspy.Round(..., number_of_points=6)
+    angles = np.arange(6) * 2.0 * np.pi / 6
+    unit_hexagon = np.stack((np.cos(angles), np.sin(angles)), axis = -1)
+    # Radii of all the hexagons from the innermost to the outermost
+    radii = radius + np.arange(num_of_hexagon + 1) * trench_width
+    # Ring k lies between radii[k - 1] and radii[k]; only the rings with k = num_of_hexagon, num_of_hexagon - 2, ... are covered
+    k = np.arange(num_of_hexagon, 0, -2)
+    # Each ring is one polygon: the outer hexagon counterclockwise, then the inner one clockwise, joined by a cut line
+    outer_index = [0, 1, 2, 3, 4, 5, 0]
+    inner_index = [0, 5, 4, 3, 2, 1, 0]
+    unit_ring = unit_hexagon[outer_index + inner_index]
+    scale = np.concatenate((np.repeat(radii[k, np.newaxis], 7, axis = 1), np.repeat(radii[k - 1, np.newaxis], 7, axis = 1)), axis = 1)
+    rings = scale[:, :, np.newaxis] * unit_ring[np.newaxis, :, :] + (x_center, y_center)
+    if num_of_hexagon % 2 == 0:
+        middle_hexagon = radii[0] * unit_hexagon + (x_center, y_center)
+    else:
+        middle_hexagon = None
+    return rings, middle_hexagon
+
+def hexagon_ring_pattern(x_center, y_center, num_of_hexagon, radius, trench_width):
+    """
+    Analytic version of hexagon_pattern for an empty starting pattern. The time grows linearly with num_of_hexagon.
+
+    Return: the pattern with multiple hexagons
+    """
+    rings, middle_hexagon = hexagon_ring_polygons(x_center, y_center, num_of_hexagon, radius, trench_width)
+    polygons = list(rings)
+    if middle_hexagon is not None:
+        polygons.append(middle_hexagon)
+    return gdspy.PolygonSet(polygons)
+
 def rectangle_horizontal_array(x_top, y_top, length, width, dx, num_horizontal_patterns, main_cell):
     "Return a horizontal array of rectangle pattern (length x width) with the spacing of dx between each pattern"
     # Determine the coordinates of a bottom right corner of the rectangle
@@ -65,8 +113,24 @@ def rectangle_horizontal_array(x_top, y_top, length, width, dx, num_horizontal_p
     else:
         return rectangle_horizontal_array(x_top + length + dx, y_top, length, width, dx, num_horizontal_patterns - 1, main_cell)
 
+def rectangle_matrix_polygons(x_top, y_top, length, width, dx, dy, num_horizontal_patterns, num_vertical_array):
+    """
+    Return: the vertices of the rectangles of rectangle_pattern as one array of shape (number of rectangles, 4, 2),
+    row by row, with the vertices in the order of gdspy.Rectangle
+    """
+    x_left = x_top + np.arange(num_horizontal_patterns) * (length + dx)
+    y_bottom = y_top + np.arange(num_vertical_array) * (width + dy)
+    x, y = (corner.ravel() for corner in np.meshgrid(x_left, y_bottom))
+    return np.stack((np.stack((x, y), axis = -1), np.stack((x, y + width), axis = -1),
+                     np.stack((x + length, y + width), axis = -1), np.stack((x + length, y), axis = -1)), axis = 1)
+
 def rectangle_pattern(x_top, y_top, length, width, dx, dy, num_horizontal_patterns, num_vertical_array, main_cell):
-    " Return a matrix of patterns (num_horizontal x num_vertical) of rectangular patterns (length x width) with the horizontal spacing of dx and vertical spacing of dy."
+    """
+    Return a matrix of patterns (num_horizontal x num_vertical) of rectangular patterns (length x width) with the horizontal spacing of dx and vertical spacing of dy.
+    main_cell may also be a polygon store (see polygon_store.py): all the rectangles are then added to it at once.
+    """
+    if polygon_store.is_polygon_store(main_cell):
+        return polygon_store.add_polygons(main_cell, rectangle_matrix_polygons(x_top, y_top, length, width, dx, dy, num_horizontal_patterns, num_vertical_array))
     if num_vertical_array == 1:
         return rectangle_horizontal_array(x_top, y_top, length, width, dx, num_horizontal_patterns, main_cell)
     else:
@@ -96,10 +160,100 @@ def rotation_matrix(main_cell, pattern_cell, x_coor, y_coor, magnification_value
     else:
         return rotation_matrix(main_cell, pattern_cell, x_coor, y_coor + dy, magnification_value, start_angle + rotation_angle_increment, final_angle, rotation_angle_increment, dx, dy, num_of_horizontal_copies)
 
+def rectangle_cell_array(x_top, y_top, length, width, dx, dy, num_horizontal_patterns, num_vertical_array, main_cell, unit_cell):
+    """
+    Same matrix as rectangle_pattern, but hierarchical: a single rectangle (length x width) is added to unit_cell
+    and main_cell gets one CellArray of it, so the size of the GDS file does not depend on the number of rectangles.
+    unit_cell: an empty cell to hold the rectangle
+
+    Return: main_cell
+    """
+    unit_cell.add(gdspy.Rectangle((0, 0), (length, width)))
+    main_cell.add(gdspy.CellArray(unit_cell, num_horizontal_patterns, num_vertical_array, (length + dx, width + dy), origin = (x_top, y_top)))
+    return main_cell
+
+def rotated_row_array(lib, main_cell, pattern_cell, x_coor, y_coor, magnification_value, rotation_angle, dx, num_of_horizontal_copies):
+    """
+    Same row as horizontal_rotated_copy, but with one CellArray instead of one reference per copy.
+    A CellArray rotates its spacing together with the cell, so the rotated pattern is first put in a row cell
+    (e.g. 'rect_1_35p27') and the row cell is repeated without rotation.
+    lib: the library holding the row cells; a row cell is reused when the same pattern and angle come up again
+
+    Return: main_cell
+    """
+    row_name = '{}_{}'.format(pattern_cell.name, '{:g}'.format(rotation_angle).replace('.', 'p'))
+    if magnification_value != 1:
+        row_name += '_x{}'.format('{:g}'.format(magnification_value).replace('.', 'p'))
+    if row_name in lib.cells:
+        row_cell = lib.cells[row_name]
+    else:
+        row_cell = gdspy.Cell(row_name, exclude_from_current = True)
+        lib.add(row_cell)
+        row_cell.add(gdspy.CellReference(pattern_cell, origin = (0, 0), magnification = magnification_value, rotation = rotation_angle))
+    main_cell.add(gdspy.CellArray(row_cell, num_of_horizontal_copies, 1, (dx, 0), origin = (x_coor, y_coor)))
+    return main_cell
+
+def rotation_cell_array(lib, main_cell, pattern_cell, x_coor, y_coor, magnification_value, start_angle, final_angle, rotation_angle_increment, dx, dy, num_of_horizontal_copies):
+    """
+    Same matrix as rotation_matrix, with one CellArray per angle row (see rotated_row_array).
+    Written as a loop, so the number of rows is not limited by the recursion depth.
+
+    Return: main_cell
+    """
+    rotation_angle = start_angle
+    while True:
+        rotated_row_array(lib, main_cell, pattern_cell, x_coor, y_coor, magnification_value, rotation_angle, dx, num_of_horizontal_copies)
+        if rotation_angle >= final_angle:
+            return main_cell
+        rotation_angle += rotation_angle_increment
+        y_coor += dy
+
+@functools.lru_cache(maxsize = None)
+def dot_polygon(radius, tolerance, address_grid = None, max_vertices = None):
+    """
+    radius, tolerance: same as in dot_pattern
+    address_grid: address grid of the e-beam writer; the writer cannot resolve a finer polygon, so the tolerance is raised
+        to the grid, the vertices are snapped to it and the polygon gets the area of the circle
+    max_vertices: largest number of vertices of the dot
+
+    Return: the vertices of one dot centered on the origin, computed once for every set of parameters (read-only array).
+    Without address_grid and max_vertices, the dot is the one of the original dot_pattern, gdspy.Round((0, 0), radius, tolerance):
+    the third argument of gdspy.Round is inner_radius, so 'tolerance' is the radius of a small hole and the outline keeps
+    the default tolerance of gdspy (0.01), e.g. a 12-vertex polygon for radius 0.05.
+    With address_grid or max_vertices, 'tolerance' is the largest distance between the polygon and the circle, and the
+    dot has no hole.
+    """
+    if address_grid is None and max_vertices is None:
+        # Same geometry as the original builders; translating this dot gives the same vertices as gdspy.Round at the center
+        points = gdspy.Round((0, 0), radius, tolerance).polygons[0]
+        points.flags.writeable = False
+        return points
+    if address_grid is not None:
+        tolerance = max(tolerance, address_grid)
+    # Distance between a chord and the circle: radius * (1 - cos(pi / number_of_points)) <= tolerance
+    number_of_points = int(np.ceil(np.pi / np.arccos(max(1 - tolerance / radius, -1))))
+    if max_vertices is not None:
+        number_of_points = min(number_of_points, max_vertices)
+    # A multiple of 4, so that the dot is symmetric about both axes
+    number_of_points = max(4, 4 * int(round(number_of_points / 4.0)))
+    if max_vertices is not None and max_vertices >= 4:
+        number_of_points = min(number_of_points, 4 * (max_vertices // 4))
+    angles = np.arange(number_of_points) * 2 * np.pi / number_of_points
+    points = np.stack((np.cos(angles), np.sin(angles)), axis = -1) * radius
+    if address_grid is not None:
+        # Same area as the circle
+        points *= np.sqrt(2 * np.pi / (number_of_points * np.sin(2 * np.pi / number_of_points)))
+        points = np.round(points / address_grid) * address_grid
+        # Vertices merged by the snapping are removed
+        points = points[np.any(points != np.roll(points, 1, axis = 0), axis = 1)]
+    points.flags.writeable = False
+    return points
+
 def dot_pattern(x_coor, y_coor, radius, tolerance, substrate_pattern):
     """Add a dot pattern at (x_coor, y_coor) with a radius of 'radius' into a substrate pattern"""
-    # Create a dot pattern
-    dot = gdspy.Round((x_coor, y_coor), radius, tolerance)
+    # Create a dot pattern from the shared dot polygon: the same vertices as gdspy.Round((x_coor, y_coor), radius, tolerance),
+    # so the pattern is the same as the one of the original builder (see dot_polygon)
+    dot = gdspy.Polygon(dot_polygon(radius, tolerance) + (x_coor, y_coor))
     # Add the dot pattern to the substrate pattern
     new_substrate_pattern = gdspy.boolean(substrate_pattern, dot, 'xor')
     return new_substrate_pattern
@@ -115,7 +269,13 @@ def horizontal_dot_pattern(x_coor, y_coor, radius, tolerance, dx, number_of_hori
         return horizontal_dot_pattern(new_x_coor, y_coor, radius, tolerance, dx, number_of_horizontal_copies - 1, new_substrate_pattern)
     
 def horizontal_dot_matrix(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies, substrate_pattern):
-    """Add a matrix of dot patterns into substrate pattern"""
+    """
+    Add a matrix of dot patterns into substrate pattern.
+    substrate_pattern may also be a polygon store (see polygon_store.py): the dots of dot_matrix_polygons are then added
+    to it at once, as separate polygons (the XOR with the polygons already in the store is not computed)
+    """
+    if polygon_store.is_polygon_store(substrate_pattern):
+        return polygon_store.add_polygons(substrate_pattern, dot_matrix_polygons(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies))
     # Add a horizontal dot array into a substrate pattern
     new_substrate_pattern = horizontal_dot_pattern(x_coor, y_coor, radius, tolerance, dx, number_of_horizontal_copies, substrate_pattern)
     if number_of_vertical_copies == 1:
@@ -123,6 +283,113 @@ def horizontal_dot_matrix(x_coor, y_coor, radius, tolerance, dx, dy, number_of_h
     else:
         new_y_coor = y_coor + radius + dy + radius
         return horizontal_dot_matrix(x_coor, new_y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies - 1, new_substrate_pattern)
+
+def dot_matrix_polygons(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies, address_grid = None, max_vertices = None):
+    """
+    x_coor, y_coor: center of the bottom left dot
+    radius, tolerance: same as in dot_pattern
+    dx, dy: spacing between the edges of two neighbouring dots
+    address_grid, max_vertices: polygonization of the dots, see dot_polygon
+
+    Return: the vertices of every dot of the matrix as one array of shape (number of dots, number of points, 2)
+    """
+    # One dot at the origin; every other dot is a translated copy of it
+    dot = dot_polygon(radius, tolerance, address_grid, max_vertices)
+    # Same dot centers as horizontal_dot_matrix
+    x_centers = x_coor + np.arange(number_of_horizontal_copies) * (radius + dx + radius)
+    y_centers = y_coor + np.arange(number_of_vertical_copies) * (radius + dy + radius)
+    centers = np.stack(np.meshgrid(x_centers, y_centers), axis = -1).reshape(-1, 1, 2)
+    return dot[np.newaxis, :, :] + centers
+
+def xor_in_tile(substrate_pattern, dots, tile):
+    """
+    dots: vertices of the dots touching the tile, shape (number of dots, number of points, 2)
+    tile: a rectangle
+
+    Return: the part of (substrate_pattern XOR dots) inside the tile, or None if it is empty
+    """
+    # (substrate AND tile) XOR dots, cut back to the tile
+    tile_pattern = gdspy.boolean(substrate_pattern, tile, 'and')
+    if len(dots) > 0:
+        tile_pattern = gdspy.boolean(tile_pattern, list(dots), 'xor')
+        tile_pattern = gdspy.boolean(tile_pattern, tile, 'and')
+    return tile_pattern
+
+def batched_dot_matrix(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies, substrate_pattern, tile_size = None, address_grid = None, max_vertices = None):
+    """
+    Add a matrix of dot patterns into a substrate pattern with a single boolean operation.
+    Gives the same pattern as horizontal_dot_matrix as long as the dots do not overlap each other.
+    tile_size: if given, the substrate is cut into square tiles of this size and one boolean is done per tile
+    address_grid, max_vertices: polygonization of the dots, see dot_polygon
+
+    Return: the new substrate pattern
+    """
+    dots = dot_matrix_polygons(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies, address_grid, max_vertices)
+    if tile_size is None:
+        return gdspy.boolean(substrate_pattern, list(dots), 'xor')
+    # Bounding box of the substrate and the dots together
+    box = substrate_pattern.get_bounding_box()
+    x_min = min(box[0][0], dots[:, :, 0].min())
+    y_min = min(box[0][1], dots[:, :, 1].min())
+    x_max = max(box[1][0], dots[:, :, 0].max())
+    y_max = max(box[1][1], dots[:, :, 1].max())
+    dot_min = dots.min(axis = 1)
+    dot_max = dots.max(axis = 1)
+    new_substrate_pattern = gdspy.PolygonSet([])
+    for x_tile in np.arange(x_min, x_max, tile_size):
+        for y_tile in np.arange(y_min, y_max, tile_size):
+            tile = gdspy.Rectangle((x_tile, y_tile), (x_tile + tile_size, y_tile + tile_size))
+            # Dots touching the tile, including the ones crossing its border
+            touching = np.all((dot_max >= (x_tile, y_tile)) & (dot_min <= (x_tile + tile_size, y_tile + tile_size)), axis = 1)
+            tile_pattern = xor_in_tile(substrate_pattern, dots[touching], tile)
+            if tile_pattern is not None:
+                new_substrate_pattern.polygons.extend(tile_pattern.polygons)
+                new_substrate_pattern.layers.extend(tile_pattern.layers)
+                new_substrate_pattern.datatypes.extend(tile_pattern.datatypes)
+    return new_substrate_pattern
+
+def dot_matrix_window(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies, box, address_grid = None, max_vertices = None):
+    """
+    box: ((x_min, y_min), (x_max, y_max))
+    address_grid, max_vertices: polygonization of the dots, see dot_polygon
+
+    Return: the vertices of the dots of the matrix that touch box, in the format of dot_matrix_polygons.
+    Only these dots are generated, so the memory use depends on the size of box and not on the size of the matrix.
+    """
+    x_pitch = radius + dx + radius
+    y_pitch = radius + dy + radius
+    first_column = max(0, int(np.ceil((box[0][0] - radius - x_coor) / x_pitch)))
+    last_column = min(number_of_horizontal_copies - 1, int(np.floor((box[1][0] + radius - x_coor) / x_pitch)))
+    first_row = max(0, int(np.ceil((box[0][1] - radius - y_coor) / y_pitch)))
+    last_row = min(number_of_vertical_copies - 1, int(np.floor((box[1][1] + radius - y_coor) / y_pitch)))
+    return dot_matrix_polygons(x_coor + first_column * x_pitch, y_coor + first_row * y_pitch, radius, tolerance, dx, dy,
+                               max(0, last_column - first_column + 1), max(0, last_row - first_row + 1), address_grid, max_vertices)
+
+def dot_field_tiles(substrate_corners, dot_matrices, tile_size):
+    """
+    substrate_corners: two opposite corners of the rectangular substrate
+    dot_matrices: one dictionary of dot_matrix_polygons parameters per dot matrix
+    tile_size: side of the square tiles
+
+    Yield: the substrate XOR all the dots, one tile at a time (a PolygonSet per non-empty tile)
+    """
+    corners = np.array(substrate_corners, dtype = float)
+    x_min, y_min = corners.min(axis = 0)
+    x_max, y_max = corners.max(axis = 0)
+    # Dots may stick out of the substrate: the tiles cover them as well
+    for dot_matrix in dot_matrices:
+        x_min = min(x_min, dot_matrix['x_coor'] - dot_matrix['radius'])
+        y_min = min(y_min, dot_matrix['y_coor'] - dot_matrix['radius'])
+        x_max = max(x_max, dot_matrix['x_coor'] + (2 * dot_matrix['radius'] + dot_matrix['dx']) * (dot_matrix['number_of_horizontal_copies'] - 1) + dot_matrix['radius'])
+        y_max = max(y_max, dot_matrix['y_coor'] + (2 * dot_matrix['radius'] + dot_matrix['dy']) * (dot_matrix['number_of_vertical_copies'] - 1) + dot_matrix['radius'])
+    substrate_pattern = gdspy.Rectangle(*substrate_corners)
+    for x_tile in np.arange(x_min, x_max, tile_size):
+        for y_tile in np.arange(y_min, y_max, tile_size):
+            box = ((x_tile, y_tile), (x_tile + tile_size, y_tile + tile_size))
+            dots = np.concatenate([dot_matrix_window(box = box, **dot_matrix) for dot_matrix in dot_matrices])
+            tile_pattern = xor_in_tile(substrate_pattern, dots, gdspy.Rectangle(*box))
+            if tile_pattern is not None:
+                yield tile_pattern
     
 ###############################
 # ADDITIONAL FUNCTIONS
@@ -137,18 +404,28 @@ def hexagon_array(center_x_coor, center_y_coor, number_of_loops, radius, trench_
     dx: distance to move in the x-direction
     dy: distance to move in the y_direction
     number_of_patterns: number of patterns in one horizontal cell
+    cell: the cell, or a polygon store (see polygon_store.py) filled directly with the rings
     
+
     Return a cell with horizonal_cell_array
     """
-    current_pattern = hexagon_pattern(center_x_coor, center_y_coor, number_of_loops, radius, trench_width, pattern)
-    if number_of_patterns_x == 1:      
-        return cell.add(current_pattern)
+    if pattern is None and polygon_store.is_polygon_store(cell):
+        current_pattern = None
+        hexagon_pattern(center_x_coor, center_y_coor, number_of_loops, radius, trench_width, cell)
+    elif pattern is None:
+        # Nothing to XOR with, so the rings can be computed directly
+        current_pattern = hexagon_ring_pattern(center_x_coor, center_y_coor, number_of_loops, radius, trench_width)
+    else:
+        current_pattern = hexagon_pattern(center_x_coor, center_y_coor, number_of_loops, radius, trench_width, pattern)
+    if current_pattern is not None:
+        cell = cell.add(current_pattern)
+    if number_of_patterns_x == 1:
+        return cell
     else:
         new_x_coor = center_x_coor + dx
         new_y_coor = center_y_coor + dy
         new_trench_width = trench_width + trench_width_increment
-        new_cell = cell.add(current_pattern)
-        return hexagon_array(new_x_coor, new_y_coor, number_of_loops, radius, new_trench_width, trench_width_increment, dx, dy, number_of_patterns_x - 1, pattern, new_cell)
+        return hexagon_array(new_x_coor, new_y_coor, number_of_loops, radius, new_trench_width, trench_width_increment, dx, dy, number_of_patterns_x - 1, pattern, cell)
 
 def quadrant_cell_array(center_x_coor, center_y_coor, number_of_loops, radius, trench_width, trench_width_increment, 
                                                  dx, dy, number_of_patterns_x, number_of_patterns_y, pattern, cell):
@@ -166,400 +443,104 @@ def quadrant_cell_array(center_x_coor, center_y_coor, number_of_loops, radius, t
 
 
 ###############################
-# MAIN CODES
+# CELL RECIPES
 ###############################
+# Each recipe fills one cell with polygons only, so that it can be built in a worker process (see parallel_build.py).
+# The recipes and their parameters are listed in the layout spec (see layout_spec.py and fab_pattern.json).
+# The recipes that only generate shapes fill a polygon store (see polygon_store.py) and return its arrays,
+# so no gdspy object is created per shape in the workers.
+
+def hexagon_cell_recipe(cell, center_x_coor, center_y_coor, number_of_loops, radius, trench_width, trench_width_increment, dx, dy, number_of_patterns_x):
+    """A row of hexagonal patterns (see hexagon_array), the trench width increases by trench_width_increment from one pattern to the next"""
+    store = polygon_store.new_polygon_store()
+    hexagon_array(center_x_coor = center_x_coor, center_y_coor = center_y_coor, 
+                  number_of_loops = number_of_loops, 
+                  radius = radius, trench_width = trench_width, trench_width_increment = trench_width_increment, 
+                  dx = dx, dy = dy, 
+                  number_of_patterns_x = number_of_patterns_x, 
+                  pattern = None, 
+                  cell = store)
+    return polygon_store.store_arrays(store)
+
+def rectangle_cell_recipe(cell, x_top, y_top, length, width, dx, dy, num_horizontal_patterns, num_vertical_array):
+    """A matrix of rectangular patterns (see rectangle_pattern)"""
+    store = rectangle_pattern(x_top = x_top, y_top = y_top, 
+                              length = length, width = width, 
+                              dx = dx, dy = dy, 
+                              num_horizontal_patterns = num_horizontal_patterns, num_vertical_array = num_vertical_array, 
+                              main_cell = polygon_store.new_polygon_store())
+    return polygon_store.store_arrays(store)
+
+def dot_field_recipe(cell, substrate_corners, dot_matrices):
+    """
+    substrate_corners: two opposite corners of the rectangular substrate
+    dot_matrices: one dictionary of dot_matrix_polygons parameters per dot matrix
 
-# The GDSII file is called a library, which contains multiple cells.
-lib = gdspy.GdsLibrary()
-# Define a main cell
-main = lib.new_cell('main')
-
-# Define pattern cells
-hexagon_cell = lib.new_cell('hexagon')
-
-# CFO = 0.05 um, BFO = 0.05 um
-rect_1 = lib.new_cell('rect_1')
-rect_mat_1 = lib.new_cell('rect_mat_1')
-rect_mat_1a = lib.new_cell('rect_mat_1a')
-
-# CFO = 0.05 um, BFO = 0.1 um
-rect_2 = lib.new_cell('rect_2')
-rect_mat_2 = lib.new_cell('rect_mat_2')
-rect_mat_2a = lib.new_cell('rect_mat_2a')
-
-# CFO = 0.05 um, BFO = 0.15 um 
-rect_3 = lib.new_cell('rect_3')
-rect_mat_3 = lib.new_cell('rect_mat_3')
-rect_mat_3a = lib.new_cell('rect_mat_3a')
-
-# CFO = 0.1 um, BFO = 0.1 um
-rect_4 = lib.new_cell('rect_4')
-rect_mat_4 = lib.new_cell('rect_mat_4')
-rect_mat_4a = lib.new_cell('rect_mat_4a')
-
-# CFO = 0.1 um, BFO = 0.15 um
-rect_5 = lib.new_cell('rect_5')
-rect_mat_5 = lib.new_cell('rect_mat_5')
-rect_mat_5a = lib.new_cell('rect_mat_5a')
-
-# CFO = 0.1 um, BFO = 0.2 um
-rect_6 = lib.new_cell('rect_6')
-rect_mat_6 = lib.new_cell('rect_mat_6')
-rect_mat_6a = lib.new_cell('rect_mat_6a')
-
-# CFO = 0.1 um, BFO = 0.25 um
-rect_7 = lib.new_cell('rect_7')
-rect_mat_7 = lib.new_cell('rect_mat_7')
-rect_mat_7a = lib.new_cell('rect_mat_7a')
+    Add the substrate with all the dots subtracted from it in one boolean operation.
+    """
+    rectangular_substrate_pattern = gdspy.Rectangle(*substrate_corners)
+    dots = np.concatenate([dot_matrix_polygons(**dot_matrix) for dot_matrix in dot_matrices])
+    new_dot_pattern = gdspy.boolean(rectangular_substrate_pattern, list(dots), 'xor')
+    return cell.add(new_dot_pattern)
 
-###############################
-# CREATE PATTERNS
-###############################
-# A hexagonal pattern
-pattern_temp = None
-hexagon_array(center_x_coor = 0, center_y_coor = -60, 
-              number_of_loops = 40, 
-              radius = 0.5, trench_width = 0.05, trench_width_increment = 0.02, 
-              dx = 40, dy = 0, 
-              number_of_patterns_x = 12, 
-              pattern = pattern_temp, 
-              cell = hexagon_cell)
-hexagon_ref = gdspy.CellReference(hexagon_cell, (0, 0))
-
-### CFO = 0.05 um, BFO = 0.05 um ###
-
-# Rectangular pattern matrix, rotation angles from 0 to 90 degree with 15 degree increment
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.05, 
-                  dx = 0, dy = 0.05, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_1)
-rect_mat_cell_1 = rotation_matrix(main_cell = rect_mat_1, pattern_cell = rect_1, 
-                       x_coor = 0, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_1_35p27 = horizontal_rotated_copy(main_cell = rect_mat_1a, pattern_cell = rect_1, 
-                                                    x_coor = 0, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_1_54p74 = horizontal_rotated_copy(main_cell = rect_mat_1a, pattern_cell = rect_1, 
-                                                    x_coor = 0, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-### CFO = 0.05 um, BFO = 0.1 um ###
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.1, 
-                  dx = 0, dy = 0.05, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_2)
-rect_mat_cell_2 = rotation_matrix(main_cell = rect_mat_2, pattern_cell = rect_2, 
-                       x_coor = 70, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_2_35p27 = horizontal_rotated_copy(main_cell = rect_mat_2a, pattern_cell = rect_2, 
-                                                    x_coor = 70, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_2_54p74 = horizontal_rotated_copy(main_cell = rect_mat_2a, pattern_cell = rect_2, 
-                                                    x_coor = 70, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-### CFO = 0.05 um, BFO = 0.15 um ###
-
-# Rectangular pattern matrix, rotation angles from 0 to 90 degree with 15 degree increment
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.15, 
-                  dx = 0, dy = 0.05, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_3)
-rect_mat_cell_3 = rotation_matrix(main_cell = rect_mat_3, pattern_cell = rect_3, 
-                       x_coor = 140, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_3_35p27 = horizontal_rotated_copy(main_cell = rect_mat_3a, pattern_cell = rect_3, 
-                                                    x_coor = 140, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_3_54p74 = horizontal_rotated_copy(main_cell = rect_mat_3a, pattern_cell = rect_3, 
-                                                    x_coor = 140, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-### CFO = 0.1 um, BFO = 0.1 um ###
-
-# Rectangular pattern matrix, rotation angles from 0 to 90 degree with 15 degree increment
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.1, 
-                  dx = 0, dy = 0.1, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_4)
-rect_mat_cell_4 = rotation_matrix(main_cell = rect_mat_4, pattern_cell = rect_4, 
-                       x_coor = 210, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_4_35p27 = horizontal_rotated_copy(main_cell = rect_mat_4a, pattern_cell = rect_4, 
-                                                    x_coor = 210, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_4_54p74 = horizontal_rotated_copy(main_cell = rect_mat_4a, pattern_cell = rect_4, 
-                                                    x_coor = 210, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-### CFO = 0.1 um, BFO = 0.15 um ###
-
-# Rectangular pattern matrix, rotation angles from 0 to 90 degree with 15 degree increment
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.15, 
-                  dx = 0, dy = 0.1, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_5)
-rect_mat_cell_5 = rotation_matrix(main_cell = rect_mat_5, pattern_cell = rect_5, 
-                       x_coor = 280, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_5_35p27 = horizontal_rotated_copy(main_cell = rect_mat_5a, pattern_cell = rect_5, 
-                                                    x_coor = 280, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_5_54p74 = horizontal_rotated_copy(main_cell = rect_mat_5a, pattern_cell = rect_5, 
-                                                    x_coor = 280, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-### CFO = 0.1 um, BFO = 0.2 um ###
-
-# Rectangular pattern matrix, rotation angles from 0 to 90 degree with 15 degree increment
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.2, 
-                  dx = 0, dy = 0.1, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_6)
-rect_mat_cell_6 = rotation_matrix(main_cell = rect_mat_6, pattern_cell = rect_6, 
-                       x_coor = 350, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_6_35p27 = horizontal_rotated_copy(main_cell = rect_mat_6a, pattern_cell = rect_6, 
-                                                    x_coor = 350, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_6_54p74 = horizontal_rotated_copy(main_cell = rect_mat_6a, pattern_cell = rect_6, 
-                                                    x_coor = 350, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-### CFO = 0.1 um, BFO = 0.25 um ###
-
-# Rectangular pattern matrix, rotation angles from 0 to 90 degree with 15 degree increment
-
-rectangle_pattern(x_top = 0, y_top = 0, 
-                  length = 15, width = 0.25, 
-                  dx = 0, dy = 0.1, 
-                  num_horizontal_patterns = 1, num_vertical_array = 20, 
-                  main_cell = rect_7)
-rect_mat_cell_7 = rotation_matrix(main_cell = rect_mat_7, pattern_cell = rect_7, 
-                       x_coor = 420, y_coor = 0, 
-                       magnification_value = 1, 
-                       start_angle = 0, 
-                       final_angle = 90, 
-                       rotation_angle_increment = 15, 
-                       dx = 20, 
-                       dy = 20, 
-                       num_of_horizontal_copies = 2)
-
-# Rectangular pattern with rotation angles 35.27 and 54.74
-
-rect_mat_cell_7_35p27 = horizontal_rotated_copy(main_cell = rect_mat_7a, pattern_cell = rect_7, 
-                                                    x_coor = 420, y_coor = -20, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 35.27, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-rect_mat_cell_7_54p74 = horizontal_rotated_copy(main_cell = rect_mat_7a, pattern_cell = rect_7, 
-                                                    x_coor = 420, y_coor = -40, 
-                                                    magnification_value = 1, 
-                                                    rotation_angle = 54.74, 
-                                                    dx = 20, 
-                                                    num_of_horizontal_copies = 2)
-
-
-
-# Dot patterns with the spacing 0.05
-rectangular_substrate_pattern = gdspy.Rectangle((160, -70), (170, -80))
-new_dot_pattern = horizontal_dot_matrix(x_coor = 161, y_coor = -79, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.05, dy = 0.05, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = rectangular_substrate_pattern)
-# Dot pattern with the spacing 0.0625
-new_dot_pattern_1 = horizontal_dot_matrix(x_coor = 161, y_coor = -76, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.0625, dy = 0.0625, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = new_dot_pattern)
-
-# Dot pattern with the spacing 0.075
-new_dot_pattern_2 = horizontal_dot_matrix(x_coor = 161, y_coor = -73, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.075, dy = 0.075, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = new_dot_pattern_1)
-
-# Dot pattern with the spacing 0.0875
-new_dot_pattern_3 = horizontal_dot_matrix(x_coor = 164, y_coor = -79, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.0875, dy = 0.0875, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = new_dot_pattern_2)
-
-# Dot pattern with the spacing 0.01
-new_dot_pattern_4 = horizontal_dot_matrix(x_coor = 164, y_coor = -76, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.1, dy = 0.1, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = new_dot_pattern_3)
-
-# Dot pattern with the spacing 0.0125
-new_dot_pattern_5 = horizontal_dot_matrix(x_coor = 164, y_coor = -73, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.125, dy = 0.125, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = new_dot_pattern_4)
-
-# Dot pattern with the spacing 0.015
-new_dot_pattern_6 = horizontal_dot_matrix(x_coor = 167, y_coor = -79, 
-                                        radius = 0.05, tolerance = 0.0001, 
-                                        dx = 0.15, dy = 0.15, 
-                                        number_of_horizontal_copies = 11, number_of_vertical_copies = 11, 
-                                        substrate_pattern = new_dot_pattern_5)
+def dot_field_stream_recipe(cell, substrate_corners, dot_matrices, tile_size = 1):
+    """
+    Same pattern as dot_field_recipe, yielded one tile at a time (see dot_field_tiles) instead of added to the cell.
+    Used with streaming_gds.py, the memory use does not grow with the number of dots.
+    """
+    yield from dot_field_tiles(substrate_corners, dot_matrices, tile_size)
+
+def dot_field_tiled_recipe(cell, substrate_corners, dot_matrices, tile_size = 2, max_workers = None):
+    """
+    Same pattern as dot_field_recipe, with the boolean operation split into tiles computed in parallel
+    (see tiled_boolean.py). Meant for large dot fields, where the single boolean operation is the slowest step.
+    max_workers: processes of the tiles (default: all the cores, or in a build worker its share of the cores, see
+        parallel_build.default_workers)
+    """
+    # Imported here, so that the process pool is only loaded by the layouts that use it
+    import tiled_boolean
+    rectangular_substrate_pattern = gdspy.Rectangle(*substrate_corners)
+    dots = np.concatenate([dot_matrix_polygons(**dot_matrix) for dot_matrix in dot_matrices])
+    new_dot_pattern = tiled_boolean.tiled_boolean(rectangular_substrate_pattern, list(dots), 'xor', tile_size, max_workers)
+    return cell.add(new_dot_pattern)
 
 ###############################
-# DISPLAY PATTERNS
+# MAIN CODES
 ###############################
+# The layout itself is described in fab_pattern.json
 
-# Add all patterns to main cell
-
-# Hexagon
-main.add(hexagon_ref)
-
-### CFO = 0.05 um, BFO = 0.05 um ###
-main.add(rect_mat_cell_1)
-main.add(rect_mat_1a)
-
-### CFO = 0.05 um, BFO = 0.1 um ###
-main.add(rect_mat_cell_2)
-main.add(rect_mat_2a)
-
-### CFO = 0.05 um, BFO = 0.15 um ###
-main.add(rect_mat_cell_3)
-main.add(rect_mat_3a)
-
-### CFO = 0.1 um, BFO = 0.1 um ###
-main.add(rect_mat_cell_4)
-main.add(rect_mat_4a)
-
-### CFO = 0.1 um, BFO = 0.15 um ###
-main.add(rect_mat_cell_5)
-main.add(rect_mat_5a)
-
-### CFO = 0.1 um, BFO = 0.2 um ###
-main.add(rect_mat_cell_6)
-main.add(rect_mat_6a)
-
-### CFO = 0.1 um, BFO = 0.25 um ###
-main.add(rect_mat_cell_7)
-main.add(rect_mat_7a)
-
-# Dot pattern
-main.add(new_dot_pattern_6)
-
-# Save the library in a file called 'first.gds'.
-lib.write_gds("fab_pattern")
-
-# Optionally, save an image of the cell as SVG.
-main.write_svg('fab_pattern.svg')
-
-# Display all cells using the internal viewer.
-#gdspy.LayoutViewer()
-
-os._exit(00)
\ No newline at end of file
+def main(arguments = None):
+    """
+    Command line entry point: build the layout spec (default: fab_pattern.json) into the output directory.
+    arguments: list of command line arguments (default: sys.argv[1:])
+    Only the cells that changed since the last run are built again. The build modules are imported here and not at the
+    top of this file, so importing the builders stays cheap.
+    """
+    import argparse
+    import contextlib
+    import profiling
+    from layout_spec import build_spec, load_layout_spec
+    parser = argparse.ArgumentParser(description = 'Build a layout spec of PMMA patterns')
+    parser.add_argument('spec', nargs = '?', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fab_pattern.json'))
+    parser.add_argument('output_dir', nargs = '?', default = '.')
+    parser.add_argument('--cells', nargs = '+', default = None, help = 'build only these cells and the cells they reference')
+    parser.add_argument('--shallow', action = 'store_true', help = 'with --cells, build the polygons of the cells only, without their references')
+    parser.add_argument('--workers', type = int, default = None, help = 'number of processes (1: no process pool)')
+    parser.add_argument('--list', action = 'store_true', help = 'list the cells of the spec and exit')
+    parser.add_argument('--profile', default = None, help = 'write a profiling report to this JSON file')
+    arguments = parser.parse_args(arguments)
+    spec = load_layout_spec(arguments.spec)
+    if arguments.list:
+        for name, cell_spec in spec['cells'].items():
+            print(name, ' '.join(entry['recipe'] for entry in cell_spec.get('polygons', [])),
+                  ' '.join('{}({})'.format(entry['builder'], entry['cell']) for entry in cell_spec.get('references', [])))
+        return
+    with profiling.profiled(arguments.profile) if arguments.profile is not None else contextlib.nullcontext():
+        build_spec(spec, arguments.output_dir, max_workers = arguments.workers, cells = arguments.cells, shallow = arguments.shallow)
+
+if __name__ == '__main__':
+    # Usage: python PMMA_pattern.py [layout spec] [output directory] [--cells hexagon ...] [--shallow] [--workers n] [--list] [--profile report.json]
+    main()
+
+    # Display all cells using the internal viewer.
+    #gdspy.LayoutViewer()
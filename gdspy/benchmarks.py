@@ -0,0 +1,207 @@
+###############################
+# DESCRIPTION
+###############################
+## Benchmarks of the pattern builders of PMMA_pattern.py at three scales (small, medium, large),
+## and of write_gds, write_oas and write_svg on a layout made of the patterns of each scale.
+## Every case is timed (best of several runs) and its peak memory is measured with tracemalloc in a separate run.
+## The results are compared with a baseline saved by an earlier run on the same machine (--save), and the program
+## exits with status 1 when a case is slower or uses more memory than the baseline by more than the threshold.
+## The baseline belongs to the machine, not to the sources: it is kept in the user cache directory by default
+## (see default_baseline_path), and benchmark_baseline.json is ignored by git.
+## Usage: python benchmarks.py [--save] [--baseline benchmark_baseline.json] [--threshold 0.25] [--repeat 3] [--filter name]
+## The original recursive builders that do one boolean per dot grow quadratically, so they only run at the small scale.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import argparse
+import functools
+import gc
+import gdspy
+import json
+import numpy as np
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import PMMA_pattern
+from oasis import write_oas
+from polygon_store import new_polygon_store
+
+###############################
+# FUNCTIONS
+###############################
+
+# hexagon loops, dots per side, rectangle lines (horizontal, vertical), rotation angle step (0 to 90 degrees)
+SCALES = {'small': {'hexagon_loops': 10, 'dots': 11, 'lines': (20, 1), 'angle_step': 10},
+          'medium': {'hexagon_loops': 40, 'dots': 50, 'lines': (100, 10), 'angle_step': 1},
+          'large': {'hexagon_loops': 200, 'dots': 200, 'lines': (100, 100), 'angle_step': 0.25}}
+
+def new_cell(name):
+    return gdspy.Cell(name, exclude_from_current = True)
+
+def dot_substrate(dots):
+    "Return a substrate large enough for dots x dots dots of radius 0.05 with a spacing of 0.1"
+    return gdspy.Rectangle((-1, -1), (dots * 0.2 + 1, dots * 0.2 + 1))
+
+def rectangle_cell(lines):
+    "Return a cell with the rectangle matrix of rectangle_pattern, lines = (horizontal, vertical)"
+    cell = new_cell('rect')
+    PMMA_pattern.rectangle_pattern(0, 0, 1, 0.05, 0.1, 0.1, lines[0], lines[1], cell)
+    return cell
+
+@functools.lru_cache(maxsize = None)
+def layout_library(scale):
+    "Return a library with the patterns of one scale, built as in fab_pattern.json (once, for the write cases)"
+    parameters = SCALES[scale]
+    lib = gdspy.GdsLibrary()
+    main = new_cell('main')
+    hexagon = new_cell('hexagon')
+    hexagon.add(PMMA_pattern.hexagon_ring_pattern(0, 0, parameters['hexagon_loops'], 1, 0.05))
+    rect = rectangle_cell(parameters['lines'])
+    rect_mat = new_cell('rect_mat')
+    for cell in [main, hexagon, rect, rect_mat]:
+        lib.add(cell)
+    PMMA_pattern.rotation_cell_array(lib, rect_mat, rect, 0, 0, 1, 0, 90, parameters['angle_step'], 30, 30, 10)
+    PMMA_pattern.rotate_pattern(main, hexagon, 0, -60, 1, 0)
+    PMMA_pattern.rotate_pattern(main, rect_mat, 0, 0, 1, 0)
+    dots = parameters['dots']
+    main.add(PMMA_pattern.batched_dot_matrix(-20, -20, 0.05, 1e-4, 0.1, 0.1, dots, dots, dot_substrate(dots).translate(-20, -20), tile_size = 1))
+    return lib
+
+def benchmark_cases():
+    """
+    Return: a list of (name, setup); setup() prepares the inputs and returns the function to time
+    """
+    cases = []
+    for scale, parameters in SCALES.items():
+        loops = parameters['hexagon_loops']
+        dots = parameters['dots']
+        lines = parameters['lines']
+        step = parameters['angle_step']
+        cases.append(('hexagon_pattern/' + scale,
+                      lambda loops = loops: lambda: PMMA_pattern.hexagon_pattern(0, 0, loops, 1, 0.05, gdspy.PolygonSet([]))))
+        cases.append(('hexagon_pattern_store/' + scale,
+                      lambda loops = loops: lambda: PMMA_pattern.hexagon_pattern(0, 0, loops, 1, 0.05, new_polygon_store())))
+        cases.append(('hexagon_ring_pattern/' + scale,
+                      lambda loops = loops: lambda: PMMA_pattern.hexagon_ring_pattern(0, 0, loops, 1, 0.05)))
+        if scale == 'small':
+            cases.append(('horizontal_dot_matrix/' + scale,
+                          lambda dots = dots: lambda: PMMA_pattern.horizontal_dot_matrix(0, 0, 0.05, 1e-4, 0.1, 0.1, dots, dots, dot_substrate(dots))))
+        cases.append(('batched_dot_matrix/' + scale,
+                      lambda dots = dots: lambda: PMMA_pattern.batched_dot_matrix(0, 0, 0.05, 1e-4, 0.1, 0.1, dots, dots, dot_substrate(dots), tile_size = 1)))
+        cases.append(('rectangle_pattern/' + scale,
+                      lambda lines = lines: lambda: rectangle_cell(lines)))
+        cases.append(('rectangle_pattern_store/' + scale,
+                      lambda lines = lines: lambda: PMMA_pattern.rectangle_pattern(0, 0, 1, 0.05, 0.1, 0.1, lines[0], lines[1], new_polygon_store())))
+        cases.append(('rectangle_cell_array/' + scale,
+                      lambda lines = lines: lambda: PMMA_pattern.rectangle_cell_array(0, 0, 1, 0.05, 0.1, 0.1, lines[0], lines[1], new_cell('rect'), new_cell('unit'))))
+        cases.append(('rotation_matrix/' + scale,
+                      lambda step = step: lambda: PMMA_pattern.rotation_matrix(new_cell('rect_mat'), new_cell('rect'), 0, 0, 1, 0, 90, step, 30, 30, 10)))
+        cases.append(('rotation_cell_array/' + scale,
+                      lambda step = step: lambda: PMMA_pattern.rotation_cell_array(gdspy.GdsLibrary(), new_cell('rect_mat'), new_cell('rect'), 0, 0, 1, 0, 90, step, 30, 30, 10)))
+        cases.append(('write_gds/' + scale, lambda scale = scale: write_case(scale, 'gds')))
+        cases.append(('write_oas/' + scale, lambda scale = scale: write_case(scale, 'oas')))
+        cases.append(('write_svg/' + scale, lambda scale = scale: write_case(scale, 'svg')))
+    return cases
+
+def write_case(scale, output):
+    "Return the function writing the layout of one scale to a temporary GDS, OASIS or SVG file"
+    lib = layout_library(scale)
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.' + output)
+    if output == 'gds':
+        return lambda: lib.write_gds(path)
+    if output == 'oas':
+        return lambda: write_oas(lib, path)
+    return lambda: lib.cells['main'].write_svg(path)
+
+def run_case(setup, repeat = 3, min_time = 0.2):
+    """
+    Return: {'time': best time of the runs in s, 'peak_memory_mb': peak memory of one more run traced with tracemalloc}
+    The case runs at least repeat times and until min_time seconds have been spent, so that short cases are stable.
+    """
+    run = setup()
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    while len(times) < repeat or sum(times) < min_time:
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {'time': min(times), 'peak_memory_mb': peak / 2**20}
+
+def environment():
+    "Return the versions the results depend on"
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'gdspy': gdspy.__version__,
+            'machine': platform.machine(), 'processor': platform.processor()}
+
+def default_baseline_path():
+    "Return the path of the baseline in the user cache directory ($XDG_CACHE_HOME or ~/.cache)"
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'pmma_pattern', 'benchmark_baseline.json')
+
+def compare(results, baseline, threshold):
+    """
+    results, baseline: {case name: {'time': ..., 'peak_memory_mb': ...}}
+    threshold: allowed relative increase, e.g. 0.25 for 25 %
+
+    Return: the list of regressions as text
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for measure in ['time', 'peak_memory_mb']:
+            # Tiny values are dominated by noise
+            floor = 0.01 if measure == 'time' else 0.1
+            reference = max(baseline[name][measure], floor)
+            if result[measure] > reference * (1 + threshold):
+                regressions.append('{} {}: {:.4g} -> {:.4g} (+{:.0f} %)'.format(name, measure, baseline[name][measure],
+                                                                             result[measure], 100 * (result[measure] / reference - 1)))
+    return regressions
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks of the pattern builders')
+    parser.add_argument('--baseline', default = default_baseline_path(), help = 'baseline file (default: %(default)s)')
+    parser.add_argument('--save', action = 'store_true', help = 'save the results as the new baseline')
+    parser.add_argument('--threshold', type = float, default = 0.25, help = 'allowed relative regression')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--filter', default = '', help = 'only run the cases whose name contains this text')
+    arguments = parser.parse_args()
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baseline_file:
+            stored = json.load(baseline_file)
+        baseline = stored['results']
+        if stored['environment'] != environment():
+            print('Warning: the baseline was measured with {}'.format(stored['environment']))
+    results = {}
+    for name, setup in benchmark_cases():
+        if arguments.filter not in name:
+            continue
+        results[name] = run_case(setup, arguments.repeat)
+        reference = baseline.get(name)
+        print('{:32s} {:10.4f} s {:10.2f} MB'.format(name, results[name]['time'], results[name]['peak_memory_mb'])
+              + ('' if reference is None else '   baseline {:10.4f} s {:10.2f} MB'.format(reference['time'], reference['peak_memory_mb'])))
+    regressions = compare(results, baseline, arguments.threshold)
+    if arguments.save:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(arguments.baseline)), exist_ok = True)
+        with open(arguments.baseline, 'w') as baseline_file:
+            json.dump({'environment': environment(), 'results': baseline}, baseline_file, indent = 2)
+    for regression in regressions:
+        print('Regression: ' + regression)
+    sys.exit(1 if regressions else 0)
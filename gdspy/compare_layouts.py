@@ -0,0 +1,190 @@
+###############################
+# DESCRIPTION
+###############################
+## Geometric equivalence check of two layouts, e.g. the GDS files written before and after optimizing a builder.
+## The same cells of both layouts (see default_cells, or --cell) are flattened per (layer, datatype) and compared in two steps:
+##   + polygons that are identical in both layouts (same vertices on the database grid, whatever the first vertex and
+##     the orientation) are matched with a hash of their edges, vectorized over all the polygons
+##   + the polygons left are compared with a XOR computed in tiles, in parallel (see tiled_boolean.py), minus the matched
+##     polygons that cover them; differences thinner than the tolerance are ignored (the XOR is shrunk by the tolerance)
+## so two identical layouts are compared without any boolean operation, and a difference only costs the tiles it touches.
+## The shrink is computed on a grid 10 times finer than the comparison grid (the smaller of the tolerance and the database
+## unit): on that grid, the slivers left by rounding the vertices of the dots to the database unit (1e-3 um) could round
+## back to a non-empty polygon, and be reported at the default tolerance of 1e-3 although they are thinner than it.
+## Usage: python compare_layouts.py old.gds new.gds [--cell main] [--tolerance 0.001] [--tile-size 5] [--workers n] [--report diff.json]
+## Without --cell, all the top cells are compared when both files have the same ones (see default_cells).
+## The exit status is 1 when the layouts differ, so the check can run before every commit.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import argparse
+import gdspy
+import json
+import numpy as np
+import sys
+from tiled_boolean import bounding_boxes, run_tile_tasks, tile_grid, tile_tasks
+
+###############################
+# FUNCTIONS
+###############################
+
+def default_cells(lib1, lib2):
+    """
+    Return the names of the cells to compare when none is given: the top cell present in both libraries, the cell of
+    both libraries when each one has a single top cell, or all the top cells when both libraries have the same ones.
+    Raise a ValueError when this is ambiguous.
+    """
+    top_names1 = [cell.name for cell in lib1.top_level() if isinstance(cell, gdspy.Cell)]
+    top_names2 = [cell.name for cell in lib2.top_level() if isinstance(cell, gdspy.Cell)]
+    common = [name for name in top_names1 if name in top_names2]
+    if len(common) == 1:
+        return common
+    if len(common) == 0 and len(top_names1) == 1 and len(top_names2) == 1 and top_names1[0] in lib2.cells:
+        return top_names1
+    if len(common) > 1 and sorted(top_names1) == sorted(top_names2):
+        return sorted(common)
+    raise ValueError("Cannot choose the cell to compare (top cells {} and {}): give it with --cell".format(top_names1, top_names2))
+
+def flattened_layers(lib, cell_name):
+    "Return the polygons of a cell of the library, flattened, as {(layer, datatype): [vertex arrays]}"
+    if cell_name not in lib.cells:
+        raise ValueError("Cell '{}' is missing from one of the layouts".format(cell_name))
+    return lib.cells[cell_name].get_polygons(by_spec = True)
+
+def polygon_hashes(polygons, grid):
+    """
+    Return a 64-bit hash per polygon, computed from its vertices rounded to the grid.
+    The hash is a sum over the edges, so it does not depend on the first vertex, and the edges of clockwise polygons
+    are reversed first, so it does not depend on the orientation either.
+    """
+    if len(polygons) == 0:
+        return np.zeros(0, dtype = np.uint64)
+    counts = np.array([len(points) for points in polygons])
+    points = np.round(np.concatenate(polygons) / grid).astype(np.int64)
+    starts = np.cumsum(counts) - counts
+    next_vertex = np.arange(len(points)) + 1
+    next_vertex[starts + counts - 1] = starts
+    x0, y0 = points[:, 0], points[:, 1]
+    x1, y1 = points[next_vertex, 0], points[next_vertex, 1]
+    clockwise = np.repeat(np.add.reduceat(x0 * y1 - x1 * y0, starts) < 0, counts)
+    x0, y0, x1, y1 = np.where(clockwise, x1, x0), np.where(clockwise, y1, y0), np.where(clockwise, x0, x1), np.where(clockwise, y0, y1)
+    # Mix the 4 coordinates of every edge into 64 bits (wrapping multiplications), then add the edges of each polygon
+    edge_hash = np.zeros(len(points), dtype = np.uint64)
+    for coordinate, multiplier in zip([x0, y0, x1, y1], [0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9, 0xd6e8feb86659fd93]):
+        edge_hash = (edge_hash ^ coordinate.astype(np.uint64)) * np.uint64(multiplier)
+        edge_hash ^= edge_hash >> np.uint64(29)
+    return np.add.reduceat(edge_hash, starts)
+
+def unmatched_polygons(polygons1, polygons2, grid):
+    "Return the indices of the polygons of each layout whose hash is not found the same number of times in the other one"
+    hashes1 = polygon_hashes(polygons1, grid)
+    hashes2 = polygon_hashes(polygons2, grid)
+    values, inverse, counts = np.unique(np.concatenate((hashes1, hashes2)), return_inverse = True, return_counts = True)
+    counts1 = np.bincount(inverse[:len(hashes1)], minlength = len(values))
+    differing = counts1 * 2 != counts
+    return np.flatnonzero(differing[inverse[:len(hashes1)]]), np.flatnonzero(differing[inverse[len(hashes1):]])
+
+def difference_regions(pieces, tolerance, precision):
+    "Return the bounding boxes [x_min, y_min, x_max, y_max] and areas of the XOR pieces that do not vanish when shrunk by the tolerance"
+    regions = []
+    for points in pieces:
+        if tolerance > 0 and gdspy.offset([points], -tolerance, precision = precision / 10) is None:
+            continue
+        area = abs(0.5 * np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1]))
+        regions.append({'box': points.min(axis = 0).tolist() + points.max(axis = 0).tolist(), 'area': area})
+    return regions
+
+def remove_matched(pieces, matched, precision):
+    """
+    pieces: XOR pieces of the unmatched polygons of a tile
+    matched: polygons found in both layouts
+
+    Return: the pieces minus the matched polygons touching them (a part of an unmatched polygon covered by a matched
+    polygon is covered in both layouts, so it is not a difference)
+    """
+    if len(pieces) == 0 or len(matched) == 0:
+        return pieces
+    lower, upper = bounding_boxes(matched)
+    piece_lower, piece_upper = bounding_boxes(pieces)
+    near = np.all((upper >= piece_lower.min(axis = 0)) & (lower <= piece_upper.max(axis = 0)), axis = 1)
+    if not np.any(near):
+        return pieces
+    result = gdspy.boolean(pieces, [matched[i] for i in np.flatnonzero(near)], 'not', precision = precision, max_points = 0)
+    return [] if result is None else result.polygons
+
+def compare_layouts(layers1, layers2, tolerance = 1e-3, tile_size = 5, max_workers = None, grid = 1e-3):
+    """
+    layers1, layers2: flattened layouts {(layer, datatype): [vertex arrays]} (see flattened_layers)
+    tolerance: differences thinner than this are ignored
+    grid: database unit of the layouts, used to match identical polygons
+
+    Return: the report {'equivalent': bool, 'unmatched_polygons': {layer/datatype: (first, second)}, 'regions': [...]},
+    every region being {'layer': ..., 'datatype': ..., 'box': [x_min, y_min, x_max, y_max], 'area': ...}
+    """
+    tasks = []
+    task_layers = []
+    matched = {}
+    unmatched_counts = {}
+    precision = min(grid, tolerance) if tolerance > 0 else grid
+    for key in sorted(set(layers1) | set(layers2)):
+        polygons1 = layers1.get(key, [])
+        polygons2 = layers2.get(key, [])
+        unmatched1, unmatched2 = unmatched_polygons(polygons1, polygons2, grid)
+        if len(unmatched1) + len(unmatched2) == 0:
+            continue
+        unmatched_counts['{}/{}'.format(*key)] = (len(unmatched1), len(unmatched2))
+        # The polygons found in both layouts cancel out in the XOR: only the unmatched ones are compared, in the tiles they touch
+        unmatched = [polygons1[i] for i in unmatched1] + [polygons2[i] for i in unmatched2]
+        lower, upper = bounding_boxes(unmatched)
+        tiles = tile_grid(lower[:, 0].min(), lower[:, 1].min(), upper[:, 0].max(), upper[:, 1].max(), tile_size, precision)
+        layer_tasks = tile_tasks([polygons1[i] for i in unmatched1], [polygons2[i] for i in unmatched2], 'xor', tiles, precision, max_points = 0)
+        tasks.extend(layer_tasks)
+        task_layers.extend([key] * len(layer_tasks))
+        is_matched = np.ones(len(polygons1), dtype = bool)
+        is_matched[unmatched1] = False
+        matched[key] = [polygons1[i] for i in np.flatnonzero(is_matched)]
+    regions = []
+    for key, pieces in zip(task_layers, run_tile_tasks(tasks, max_workers)):
+        for region in difference_regions(remove_matched(pieces, matched[key], precision), tolerance, precision):
+            regions.append({'layer': int(key[0]), 'datatype': int(key[1]), **region})
+    return {'equivalent': len(regions) == 0, 'unmatched_polygons': unmatched_counts, 'regions': regions}
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Geometric equivalence check of two GDS files')
+    parser.add_argument('first')
+    parser.add_argument('second')
+    parser.add_argument('--cell', default = None, help = 'cell to compare (default: the top cells of both files, see default_cells)')
+    parser.add_argument('--tolerance', type = float, default = 1e-3)
+    parser.add_argument('--tile-size', type = float, default = 5)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--report', default = None, help = 'write the report to this JSON file')
+    arguments = parser.parse_args()
+    lib1 = gdspy.GdsLibrary(infile = arguments.first)
+    lib2 = gdspy.GdsLibrary(infile = arguments.second)
+    try:
+        cell_names = [arguments.cell] if arguments.cell is not None else default_cells(lib1, lib2)
+        layouts = [(cell_name, flattened_layers(lib1, cell_name), flattened_layers(lib2, cell_name)) for cell_name in cell_names]
+    except ValueError as error:
+        parser.error(str(error))
+    report = {'equivalent': True, 'cells': {}, 'regions': []}
+    for cell_name, layers1, layers2 in layouts:
+        cell_report = compare_layouts(layers1, layers2, arguments.tolerance, arguments.tile_size, arguments.workers)
+        report['equivalent'] = report['equivalent'] and cell_report['equivalent']
+        report['cells'][cell_name] = cell_report['unmatched_polygons']
+        report['regions'].extend(dict(region, cell = cell_name) for region in cell_report['regions'])
+    if arguments.report is not None:
+        with open(arguments.report, 'w') as report_file:
+            json.dump(report, report_file, indent = 1)
+    for region in report['regions']:
+        print('Difference in {} on layer {}/{}: box ({:.4f}, {:.4f}) - ({:.4f}, {:.4f}), area {:.6g}'.format(
+            region['cell'], region['layer'], region['datatype'], *region['box'], region['area']))
+    print('Equivalent' if report['equivalent'] else '{} differing regions'.format(len(report['regions'])))
+    sys.exit(0 if report['equivalent'] else 1)
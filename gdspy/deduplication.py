@@ -0,0 +1,162 @@
+###############################
+# DESCRIPTION
+###############################
+## Canonicalization pass on a built library, run before writing it:
+##   + repeated polygons: the polygons of a cell that are identical up to a translation (same layer, datatype and shape,
+##     after rounding to the database unit) are moved to a shape cell shared by the whole library, e.g. 'shape_3fa2c1d09b',
+##     and replaced by references; regular rows and grids of them become one CellArray
+##   + identical cells: every cell gets a hash of its geometry (polygons, references and labels) relative to its lower-left
+##     corner; of the cells with the same hash, the one with the first name in alphabetical order is kept (unless an
+##     identical top cell comes first in the hierarchy order, which is kept instead), the others are removed and their references point to the cell kept with
+##     their origin moved by the translation between the two
+## Cells are handled from the bottom of the hierarchy up, so cells that only differ by merged sub-cells are merged too.
+## Cells that are not referenced (top cells) are never removed. The flattened geometry is unchanged (to the database unit).
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import hashlib
+import numpy as np
+from hierarchy import reference_matrix, regular_arrays
+
+###############################
+# FUNCTIONS
+###############################
+
+def bottom_up_cells(lib):
+    "Return the cells of the library, every cell after the cells it references"
+    ordered = []
+    visited = set()
+    def visit(cell):
+        if cell.name in visited:
+            return
+        visited.add(cell.name)
+        for reference in cell.references:
+            if isinstance(reference.ref_cell, gdspy.Cell):
+                visit(reference.ref_cell)
+        ordered.append(cell)
+    for cell in list(lib.cells.values()):
+        visit(cell)
+    return ordered
+
+def shape_cell(lib, layer, datatype, points, scale):
+    """
+    points: integer vertices in database units, relative to the lower-left corner of the polygon
+
+    Return: the cell holding this polygon alone, created in lib the first time and shared afterwards
+    """
+    name = 'shape_' + hashlib.sha1(np.array([layer, datatype], dtype = np.int64).tobytes() + points.tobytes()).hexdigest()[:10]
+    if name not in lib.cells:
+        cell = gdspy.Cell(name, exclude_from_current = True)
+        cell.add(gdspy.Polygon(points / scale, layer = layer, datatype = datatype))
+        lib.add(cell)
+    return lib.cells[name]
+
+def extract_repeated_polygons(lib, cell, scale, min_count = 2):
+    """
+    Replace the polygons of cell that occur at least min_count times (identical up to a translation) by references to
+    shape cells (see shape_cell); every regular array of them (see hierarchy.regular_arrays) becomes one CellArray.
+
+    Return: the number of polygons replaced
+    """
+    groups = {}
+    for polygon_set in cell.polygons:
+        for points, layer, datatype in zip(polygon_set.polygons, polygon_set.layers, polygon_set.datatypes):
+            integer_points = np.round(points * scale).astype(np.int64)
+            corner = integer_points.min(axis = 0)
+            key = (layer, datatype, (integer_points - corner).tobytes())
+            groups.setdefault(key, []).append((id(points), corner))
+    extracted = set()
+    references = []
+    for (layer, datatype, shape), members in groups.items():
+        if len(members) < min_count:
+            continue
+        shape_points = np.frombuffer(shape, dtype = np.int64).reshape(-1, 2)
+        shape = shape_cell(lib, layer, datatype, shape_points, scale)
+        extracted.update(member_id for member_id, corner in members)
+        for x, y, x_spacing, number_of_columns, y_spacing, number_of_rows in regular_arrays([corner for member_id, corner in members]):
+            origin = (x / scale, y / scale)
+            if number_of_columns * number_of_rows == 1:
+                references.append(gdspy.CellReference(shape, origin))
+            else:
+                references.append(gdspy.CellArray(shape, number_of_columns, number_of_rows, (x_spacing / scale, y_spacing / scale), origin))
+    if len(extracted) > 0:
+        cell.remove_polygons(lambda points, layer, datatype: id(points) in extracted)
+        cell.add(references)
+    return len(extracted)
+
+def cell_signature(cell, scale):
+    """
+    Return: (hash, corner); hash is the same for two cells whose polygons, references and labels are identical up to
+    a translation, and corner (integer, database units) is the lower-left corner the geometry was taken relative to
+    """
+    polygons = []
+    for polygon_set in cell.polygons:
+        for points, layer, datatype in zip(polygon_set.polygons, polygon_set.layers, polygon_set.datatypes):
+            polygons.append((layer, datatype, np.round(points * scale).astype(np.int64)))
+    for path in cell.paths:
+        for (layer, datatype), path_polygons in path.get_polygons(by_spec = True).items():
+            polygons.extend((layer, datatype, np.round(points * scale).astype(np.int64)) for points in path_polygons)
+    origins = [np.round(np.array(reference.origin, dtype = float) * scale).astype(np.int64) for reference in cell.references]
+    positions = [np.round(np.array(label.position) * scale).astype(np.int64) for label in cell.labels]
+    corners = [points.min(axis = 0) for layer, datatype, points in polygons] + origins + positions
+    corner = np.min(corners, axis = 0) if len(corners) > 0 else np.zeros(2, dtype = np.int64)
+    items = sorted(repr((layer, datatype, (points - corner).tolist())) for layer, datatype, points in polygons)
+    for reference, origin in zip(cell.references, origins):
+        name = reference.ref_cell.name if isinstance(reference.ref_cell, gdspy.Cell) else reference.ref_cell
+        array = (reference.columns, reference.rows, tuple(np.round(np.array(reference.spacing) * scale).astype(np.int64).tolist())) if isinstance(reference, gdspy.CellArray) else None
+        items.append(repr(('reference', name, reference.rotation, reference.magnification, bool(reference.x_reflection), (origin - corner).tolist(), array)))
+    for label, position in zip(cell.labels, positions):
+        items.append(repr(('label', label.text, label.layer, label.texttype, label.anchor, label.rotation, label.magnification, bool(label.x_reflection), (position - corner).tolist())))
+    return hashlib.sha256('\n'.join(sorted(items)).encode()).hexdigest(), corner
+
+def redirect_references(lib, removed, kept, offset):
+    "Point the references to the cell removed to the cell kept instead, moving their origin by offset (kept = removed - offset)"
+    for cell in lib.cells.values():
+        if not any(reference.ref_cell is removed for reference in cell.references):
+            continue
+        references = cell.references
+        cell.references = []
+        for reference in references:
+            if reference.ref_cell is removed:
+                shift = reference_matrix(reference.rotation, reference.magnification, reference.x_reflection) @ offset
+                reference.ref_cell = kept
+                reference.origin = tuple(np.array(reference.origin, dtype = float) + shift)
+        # Added back in the same order with Cell.add, which also invalidates the bounding box gdspy caches for the cell
+        cell.add(references)
+
+def deduplicate_library(lib, min_count = 2):
+    """
+    Run the canonicalization pass described at the top of this file on lib (modified in place).
+    min_count: number of copies from which repeated polygons are moved to a shape cell (0 to leave the polygons as they are)
+
+    Return: {'extracted_polygons': number of polygons replaced by references, 'merged_cells': {removed cell: cell kept}}
+    """
+    scale = lib.unit / lib.precision
+    extracted = 0
+    if min_count > 0:
+        for cell in list(lib.cells.values()):
+            if not cell.name.startswith('shape_'):
+                extracted += extract_repeated_polygons(lib, cell, scale, min_count)
+    referenced = {reference.ref_cell.name for cell in lib.cells.values() for reference in cell.references if isinstance(reference.ref_cell, gdspy.Cell)}
+    signatures = {}
+    merged = {}
+    for cell in bottom_up_cells(lib):
+        signature, corner = cell_signature(cell, scale)
+        if signature not in signatures or cell.name not in referenced:
+            signatures.setdefault(signature, (cell, corner))
+            continue
+        kept, kept_corner = signatures[signature]
+        if kept.name in referenced and cell.name < kept.name:
+            # The cell kept is the one with the first name, whatever the order of the library
+            cell, corner, kept, kept_corner = kept, kept_corner, cell, corner
+            signatures[signature] = (kept, kept_corner)
+            merged = {name: kept.name if kept_name == cell.name else kept_name for name, kept_name in merged.items()}
+        redirect_references(lib, cell, kept, (corner - kept_corner) / scale)
+        lib.remove(cell, remove_references = False)
+        merged[cell.name] = kept.name
+    return {'extracted_polygons': extracted, 'merged_cells': merged}
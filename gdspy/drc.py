@@ -0,0 +1,267 @@
+###############################
+# DESCRIPTION
+###############################
+## Design-rule check of the PMMA process limits: minimum width, minimum spacing and overlaps.
+## The cell is flattened (references and arrays included, with their rotations), and every layer is checked on its own.
+## The edges are cut into short pieces put into a uniform grid hash with cells a few times the checked distance, so only the
+## edges in neighbouring grid cells are compared, and the distances are computed with NumPy on all the pairs at once.
+##   + width: two facing edges of the same polygon closer than min_width, with the polygon between them
+##   + spacing: two facing edges closer than min_spacing, with empty space between them (also notches of one polygon)
+##   + overlap: two polygons of the same layer whose edges cross, or one inside the other
+## Each rule gives at most one violation per pair of polygons, at their narrowest gap.
+## Edges lying on another edge of the same layer in the opposite direction (cut lines of polygons with holes,
+## borders between fractured pieces) are inside the layer, so they are left out of the checks.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import json
+import numpy as np
+import sys
+
+###############################
+# FUNCTIONS
+###############################
+
+def polygon_edges(polygons):
+    """
+    polygons: list of vertex arrays
+
+    Return: dictionary of edge arrays
+        + start, end: end points of the edges, shape (number of edges, 2)
+        + normal: unit outward normal of every edge
+        + polygon: index of the polygon of every edge
+        + next, previous: index of the following and preceding edge of the same polygon
+    """
+    counts = np.array([len(points) for points in polygons])
+    start = np.concatenate(polygons)
+    polygon = np.repeat(np.arange(len(polygons)), counts)
+    ends = np.cumsum(counts)
+    next_vertex = np.arange(1, len(start) + 1)
+    next_vertex[ends - 1] = ends - counts
+    end = start[next_vertex]
+    # Signed area of every polygon, to orient the normals outwards
+    cross = start[:, 0] * end[:, 1] - end[:, 0] * start[:, 1]
+    orientation = np.sign(np.add.reduceat(cross, ends - counts))[polygon]
+    direction = end - start
+    length = np.maximum(np.linalg.norm(direction, axis = 1), 1e-300)
+    normal = orientation[:, None] * np.stack((direction[:, 1], -direction[:, 0]), axis = 1) / length[:, None]
+    previous = np.empty_like(next_vertex)
+    previous[next_vertex] = np.arange(len(start))
+    return {'start': start, 'end': end, 'normal': normal, 'polygon': polygon, 'next': next_vertex, 'previous': previous}
+
+def grid_hash(lower, upper, cell_size):
+    """
+    Spatial index of boxes on a uniform grid: every box is entered in all the grid cells it touches.
+
+    Return: (grid cell keys, box indices) of the entries sorted by key, and the function giving the keys of points
+    (the key of the neighbouring cell (column + c, row + r) is key + r * row_stride + c)
+    """
+    first = np.floor(lower / cell_size).astype(np.int64)
+    last = np.floor(upper / cell_size).astype(np.int64)
+    origin = first.min(axis = 0) - 1
+    row_stride = last[:, 0].max() - origin[0] + 2
+    spans = last - first + 1
+    number_of_cells = spans[:, 0] * spans[:, 1]
+    box = np.repeat(np.arange(len(lower)), number_of_cells)
+    position = np.arange(len(box)) - np.repeat(np.cumsum(number_of_cells) - number_of_cells, number_of_cells)
+    column = first[box, 0] + position % spans[box, 0] - origin[0]
+    row = first[box, 1] + position // spans[box, 0] - origin[1]
+    keys = row * row_stride + column
+    order = np.argsort(keys, kind = 'stable')
+    def point_keys(points):
+        cells = np.floor(points / cell_size).astype(np.int64) - origin
+        return cells[:, 1] * row_stride + cells[:, 0]
+    return keys[order], box[order], point_keys, row_stride
+
+def candidate_pairs(lower, upper, cell_size, max_pairs = 2**22):
+    """
+    Yield arrays (i, j) with i < j of the boxes that are in the same or neighbouring grid cells, max_pairs at a time.
+    Every pair of boxes closer than cell_size is yielded at least once.
+    """
+    keys, boxes, point_keys, row_stride = grid_hash(lower, upper, cell_size)
+    for column_offset, row_offset in [(0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]:
+        targets = keys + row_offset * row_stride + column_offset
+        first = np.searchsorted(keys, targets)
+        count = np.searchsorted(keys, targets, side = 'right') - first
+        total = np.cumsum(count)
+        start = 0
+        while start < len(keys):
+            stop = max(np.searchsorted(total, total[start] - count[start] + max_pairs, side = 'right'), start + 1)
+            chunk_count = count[start:stop]
+            i = np.repeat(boxes[start:stop], chunk_count)
+            j = boxes[np.repeat(first[start:stop], chunk_count) + np.arange(len(i)) - np.repeat(np.cumsum(chunk_count) - chunk_count, chunk_count)]
+            keep = i != j
+            yield np.minimum(i[keep], j[keep]), np.maximum(i[keep], j[keep])
+            start = stop
+
+def edge_pieces(start, end, length):
+    """
+    Split the edges into pieces not longer than length, so that long edges are entered in the grid cells along them
+    instead of all the cells of their bounding box.
+
+    Return: the middle points of the pieces and the index of the edge of every piece
+    """
+    number_of_pieces = np.maximum(np.ceil(np.linalg.norm(end - start, axis = 1) / length), 1).astype(np.int64)
+    edge = np.repeat(np.arange(len(start)), number_of_pieces)
+    position = np.arange(len(edge)) - np.repeat(np.cumsum(number_of_pieces) - number_of_pieces, number_of_pieces)
+    step = (end - start)[edge] / number_of_pieces[edge, None]
+    return start[edge] + (position[:, None] + 0.5) * step, edge
+
+def first_of_runs(values):
+    "Return the indices of the first element of every run of equal values in a sorted array (faster than np.unique)"
+    return np.flatnonzero(np.concatenate((np.ones(min(len(values), 1), dtype = bool), values[1:] != values[:-1])))
+
+def segment_distances(a0, a1, b0, b1):
+    """
+    Return: (distance between the segments a0-a1 and b0-b1, vector from the closest point of a to the closest point of b,
+    whether the segments cross at a point inside both), for arrays of segments
+    """
+    def closest(p, q0, q1):
+        direction = q1 - q0
+        t = np.clip(np.sum((p - q0) * direction, axis = 1) / np.maximum(np.sum(direction**2, axis = 1), 1e-300), 0, 1)
+        return q0 + t[:, None] * direction
+    candidates = [(a0, closest(a0, b0, b1)), (a1, closest(a1, b0, b1)), (closest(b0, a0, a1), b0), (closest(b1, a0, a1), b1)]
+    vectors = np.stack([q - p for p, q in candidates])
+    distances = np.linalg.norm(vectors, axis = 2)
+    best = np.argmin(distances, axis = 0)
+    index = np.arange(len(a0))
+    def side(p, q0, q1):
+        return np.sign((q1[:, 0] - q0[:, 0]) * (p[:, 1] - q0[:, 1]) - (q1[:, 1] - q0[:, 1]) * (p[:, 0] - q0[:, 0]))
+    crossing = (side(a0, b0, b1) * side(a1, b0, b1) < 0) & (side(b0, a0, a1) * side(b1, a0, a1) < 0)
+    distance = np.where(crossing, 0.0, distances[best, index])
+    return distance, vectors[best, index], crossing
+
+def points_in_polygons(points, polygon_index, edges, counts, first_edge):
+    "Return whether points[k] is inside polygon polygon_index[k] (even-odd rule), for arrays of points"
+    number = counts[polygon_index]
+    pair = np.repeat(np.arange(len(points)), number)
+    edge = np.repeat(first_edge[polygon_index], number) + np.arange(len(pair)) - np.repeat(np.cumsum(number) - number, number)
+    p = points[pair]
+    a = edges['start'][edge]
+    b = edges['end'][edge]
+    straddles = (a[:, 1] > p[:, 1]) != (b[:, 1] > p[:, 1])
+    x_cross = a[:, 0] + (p[:, 1] - a[:, 1]) * (b[:, 0] - a[:, 0]) / np.where(straddles, b[:, 1] - a[:, 1], 1)
+    crossings = np.bincount(pair, weights = straddles & (x_cross > p[:, 0]), minlength = len(points))
+    return crossings % 2 == 1
+
+def check_layer(polygons, min_width = 0.05, min_spacing = 0.05, tolerance = 1e-6):
+    """
+    polygons: list of vertex arrays of one layer
+
+    Return: list of violations (rule, x, y, distance); x, y is the middle of the violation, distance is 0 for overlaps
+    """
+    edges = polygon_edges(polygons)
+    reach = max(min_width, min_spacing)
+    # Pieces of length 2 reach closer than reach have their middle points closer than 3 reach
+    piece_middle, piece_edge = edge_pieces(edges['start'], edges['end'], 2 * reach)
+    lower = np.minimum(edges['start'], edges['end'])
+    upper = np.maximum(edges['start'], edges['end'])
+    close = []
+    for i, j in candidate_pairs(piece_middle, piece_middle, 3 * reach):
+        i = piece_edge[i]
+        j = piece_edge[j]
+        # Long edges close to each other meet through many pieces; their distance is computed once
+        pair = np.sort(np.minimum(i, j) * len(edges['start']) + np.maximum(i, j))
+        pair = pair[first_of_runs(pair)]
+        i, j = pair // len(edges['start']), pair % len(edges['start'])
+        # Cheap test on the bounding boxes before the exact distances
+        gap = np.maximum(np.maximum(lower[i] - upper[j], lower[j] - upper[i]), 0)
+        near = (i != j) & (np.sum(gap**2, axis = 1) < reach**2)
+        i, j = i[near], j[near]
+        distance, vector, crossing = segment_distances(edges['start'][i], edges['end'][i], edges['start'][j], edges['end'][j])
+        adjacent = (edges['next'][i] == j) | (edges['previous'][i] == j)
+        keep = (distance < reach) & ~adjacent
+        close.append((i[keep], j[keep], distance[keep], vector[keep], crossing[keep]))
+    i, j, distance, vector, crossing = [np.concatenate(values) for values in zip(*close)]
+    # The same pair can come from several grid cells
+    pair = i * len(edges['start']) + j
+    order = np.argsort(pair, kind = 'stable')
+    unique = order[first_of_runs(pair[order])]
+    i, j, distance, vector, crossing = i[unique], j[unique], distance[unique], vector[unique], crossing[unique]
+    facing = np.sum(edges['normal'][i] * edges['normal'][j], axis = 1)
+    internal = np.zeros(len(edges['start']), dtype = bool)
+    on_top = (distance < tolerance) & (facing < -1 + 1e-6) & ~crossing
+    internal[i[on_top]] = True
+    internal[j[on_top]] = True
+    checked = ~internal[i] & ~internal[j] & (facing < 0) & (distance > tolerance)
+    outward_i = np.sum(vector * edges['normal'][i], axis = 1)
+    outward_j = np.sum(vector * edges['normal'][j], axis = 1)
+    same_polygon = edges['polygon'][i] == edges['polygon'][j]
+    width = checked & same_polygon & (distance < min_width - tolerance) & (outward_i < 0) & (outward_j > 0)
+    spacing = checked & (distance < min_spacing - tolerance) & (outward_i > 0) & (outward_j < 0)
+    results = []
+    for rule, selected in [('width', width), ('spacing', spacing)]:
+        # One violation per pair of polygons, at the middle of the narrowest gap
+        selected = np.flatnonzero(selected)
+        polygon_pair = np.minimum(edges['polygon'][i], edges['polygon'][j])[selected] * len(polygons) + np.maximum(edges['polygon'][i], edges['polygon'][j])[selected]
+        order = np.lexsort((distance[selected], polygon_pair))
+        k = selected[order][first_of_runs(polygon_pair[order])]
+        a0, a1 = edges['start'][i[k]], edges['end'][i[k]]
+        b0, b1 = edges['start'][j[k]], edges['end'][j[k]]
+        t = np.clip(np.sum(((b0 + b1) / 2 - a0) * (a1 - a0), axis = 1) / np.maximum(np.sum((a1 - a0)**2, axis = 1), 1e-300), 0, 1)
+        location = a0 + t[:, None] * (a1 - a0) + vector[k] / 2
+        results.extend((rule, x, y, value) for (x, y), value in zip(location.tolist(), distance[k].tolist()))
+    # Overlaps: crossing edges of two polygons, or a polygon inside another one
+    crossing_pairs = crossing & ~same_polygon
+    overlapping = set(zip(np.minimum(edges['polygon'][i], edges['polygon'][j])[crossing_pairs].tolist(),
+                          np.maximum(edges['polygon'][i], edges['polygon'][j])[crossing_pairs].tolist()))
+    counts = np.array([len(points) for points in polygons])
+    first_edge = np.cumsum(counts) - counts
+    polygon_lower = np.minimum.reduceat(edges['start'], first_edge, axis = 0)
+    polygon_upper = np.maximum.reduceat(edges['start'], first_edge, axis = 0)
+    # A point just inside every polygon, next to the middle of its first edge, looked up in a grid hash of the polygons
+    inside_points = (edges['start'][first_edge] + edges['end'][first_edge]) / 2 - 10 * tolerance * edges['normal'][first_edge]
+    cell_size = max(np.percentile(np.max(polygon_upper - polygon_lower, axis = 1), 90), reach)
+    keys, boxes, point_keys, row_stride = grid_hash(polygon_lower, polygon_upper, cell_size)
+    targets = point_keys(inside_points)
+    first = np.searchsorted(keys, targets)
+    count = np.searchsorted(keys, targets, side = 'right') - first
+    inner = np.repeat(np.arange(len(polygons)), count)
+    outer = boxes[np.repeat(first, count) + np.arange(len(inner)) - np.repeat(np.cumsum(count) - count, count)]
+    candidate = (inner != outer) & np.all(inside_points[inner] >= polygon_lower[outer], axis = 1) & np.all(inside_points[inner] <= polygon_upper[outer], axis = 1)
+    inner, outer = inner[candidate], outer[candidate]
+    contained = points_in_polygons(inside_points[inner], outer, edges, counts, first_edge)
+    overlapping.update(zip(np.minimum(inner, outer)[contained].tolist(), np.maximum(inner, outer)[contained].tolist()))
+    for a, b in sorted(overlapping):
+        location = (inside_points[a] + inside_points[b]) / 2
+        results.append(('overlap', float(location[0]), float(location[1]), 0.0))
+    return results
+
+def check_cell(cell, min_width = 0.05, min_spacing = 0.05, layers = None):
+    """
+    cell: the cell to check, flattened with all its references
+    layers: layers to check (default: all of them); the datatypes of a layer are checked together
+
+    Return: dictionary {layer: list of violations (rule, x, y, distance)}
+    """
+    by_layer = {}
+    for (layer, datatype), polygons in cell.get_polygons(by_spec = True).items():
+        if layers is None or layer in layers:
+            by_layer.setdefault(layer, []).extend(polygons)
+    return {layer: check_layer(polygons, min_width, min_spacing) for layer, polygons in sorted(by_layer.items())}
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    # Usage: python drc.py input.gds [cell name] [min width] [min spacing]
+    # Prints the number of violations of every rule, and writes them all to input.gds.drc.json
+    lib = gdspy.GdsLibrary(infile = sys.argv[1])
+    if len(sys.argv) > 2:
+        cell = lib.cells[sys.argv[2]]
+    else:
+        cell = lib.top_level()[0]
+    min_width = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    min_spacing = float(sys.argv[4]) if len(sys.argv) > 4 else 0.05
+    violations = check_cell(cell, min_width, min_spacing)
+    for layer, layer_violations in violations.items():
+        for rule in ['width', 'spacing', 'overlap']:
+            print('layer {} {}: {}'.format(layer, rule, sum(1 for violation in layer_violations if violation[0] == rule)))
+    with open(sys.argv[1] + '.drc.json', 'w') as report_file:
+        json.dump({str(layer): layer_violations for layer, layer_violations in violations.items()}, report_file, indent = 2)
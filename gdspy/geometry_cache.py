@@ -0,0 +1,138 @@
+###############################
+# DESCRIPTION
+###############################
+## On-disk cache of the polygons built by the cell recipes (see parallel_build.py).
+## Each entry is a .npz file named after a hash of the recipe: the builder code (with the functions it calls and the
+## modules of this folder it uses) and its parameters.
+## The cache is bounded in size; the least recently used entries are removed first, once per build (the directory is
+## scanned once after all the new entries are stored, not after every entry).
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import hashlib
+import inspect
+import numpy as np
+import os
+import tempfile
+import types
+
+###############################
+# FUNCTIONS
+###############################
+
+def code_names(code):
+    "Return the global names used by a code object, including the ones used in its comprehensions and nested functions"
+    names = list(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names.extend(code_names(constant))
+    return names
+
+def sibling_path(directory, name):
+    "Return the path of the module name if it is a file of directory (the modules of this folder are imported by plain name), else None"
+    path = os.path.join(directory, name + '.py')
+    return path if os.path.isfile(path) else None
+
+def module_source(path, seen):
+    """
+    Return the source code of the module at path and of every module of the same folder it imports, directly or not
+    (seen: the paths and functions already included)
+    """
+    if path in seen:
+        return ''
+    seen.add(path)
+    with open(path) as module_file:
+        source = module_file.read()
+    directory = os.path.dirname(path)
+    for name in code_names(compile(source, path, 'exec')):
+        dependency = sibling_path(directory, name)
+        if dependency is not None:
+            source += module_source(dependency, seen)
+    return source
+
+def builder_source(builder, seen = None):
+    """
+    Return the source code of builder and of every function of the same module it calls, directly or not, plus the
+    whole source of the other modules of the same folder these functions use (e.g. polygon_store, tiled_boolean), even
+    through a local import. Editing any of them changes the cache key, so old entries are never used by mistake.
+    """
+    if seen is None:
+        seen = set()
+    seen.add(builder)
+    source = inspect.getsource(builder)
+    directory = os.path.dirname(os.path.abspath(inspect.getsourcefile(builder)))
+    for name in code_names(builder.__code__):
+        # Decorated functions (e.g. functools.lru_cache) are followed to the function they wrap
+        value = inspect.unwrap(builder.__globals__.get(name))
+        if isinstance(value, types.FunctionType) and value.__module__ == builder.__module__:
+            if value not in seen:
+                source += builder_source(value, seen)
+            continue
+        if isinstance(value, types.FunctionType):
+            # Imported with from module import function
+            path = inspect.getsourcefile(value)
+        elif isinstance(value, types.ModuleType):
+            path = getattr(value, '__file__', None)
+        else:
+            # Modules imported inside a function are not in the globals
+            path = sibling_path(directory, name)
+        if path is not None and os.path.dirname(os.path.abspath(path)) == directory:
+            source += module_source(os.path.abspath(path), seen)
+    return source
+
+def recipe_key(recipe):
+    """
+    recipe: (cell_name, builder, kwargs) as in parallel_build.py
+
+    Return: the hexadecimal hash of the builder code, its parameters and the versions of gdspy and numpy.
+    The cell name is not part of the key: two cells built with the same recipe share one entry.
+    """
+    cell_name, builder, kwargs = recipe
+    content = [builder_source(builder), repr(sorted(kwargs.items())), gdspy.__version__, np.__version__]
+    return hashlib.sha256('\n'.join(content).encode()).hexdigest()
+
+def load_cached_arrays(cache_dir, key):
+    """Return the arrays stored under key (format of parallel_build.cell_to_arrays), or None if there is no such entry"""
+    path = os.path.join(cache_dir, key + '.npz')
+    try:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+    # Mark the entry as recently used
+    os.utime(path)
+    return arrays
+
+def evict_cache(cache_dir, max_cache_size):
+    """Remove the least recently used entries until the cache holds at most max_cache_size bytes"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            status = entry.stat()
+            entries.append((status.st_mtime, status.st_size, entry.path))
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_size <= max_cache_size:
+            break
+        os.remove(path)
+        total_size -= size
+
+def store_cached_arrays(cache_dir, key, arrays, max_cache_size = None):
+    """
+    Store arrays under key, then shrink the cache to max_cache_size bytes if it is given (see evict_cache; a build
+    storing many entries evicts once at the end instead, see parallel_build.build_cells).
+    The file is written under a temporary name and renamed, so a reader never sees half an entry.
+    """
+    os.makedirs(cache_dir, exist_ok = True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir = cache_dir, suffix = '.tmp')
+    with os.fdopen(file_descriptor, 'wb') as temp_file:
+        np.savez(temp_file, **arrays)
+    os.replace(temp_path, os.path.join(cache_dir, key + '.npz'))
+    if max_cache_size is not None:
+        evict_cache(cache_dir, max_cache_size)
@@ -0,0 +1,99 @@
+###############################
+# DESCRIPTION
+###############################
+## Geometry helpers shared by the passes that walk the cell hierarchy (deduplication.py, oasis.py, preview.py):
+##   + the transformation and the copy positions of a gdspy reference (CellReference or CellArray)
+##   + the split of a set of positions into regular rows and grids, used for CellArrays and OASIS repetitions
+##   + the choice of the cell a command line tool works on (top_cell)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+
+###############################
+# FUNCTIONS
+###############################
+
+def top_cell(lib, name = None):
+    """
+    Return the cell of lib called name, or when name is None its only top cell.
+    Raise a ValueError when the cell is missing or when lib has several top cells (the choice would be arbitrary).
+    """
+    if name is not None:
+        if name not in lib.cells:
+            raise ValueError("Cell '{}' is missing from the layout".format(name))
+        return lib.cells[name]
+    top_cells = [cell for cell in lib.top_level() if isinstance(cell, gdspy.Cell)]
+    if len(top_cells) != 1:
+        raise ValueError("Cannot choose the cell (top cells {}): give it with --cell".format(sorted(cell.name for cell in top_cells)))
+    return top_cells[0]
+
+def reference_matrix(rotation, magnification, x_reflection):
+    "Return the 2x2 matrix of the transformation of a gdspy reference: reflection about x, magnification, then rotation"
+    angle = np.radians(rotation or 0)
+    matrix = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    if x_reflection:
+        matrix = matrix @ np.diag([1.0, -1.0])
+    return matrix * (1 if magnification is None else magnification)
+
+def reference_offsets(reference):
+    "Return the positions of the copies of a reference (one for a CellReference, columns x rows for a CellArray)"
+    origin = np.zeros(2) if reference.origin is None else np.array(reference.origin, dtype = float)
+    if not isinstance(reference, gdspy.CellArray):
+        return origin[np.newaxis, :]
+    columns, rows = np.meshgrid(np.arange(reference.columns), np.arange(reference.rows), indexing = 'ij')
+    spacing = np.column_stack((columns.ravel() * reference.spacing[0], rows.ravel() * reference.spacing[1]))
+    # The spacing of a CellArray is reflected and rotated with the cell, but not magnified
+    return origin + spacing @ reference_matrix(reference.rotation, None, reference.x_reflection).T
+
+def runs(values):
+    """
+    values: sorted 1D integer array
+
+    Return: a list of (first value, spacing, count) of the evenly spaced runs the values are split into, longest first from the left
+    """
+    result = []
+    start = 0
+    while start < len(values):
+        end = start + 1
+        if end < len(values):
+            spacing = values[end] - values[start]
+            while end + 1 < len(values) and values[end + 1] - values[end] == spacing:
+                end += 1
+            end += 1
+        else:
+            spacing = 0
+        result.append((int(values[start]), int(spacing), end - start))
+        start = end
+    return result
+
+def regular_arrays(positions):
+    """
+    positions: integer array of shape (n, 2)
+
+    Return: a list of (x, y, x_spacing, number_of_columns, y_spacing, number_of_rows) covering every position once.
+    The positions are split into rows of evenly spaced x, and rows with the same x are stacked into grids of evenly
+    spaced y; a single position is (x, y, 0, 1, 0, 1).
+    """
+    positions, counts = np.unique(np.asarray(positions, dtype = np.int64).reshape(-1, 2), axis = 0, return_counts = True)
+    if len(positions) == 0:
+        return []
+    # Positions given several times (e.g. a shape written twice at the same place) are kept: the extra copies get arrays of their own
+    duplicates = regular_arrays(np.repeat(positions, counts - 1, axis = 0))
+    positions = positions[np.lexsort((positions[:, 0], positions[:, 1]))]
+    row_starts = np.flatnonzero(np.r_[True, positions[1:, 1] != positions[:-1, 1]])
+    row_ends = np.r_[row_starts[1:], len(positions)]
+    stacks = {}
+    for start, end in zip(row_starts, row_ends):
+        for row_run in runs(positions[start:end, 0]):
+            stacks.setdefault(row_run, []).append(positions[start, 1])
+    arrays = []
+    for (x, x_spacing, number_of_columns), ys in stacks.items():
+        for y, y_spacing, number_of_rows in runs(np.array(ys)):
+            arrays.append((x, y, x_spacing, number_of_columns, y_spacing, number_of_rows))
+    return arrays + duplicates
@@ -0,0 +1,232 @@
+###############################
+# DESCRIPTION
+###############################
+## Build a layout from a JSON spec (see fab_pattern.json).
+## The spec lists the cells; each cell has
+##   + polygons: recipes of PMMA_pattern.py that fill the cell with polygons, e.g. {"recipe": "rectangle_cell_recipe", "params": {...}}
+##   + references: reference builders of PMMA_pattern.py that add references to another cell,
+##     e.g. {"builder": "rotation_matrix", "cell": "rect_1", "params": {...}}
+## The spec is compiled into a dependency graph of cells. Every node gets a key hashed from its own recipes and the keys
+## of the cells it references, and the keys of the last run are saved next to the GDS file, with a key of the output
+## options and output-stage code: a run where no key changed does nothing, and otherwise only the polygon recipes missing
+## from the geometry cache are built again.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import hashlib
+import inspect
+import json
+import os
+import PMMA_pattern
+import profiling
+from geometry_cache import builder_source, module_source, recipe_key
+from parallel_build import assemble_cells, build_cells
+
+###############################
+# FUNCTIONS
+###############################
+
+def load_layout_spec(spec_path):
+    "Return the layout spec stored in a JSON file"
+    with open(spec_path) as spec_file:
+        return json.load(spec_file)
+
+def spec_function(name):
+    "Return the function of PMMA_pattern.py called name, used for the recipes and reference builders of the spec"
+    function = getattr(PMMA_pattern, name, None)
+    if not inspect.isfunction(function):
+        raise ValueError("Unknown recipe or reference builder '{}' in the layout spec".format(name))
+    return function
+
+def dependency_order(spec):
+    """
+    Return the names of the cells of the spec sorted so that every cell comes after the cells it references.
+    Raise a ValueError for a reference to a missing cell or a reference loop.
+    """
+    cells = spec['cells']
+    order = []
+    state = {}
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError("Reference loop in the layout spec: {}".format(' -> '.join(path + [name])))
+        state[name] = 'visiting'
+        for reference in cells[name].get('references', []):
+            if reference['cell'] not in cells:
+                raise ValueError("Cell '{}' references the missing cell '{}'".format(name, reference['cell']))
+            visit(reference['cell'], path + [name])
+        state[name] = 'done'
+        order.append(name)
+    for name in cells:
+        visit(name, [])
+    return order
+
+def compile_layout(spec):
+    """
+    Compile the spec into the build graph.
+
+    Return: a list of nodes in dependency order, each node being a dictionary with
+        + name: the cell name
+        + recipes: the polygon recipes of the cell as (cell_name, builder, kwargs), ready for parallel_build.build_cells
+        + references: the reference builders of the cell as (builder, referenced cell name, params)
+        + key: hash of everything the cell depends on, including the cells it references
+    """
+    cells = spec['cells']
+    keys = {}
+    nodes = []
+    for name in dependency_order(spec):
+        cell_spec = cells[name]
+        recipes = [(name, spec_function(entry['recipe']), entry['params']) for entry in cell_spec.get('polygons', [])]
+        references = [(spec_function(entry['builder']), entry['cell'], entry['params']) for entry in cell_spec.get('references', [])]
+        content = [recipe_key(recipe) for recipe in recipes]
+        for builder, cell_name, params in references:
+            content.extend([builder_source(builder), cell_name, keys[cell_name], repr(sorted(params.items()))])
+        keys[name] = hashlib.sha256('\n'.join(content).encode()).hexdigest()
+        nodes.append({'name': name, 'recipes': recipes, 'references': references, 'key': keys[name]})
+    return nodes
+
+def select_nodes(nodes, cells, shallow = False):
+    """
+    nodes: the build graph from compile_layout
+    cells: names of the cells to build
+    shallow: build the polygons of the selected cells only, without their references (e.g. the dot field of main alone)
+
+    Return: the nodes of the selected cells and of all the cells they reference, in the order of nodes
+    """
+    by_name = {node['name']: node for node in nodes}
+    for name in cells:
+        if name not in by_name:
+            raise ValueError("Unknown cell '{}' in the layout spec".format(name))
+    if shallow:
+        # The key changes too, so that a shallow build is never taken for a complete one
+        return [dict(node, references = [], key = node['key'] + '-shallow') for node in nodes if node['name'] in cells]
+    selected = set()
+    stack = list(cells)
+    while len(stack) > 0:
+        name = stack.pop()
+        if name not in selected:
+            selected.add(name)
+            stack.extend(cell_name for builder, cell_name, params in by_name[name]['references'])
+    return [node for node in nodes if node['name'] in selected]
+
+def add_references(lib, cell, references):
+    """
+    Run the reference builders of one cell; the cells they reference must already be in lib.
+    Builders that take a 'lib' argument (e.g. rotation_cell_array) get the library as well.
+    """
+    for builder, cell_name, params in references:
+        with profiling.stage(builder.__name__, cell.name) as record:
+            number_of_references = len(cell.references)
+            if 'lib' in inspect.signature(builder).parameters:
+                builder(lib = lib, main_cell = cell, pattern_cell = lib.cells[cell_name], **params)
+            else:
+                builder(main_cell = cell, pattern_cell = lib.cells[cell_name], **params)
+            record['references'] = len(cell.references) - number_of_references
+    return cell
+
+def build_layout(nodes, cache_dir = None, max_workers = None):
+    """
+    nodes: the build graph from compile_layout
+    cache_dir, max_workers: passed to parallel_build.build_cells
+
+    Return: a GdsLibrary with all the cells of the graph
+    """
+    lib = gdspy.GdsLibrary()
+    for node in nodes:
+        # Kept out of gdspy.current_library, so that several layouts can be built in one process
+        lib.add(gdspy.Cell(node['name'], exclude_from_current = True))
+    # The polygons of all the cells are built at once, so that they share the process pool
+    recipes = [recipe for node in nodes for recipe in node['recipes']]
+    assemble_cells(lib, build_cells(recipes, max_workers = max_workers, cache_dir = cache_dir))
+    for node in nodes:
+        add_references(lib, lib.cells[node['name']], node['references'])
+    return lib
+
+def output_key(spec):
+    """
+    Return the hash of the output options of the spec (top cell, output files, deduplication) and of the source of the
+    modules of the output stages it uses (deduplication.py, oasis.py, preview.py, write_time.py and their imports), so
+    that changing an option or one of these modules writes the outputs again even if no cell changed
+    """
+    options = {key: spec.get(key) for key in ['top_cell', 'gds', 'oas', 'svg', 'preview', 'write_time', 'deduplicate']}
+    stages = [('deduplicate', 'deduplication'), ('oas', 'oasis'), ('preview', 'preview'), ('write_time', 'write_time')]
+    directory = os.path.dirname(os.path.abspath(__file__))
+    seen = set()
+    content = [json.dumps(options, sort_keys = True), gdspy.__version__]
+    content += [module_source(os.path.join(directory, module + '.py'), seen) for key, module in stages if spec.get(key)]
+    return hashlib.sha256('\n'.join(content).encode()).hexdigest()
+
+def write_outputs(lib, spec, output_dir, gds_path):
+    """
+    Output stage of a build: share the repeated polygons and identical cells of lib first with "deduplicate": true in the
+    spec (see deduplication.py), then write the GDS file to gds_path, and the OASIS file (see oasis.py), the SVG image and
+    the raster preview (see preview.py) of the top cell and the write time estimate of every cell (see write_time.py)
+    that the spec names, in output_dir
+    """
+    # The modules of the optional stages are only imported when the spec asks for them, to keep the startup short
+    if spec.get('deduplicate', False):
+        from deduplication import deduplicate_library
+        with profiling.stage('deduplicate'):
+            deduplicate_library(lib)
+    with profiling.stage('write_gds') as record:
+        lib.write_gds(gds_path)
+        if profiling.is_enabled():
+            record['polygons'], record['vertices'] = profiling.count_geometry(polygon_set for cell in lib.cells.values() for polygon_set in cell.polygons)
+    if 'oas' in spec:
+        from oasis import write_oas
+        with profiling.stage('write_oas'):
+            write_oas(lib, os.path.join(output_dir, spec['oas']))
+    if 'svg' in spec:
+        with profiling.stage('write_svg', spec['top_cell']):
+            lib.cells[spec['top_cell']].write_svg(os.path.join(output_dir, spec['svg']))
+    if 'preview' in spec:
+        from preview import write_preview
+        with profiling.stage('write_preview', spec['top_cell']):
+            write_preview(lib.cells[spec['top_cell']], os.path.join(output_dir, spec['preview']))
+    if 'write_time' in spec:
+        from write_time import estimate_write_time
+        with profiling.stage('estimate_write_time'):
+            with open(os.path.join(output_dir, spec['write_time']), 'w') as report_file:
+                json.dump(estimate_write_time(lib), report_file, indent = 2)
+
+def build_spec(spec, output_dir = '.', cache_dir = 'geometry_cache', max_workers = None, cells = None, shallow = False):
+    """
+    Build the layout of a spec and write the GDS file and the other outputs the spec names (see write_outputs).
+    output_dir: directory of the output files; cache_dir is relative to it
+    cells, shallow: build only these cells (see select_nodes); the GDS file is then named after them,
+        e.g. 'fab_pattern_hexagon', and no other output is written
+    The keys of the nodes and the output key (see output_key) are saved in '<gds>.build.json'. Nothing is done if no key
+    changed and the outputs exist.
+
+    Return: the names of the cells whose key changed since the last run
+    """
+    nodes = compile_layout(spec)
+    gds_path = os.path.join(output_dir, spec['gds'])
+    if cells is not None:
+        nodes = select_nodes(nodes, cells, shallow)
+        stem, extension = os.path.splitext(gds_path)
+        gds_path = '{}_{}{}'.format(stem, '_'.join(cells), extension)
+        spec = {key: value for key, value in spec.items() if key not in ['oas', 'svg', 'preview', 'write_time']}
+    manifest_path = gds_path + '.build.json'
+    outputs = [gds_path] + [os.path.join(output_dir, spec[key]) for key in ['oas', 'svg', 'write_time'] if key in spec]
+    outputs += [os.path.join(output_dir, spec['preview'], 'preview.json')] if 'preview' in spec else []
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    last_keys = manifest.get('nodes', {})
+    changed = [node['name'] for node in nodes if last_keys.get(node['name']) != node['key']]
+    outputs_key = output_key(spec)
+    if len(changed) == 0 and manifest.get('outputs') == outputs_key and all(os.path.exists(path) for path in outputs):
+        return changed
+    lib = build_layout(nodes, cache_dir = os.path.join(output_dir, cache_dir), max_workers = max_workers)
+    write_outputs(lib, spec, output_dir, gds_path)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump({'nodes': {node['name']: node['key'] for node in nodes}, 'outputs': outputs_key}, manifest_file, indent = 2)
+    return changed
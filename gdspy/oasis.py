@@ -0,0 +1,329 @@
+###############################
+# DESCRIPTION
+###############################
+## OASIS (SEMI P39) writer for gdspy libraries, used next to lib.write_gds: write_oas(lib, 'fab_pattern.oas').
+## OASIS stores integers with a variable number of bytes and polygons as the steps between their vertices, and
+## shapes or references that repeat are written once with a repetition:
+##   + the identical shapes of a cell (same layer, datatype and shape, e.g. the rectangles of
+##     rectangle_horizontal_array or identical dots) are grouped, and their positions split into regular rows and grids
+##     (one record each); the positions left are written as one record with a list of displacements
+##   + the references to the same cell with the same rotation and magnification (horizontal_rotated_copy,
+##     rotation_matrix) are grouped the same way, and a CellArray is one placement with a grid repetition
+##   + with compress = True the records are deflated in CBLOCKs of about 1 MB
+## The coordinates are rounded to the database unit of the library (lib.precision), as in the GDSII file.
+## Usage: python oasis.py input.gds output.oas
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import struct
+import sys
+import zlib
+from hierarchy import regular_arrays
+
+###############################
+# FUNCTIONS
+###############################
+
+def unsigned_integer(value):
+    "Return the OASIS encoding of an unsigned integer: groups of 7 bits, lowest first, the high bit set on all but the last byte"
+    value = int(value)
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+def signed_integer(value):
+    "Return the OASIS encoding of a signed integer (the sign is the lowest bit)"
+    value = int(value)
+    return unsigned_integer((abs(value) << 1) | (value < 0))
+
+def unsigned_integers(values):
+    "Same as b''.join(unsigned_integer(value) for value in values), vectorized for an array of non-negative integers"
+    values = np.asarray(values, dtype = np.uint64)
+    if len(values) == 0:
+        return b''
+    number_of_bytes = np.ones(len(values), dtype = np.int64)
+    for shift in range(7, 64, 7):
+        number_of_bytes += values >= (np.uint64(1) << np.uint64(shift))
+    width = number_of_bytes.max()
+    groups = (values[:, np.newaxis] >> (np.arange(width, dtype = np.uint64) * np.uint64(7))) & np.uint64(0x7f)
+    position = np.arange(width)
+    groups |= np.where(position < number_of_bytes[:, np.newaxis] - 1, np.uint64(0x80), np.uint64(0))
+    return groups.astype(np.uint8)[position < number_of_bytes[:, np.newaxis]].tobytes()
+
+def real(value):
+    "Return the OASIS encoding of a real: an integer when value is one, otherwise an IEEE double"
+    if float(value).is_integer() and abs(value) < 2**53:
+        return unsigned_integer(0 if value >= 0 else 1) + unsigned_integer(abs(int(value)))
+    return unsigned_integer(7) + struct.pack('<d', value)
+
+def string(text):
+    "Return the OASIS encoding of a string: its length followed by its bytes"
+    data = text.encode() if isinstance(text, str) else bytes(text)
+    return unsigned_integer(len(data)) + data
+
+# Directions of the 1-integer g-deltas: east, north, west, south, north-east, north-west, south-west, south-east
+OCTANGULAR_DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, 1), (-1, 1), (-1, -1), (1, -1)]
+
+def g_deltas(deltas):
+    """
+    deltas: integer array of shape (n, 2)
+
+    Return: the OASIS g-delta encoding of every delta, one integer (direction and length) for the horizontal, vertical
+    and diagonal deltas and two integers for the others
+    """
+    deltas = np.asarray(deltas, dtype = np.int64).reshape(-1, 2)
+    dx = deltas[:, 0]
+    dy = deltas[:, 1]
+    magnitude = np.maximum(np.abs(dx), np.abs(dy))
+    direction = np.full(len(deltas), -1)
+    for code, (x, y) in enumerate(OCTANGULAR_DIRECTIONS):
+        direction[(dx == x * magnitude) & (dy == y * magnitude) & (direction < 0)] = code
+    octangular = direction >= 0
+    first = np.where(octangular, (magnitude << 4) | (direction << 1), (np.abs(dx) << 2) | ((dx < 0) << 1) | 1)
+    second = (np.abs(dy) << 1) | (dy < 0)
+    integers = np.column_stack((first, second))
+    return unsigned_integers(integers[np.column_stack((np.ones(len(deltas), dtype = bool), ~octangular))])
+
+def grid_repetition(x_spacing, number_of_columns, y_spacing, number_of_rows):
+    "Return the OASIS repetition of a grid with positive spacings (type 1, or 2 and 3 for a single row or column), or None for one element"
+    if number_of_columns > 1 and number_of_rows > 1:
+        return unsigned_integer(1) + unsigned_integers([number_of_columns - 2, number_of_rows - 2, x_spacing, y_spacing])
+    if number_of_columns > 1:
+        return unsigned_integer(2) + unsigned_integers([number_of_columns - 2, x_spacing])
+    if number_of_rows > 1:
+        return unsigned_integer(3) + unsigned_integers([number_of_rows - 2, y_spacing])
+    return None
+
+def find_repetitions(positions):
+    """
+    positions: integer array of shape (n, 2), the positions of one shape or placement
+
+    Return: a list of (x, y, repetition or None) covering every position once: one grid repetition per regular array
+    (see hierarchy.regular_arrays), and the single positions left written as one arbitrary repetition (type 10)
+    """
+    records = []
+    singles = []
+    for x, y, x_spacing, number_of_columns, y_spacing, number_of_rows in regular_arrays(positions):
+        if number_of_columns == 1 and number_of_rows == 1:
+            singles.append((x, y))
+        else:
+            records.append((x, y, grid_repetition(x_spacing, number_of_columns, y_spacing, number_of_rows)))
+    if len(singles) == 1:
+        records.append(singles[0] + (None,))
+    elif len(singles) > 1:
+        singles = np.array(singles)
+        repetition = unsigned_integer(10) + unsigned_integer(len(singles) - 2) + g_deltas(np.diff(singles, axis = 0))
+        records.append((singles[0, 0], singles[0, 1], repetition))
+    return records
+
+def array_repetition(reference, scale):
+    """
+    Return the repetition of a CellArray: a grid (types 1 to 3) when its axes are along x and y, a lattice (types 8 and 9)
+    when the rotated spacings fall on the grid of the database unit, and None otherwise
+    """
+    angle = np.radians(reference.rotation or 0)
+    reflection = -1 if reference.x_reflection else 1
+    # The spacing of a CellArray is reflected and rotated with the cell, but not magnified
+    column_step = np.array([np.cos(angle), np.sin(angle)]) * reference.spacing[0] * scale
+    row_step = np.array([-np.sin(angle), np.cos(angle)]) * reference.spacing[1] * reflection * scale
+    steps = np.round([column_step, row_step]).astype(np.int64)
+    if np.abs(steps - [column_step, row_step]).max() > 1e-6:
+        return None
+    column_step, row_step = steps
+    if column_step[1] == 0 and row_step[0] == 0 and column_step[0] >= 0 and row_step[1] >= 0:
+        return grid_repetition(column_step[0], reference.columns, row_step[1], reference.rows)
+    if reference.columns > 1 and reference.rows > 1:
+        return unsigned_integer(8) + unsigned_integers([reference.columns - 2, reference.rows - 2]) + g_deltas([column_step, row_step])
+    if reference.columns > 1:
+        return unsigned_integer(9) + unsigned_integer(reference.columns - 2) + g_deltas([column_step])
+    return unsigned_integer(9) + unsigned_integer(reference.rows - 2) + g_deltas([row_step])
+
+def is_rectangle(points):
+    "Return True when the polygon is a rectangle along the axes (4 vertices at its corners, every edge horizontal or vertical)"
+    if len(points) != 4:
+        return False
+    corners = (points == points.min(axis = 0)) | (points == points.max(axis = 0))
+    edges = np.diff(np.vstack((points, points[:1])), axis = 0)
+    return bool(np.all(corners) and np.all(np.any(edges == 0, axis = 1)))
+
+def shape_records(polygons, layers, datatypes, modal):
+    """
+    polygons: integer vertex arrays in database units; layers, datatypes: one per polygon
+    modal: the layer and datatype of the last shape of the cell (OASIS modal variables), updated by this function
+
+    Return: the RECTANGLE and POLYGON records of the polygons, identical shapes written once with their repetitions
+    """
+    groups = {}
+    for points, layer, datatype in zip(polygons, layers, datatypes):
+        if is_rectangle(points):
+            lower = points.min(axis = 0)
+            key = ('rectangle', layer, datatype, tuple(points.max(axis = 0) - lower))
+            position = lower
+        else:
+            key = ('polygon', layer, datatype, (points[1:] - points[0]).tobytes())
+            position = points[0]
+        groups.setdefault(key, []).append(position)
+    records = []
+    for (kind, layer, datatype, shape), positions in groups.items():
+        info = 0b11000
+        fields = b''
+        if modal.get('layer') != layer:
+            info |= 0b1
+            fields += unsigned_integer(layer)
+        if modal.get('datatype') != datatype:
+            info |= 0b10
+            fields += unsigned_integer(datatype)
+        modal['layer'] = layer
+        modal['datatype'] = datatype
+        if kind == 'rectangle':
+            width, height = shape
+            if width == height:
+                info |= 0b11000000
+                fields += unsigned_integer(width)
+            else:
+                info |= 0b1100000
+                fields += unsigned_integer(width) + unsigned_integer(height)
+            record_type = 20
+        else:
+            deltas = np.diff(np.vstack(([0, 0], np.frombuffer(shape, dtype = np.int64).reshape(-1, 2))), axis = 0)
+            info |= 0b100000
+            fields += unsigned_integer(4) + unsigned_integer(len(deltas)) + g_deltas(deltas)
+            record_type = 21
+        for x, y, repetition in find_repetitions(positions):
+            records.append(unsigned_integer(record_type) + bytes([info | (0b100 if repetition else 0)]) + fields
+                           + signed_integer(x) + signed_integer(y) + (repetition or b''))
+    return records
+
+def placement_record(cell_number, x, y, rotation, magnification, x_reflection, repetition):
+    "Return a PLACEMENT record (type 17 for multiples of 90 degrees without magnification, 18 otherwise)"
+    rotation = (rotation or 0) % 360
+    magnification = 1 if magnification is None else magnification
+    position = signed_integer(x) + signed_integer(y) + (repetition or b'')
+    flags = 0b11110000 | (0b1000 if repetition else 0) | (1 if x_reflection else 0)
+    if magnification == 1 and rotation % 90 == 0:
+        return unsigned_integer(17) + bytes([flags | (int(rotation // 90) << 1)]) + unsigned_integer(cell_number) + position
+    fields = unsigned_integer(cell_number)
+    if magnification != 1:
+        flags |= 0b100
+        fields += real(magnification)
+    if rotation != 0:
+        flags |= 0b10
+        fields += real(rotation)
+    return unsigned_integer(18) + bytes([flags]) + fields + position
+
+def array_origins(reference):
+    "Return the origins of the copies of a CellArray"
+    angle = np.radians(reference.rotation or 0)
+    reflection = -1 if reference.x_reflection else 1
+    columns, rows = np.meshgrid(np.arange(reference.columns), np.arange(reference.rows), indexing = 'ij')
+    x = columns.ravel() * reference.spacing[0]
+    y = rows.ravel() * reference.spacing[1] * reflection
+    return np.column_stack((x * np.cos(angle) - y * np.sin(angle), x * np.sin(angle) + y * np.cos(angle))) + reference.origin
+
+def placement_records(references, cell_numbers, scale):
+    "Return the PLACEMENT records of the references; references with the same cell and transformation are grouped"
+    groups = {}
+    records = []
+    for reference in references:
+        if not isinstance(reference.ref_cell, gdspy.Cell):
+            continue
+        transformation = (cell_numbers[reference.ref_cell.name], reference.rotation, reference.magnification, bool(reference.x_reflection))
+        if isinstance(reference, gdspy.CellArray):
+            repetition = array_repetition(reference, scale)
+            if repetition is not None:
+                x, y = np.round(np.array(reference.origin) * scale).astype(np.int64)
+                records.append(placement_record(transformation[0], x, y, *transformation[1:], repetition))
+            else:
+                # One copy or rotated spacings off the grid: the copies are placed one by one
+                groups.setdefault(transformation, []).extend(np.round(array_origins(reference) * scale).astype(np.int64))
+        else:
+            groups.setdefault(transformation, []).append(np.round(np.array(reference.origin) * scale).astype(np.int64))
+    for (cell_number, rotation, magnification, x_reflection), positions in groups.items():
+        for x, y, repetition in find_repetitions(positions):
+            records.append(placement_record(cell_number, x, y, rotation, magnification, x_reflection, repetition))
+    return records
+
+def text_record(label, scale):
+    "Return the TEXT record of a gdspy Label"
+    x, y = np.round(np.array(label.position) * scale).astype(np.int64)
+    return (unsigned_integer(19) + bytes([0b01011011]) + string(label.text) + unsigned_integer(label.layer)
+            + unsigned_integer(label.texttype) + signed_integer(x) + signed_integer(y))
+
+def cell_records(cell, cell_numbers, scale):
+    "Return the records of the content of a cell (shapes, placements and texts)"
+    polygons = []
+    layers = []
+    datatypes = []
+    for polygon_set in cell.polygons:
+        polygons.extend(polygon_set.polygons)
+        layers.extend(polygon_set.layers)
+        datatypes.extend(polygon_set.datatypes)
+    for path in cell.paths:
+        for (layer, datatype), path_polygons in path.get_polygons(by_spec = True).items():
+            polygons.extend(path_polygons)
+            layers.extend([layer] * len(path_polygons))
+            datatypes.extend([datatype] * len(path_polygons))
+    polygons = [np.round(points * scale).astype(np.int64) for points in polygons]
+    records = shape_records(polygons, layers, datatypes, {})
+    records += placement_records(cell.references, cell_numbers, scale)
+    records += [text_record(label, scale) for label in cell.labels]
+    return records
+
+def compressed_block(records):
+    "Return a CBLOCK record holding the records deflated"
+    content = b''.join(records)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    deflated = compressor.compress(content) + compressor.flush()
+    return unsigned_integer(34) + unsigned_integer(0) + unsigned_integer(len(content)) + unsigned_integer(len(deflated)) + deflated
+
+def grid_steps(precision):
+    "Return the number of database units per micron, an integer when it is one up to rounding (1e-6 / 1e-9 is 999.9999999999999)"
+    steps = 1e-6 / precision
+    return round(steps) if abs(steps - round(steps)) < 1e-9 * steps else steps
+
+def write_oas(lib, path, compress = True, block_size = 2**20):
+    """
+    lib: gdspy GdsLibrary
+    compress: deflate the records (cell names and cells) in CBLOCKs of about block_size bytes; small cells share a block
+
+    Write all the cells of lib to an OASIS file.
+    """
+    scale = lib.unit / lib.precision
+    names = list(lib.cells)
+    cell_numbers = {name: number for number, name in enumerate(names)}
+    with open(path, 'wb') as oas_file:
+        oas_file.write(b'%SEMI-OASIS\r\n')
+        # START: version, grid steps per micron, table offsets in START (all empty: no name tables)
+        oas_file.write(unsigned_integer(1) + string('1.0') + real(grid_steps(lib.precision)) + unsigned_integer(0) + bytes(12))
+        # CELLNAME records, numbered implicitly from 0, then the CELL records and their content
+        records = [unsigned_integer(3) + string(name) for name in names]
+        pending = sum(len(record) for record in records)
+        for name in names:
+            records.append(unsigned_integer(13) + unsigned_integer(cell_numbers[name]))
+            content = cell_records(lib.cells[name], cell_numbers, scale)
+            records.extend(content)
+            pending += sum(len(record) for record in content)
+            if pending >= block_size:
+                oas_file.write(compressed_block(records) if compress else b''.join(records))
+                records = []
+                pending = 0
+        if len(records) > 0:
+            oas_file.write(compressed_block(records) if compress else b''.join(records))
+        # END: padded to 256 bytes, no validation
+        oas_file.write(unsigned_integer(2) + string(bytes(252)) + unsigned_integer(0))
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    write_oas(gdspy.GdsLibrary(infile = sys.argv[1]), sys.argv[2])
@@ -0,0 +1,167 @@
+###############################
+# DESCRIPTION
+###############################
+## Build independent pattern cells in parallel with a process pool.
+## A recipe is a tuple (cell_name, builder, kwargs): builder(cell, **kwargs) fills an empty cell with polygons.
+## A builder may also be a generator function yielding its PolygonSets instead of adding them to the cell,
+## or return its polygons as arrays in the format of cell_to_arrays (e.g. a polygon store, see polygon_store.py).
+## The recipes run in worker processes, which send back the polygons as NumPy arrays,
+## and the parent process puts them into the cells of the GdsLibrary.
+## With a cache directory, recipes already built in an earlier run are read from disk instead (see geometry_cache.py).
+## A builder may start a process pool of its own (e.g. tiled_boolean.py): in a worker, the pools started with the default
+## number of processes get the share of the cores left to this worker (see nested_workers), so that a build never runs
+## more processes than cores, instead of up to cores^2.
+## Every recipe is a profiling stage named after its builder (see profiling.py).
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import inspect
+import numpy as np
+import os
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from geometry_cache import evict_cache, load_cached_arrays, recipe_key, store_cached_arrays
+
+###############################
+# FUNCTIONS
+###############################
+
+# Number of processes of the pools started in this process when none is given, set in the build workers (see build_cells)
+nested_workers = None
+
+def set_nested_workers(number):
+    "Initializer of the build workers: the pools they start get number processes by default"
+    global nested_workers
+    nested_workers = number
+
+def default_workers(max_workers = None):
+    "Return max_workers, or in a build worker when it is None, the number of processes left to the pools it starts"
+    if max_workers is None:
+        return nested_workers
+    return max_workers
+
+def cell_to_arrays(cell):
+    """
+    cell: a cell with polygons only (references are not serialized)
+
+    Return: a dictionary of arrays describing all the polygons of the cell
+        + vertices: all the vertices, one after another, shape (number of vertices, 2)
+        + offsets: polygon i is vertices[offsets[i]:offsets[i + 1]]
+        + layers, datatypes: layer and datatype of every polygon
+    """
+    polygons = []
+    layers = []
+    datatypes = []
+    for polygon_set in cell.polygons:
+        polygons.extend(polygon_set.polygons)
+        layers.extend(polygon_set.layers)
+        datatypes.extend(polygon_set.datatypes)
+    offsets = np.zeros(len(polygons) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(points) for points in polygons])
+    if len(polygons) > 0:
+        vertices = np.concatenate(polygons)
+    else:
+        vertices = np.zeros((0, 2))
+    return {'vertices': vertices,
+            'offsets': offsets,
+            'layers': np.array(layers, dtype = np.int32),
+            'datatypes': np.array(datatypes, dtype = np.int32)}
+
+def arrays_to_polygon_sets(arrays):
+    """
+    arrays: polygons in the format of cell_to_arrays
+
+    Return: a list of PolygonSet, one per (layer, datatype) pair
+    """
+    vertices = arrays['vertices']
+    offsets = arrays['offsets']
+    polygon_sets = []
+    pairs = set(zip(arrays['layers'].tolist(), arrays['datatypes'].tolist()))
+    for layer, datatype in sorted(pairs):
+        index = np.flatnonzero((arrays['layers'] == layer) & (arrays['datatypes'] == datatype))
+        polygons = [vertices[offsets[i]:offsets[i + 1]] for i in index]
+        polygon_sets.append(gdspy.PolygonSet(polygons, layer = layer, datatype = datatype))
+    return polygon_sets
+
+def build_cell_arrays(recipe):
+    """
+    Run one recipe in a fresh cell (this is the task executed by the workers).
+
+    Return: (cell_name, arrays, profiling records) with the polygons of the cell in the format of cell_to_arrays
+    """
+    cell_name, builder, kwargs = recipe
+    first_event = len(profiling.events)
+    with profiling.stage(builder.__name__, cell_name) as record:
+        cell = gdspy.Cell(cell_name, exclude_from_current = True)
+        result = builder(cell, **kwargs)
+        if inspect.isgenerator(result):
+            for polygon_set in result:
+                cell.add(polygon_set)
+        if profiling.is_enabled() and isinstance(result, dict):
+            record['polygons'], record['vertices'] = len(result['offsets']) - 1, len(result['vertices'])
+        elif profiling.is_enabled():
+            record['polygons'], record['vertices'] = profiling.count_geometry(cell.polygons)
+    arrays = result if isinstance(result, dict) else cell_to_arrays(cell)
+    return cell_name, arrays, profiling.take_events(first_event)
+
+def build_cells(recipes, max_workers = None, cache_dir = None, max_cache_size = 2**30):
+    """
+    recipes: list of (cell_name, builder, kwargs); builder and kwargs must be picklable, so builder has to be a module-level function
+    max_workers: number of processes (default: all the cores); with max_workers = 1 everything runs in this process.
+        The cores are shared among the workers: a recipe starting a pool of its own gets cores // workers processes.
+    cache_dir: if given, the polygons of every recipe are looked up in and saved to this directory
+    max_cache_size: size limit of the cache directory in bytes, enforced once after the new entries are stored
+
+    Return: a dictionary {cell_name: list of arrays}; a cell name used by several recipes gets one entry per recipe
+    """
+    built = [None] * len(recipes)
+    keys = [None] * len(recipes)
+    if cache_dir is not None:
+        with profiling.stage('load_cache'):
+            for i, recipe in enumerate(recipes):
+                keys[i] = recipe_key(recipe)
+                built[i] = load_cached_arrays(cache_dir, keys[i])
+    # Only the recipes missing from the cache are built
+    missing = [i for i in range(len(recipes)) if built[i] is None]
+    missing_recipes = [recipes[i] for i in missing]
+    max_workers = default_workers(max_workers)
+    if max_workers == 1 or len(missing_recipes) <= 1:
+        new_arrays = map(build_cell_arrays, missing_recipes)
+        for i, (cell_name, arrays, events) in zip(missing, new_arrays):
+            built[i] = arrays
+            profiling.add_events(events)
+    else:
+        cores = os.cpu_count() or 1
+        workers = min(max_workers or cores, len(missing_recipes))
+        with ProcessPoolExecutor(max_workers = workers, initializer = set_nested_workers, initargs = (max(1, cores // workers),)) as executor:
+            # Results come back in the order of the recipes, whatever order they finish in
+            for i, (cell_name, arrays, events) in zip(missing, executor.map(build_cell_arrays, missing_recipes)):
+                built[i] = arrays
+                profiling.add_events(events)
+    if cache_dir is not None:
+        with profiling.stage('store_cache'):
+            for i in missing:
+                store_cached_arrays(cache_dir, keys[i], built[i])
+            if len(missing) > 0:
+                evict_cache(cache_dir, max_cache_size)
+    results = {}
+    for (cell_name, builder, kwargs), arrays in zip(recipes, built):
+        results.setdefault(cell_name, []).append(arrays)
+    return results
+
+def assemble_cells(lib, results):
+    """
+    Add the polygons returned by build_cells to the cells of lib with the same names.
+
+    Return: lib
+    """
+    for cell_name, arrays_list in results.items():
+        cell = lib.cells[cell_name]
+        for arrays in arrays_list:
+            cell.add(arrays_to_polygon_sets(arrays))
+    return lib
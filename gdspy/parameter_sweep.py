@@ -0,0 +1,146 @@
+###############################
+# DESCRIPTION
+###############################
+## Generate many variants of a layout spec (see layout_spec.py) in one run.
+## A sweep file names the base spec and the parameters to change, e.g. fab_pattern_sweep.json:
+##   + product: list of axes {"paths": [...], "values": [...]}; every combination of values is one variant,
+##     and all the paths of an axis get the same value (e.g. dx and dy of a dot matrix)
+##   + variants: explicit list of {path: value} dictionaries, used as they are
+##   + name: file name of each variant, formatted with its index (default 'variant_{index:03d}')
+## A path points into the spec, e.g. "cells/rect_1/polygons/0/params/width".
+## Every distinct polygon recipe of the sweep is built once into the geometry cache, then the variants are
+## assembled from the cache and written one by one, so only one variant is held in memory at a time.
+## Every variant goes through the output stage of layout_spec.build_spec (see layout_spec.write_outputs): deduplication
+## and the OASIS, SVG, preview and write time outputs named by the spec are written for each variant, named after it
+## (e.g. 'fab_pattern.oas' becomes 'fab_pattern_000.oas' for the variant 'fab_pattern_000', see variant_outputs).
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import copy
+import itertools
+import json
+import os
+import sys
+from geometry_cache import recipe_key
+from layout_spec import build_layout, compile_layout, load_layout_spec, write_outputs
+from parallel_build import build_cells
+
+###############################
+# FUNCTIONS
+###############################
+
+def sweep_variants(product = None, variants = None):
+    """
+    product: list of axes {"paths": [...], "values": [...]}
+    variants: list of {path: value}
+
+    Return: the list of {path: value} of every variant, the product first
+    """
+    all_variants = []
+    if product:
+        for values in itertools.product(*[axis['values'] for axis in product]):
+            overrides = {}
+            for axis, value in zip(product, values):
+                for path in axis['paths']:
+                    overrides[path] = value
+            all_variants.append(overrides)
+    if variants:
+        all_variants.extend(variants)
+    return all_variants
+
+def apply_overrides(spec, overrides):
+    "Return a copy of spec with the values of overrides ({path: value}) written at their paths"
+    new_spec = copy.deepcopy(spec)
+    for path, value in overrides.items():
+        keys = path.split('/')
+        node = new_spec
+        for key in keys[:-1]:
+            node = node[int(key)] if isinstance(node, list) else node[key]
+        if isinstance(node, list):
+            node[int(keys[-1])] = value
+        else:
+            if keys[-1] not in node:
+                raise KeyError("'{}' is not in the layout spec".format(path))
+            node[keys[-1]] = value
+    return new_spec
+
+def variant_outputs(spec, file_name):
+    """
+    Return a copy of spec whose output files are named after the variant file_name: the name of the GDS file of the
+    spec is replaced by file_name at the start of the other output names, which are prefixed with it otherwise
+    """
+    new_spec = dict(spec, gds = file_name)
+    for key in ['oas', 'svg', 'preview', 'write_time']:
+        if key in spec:
+            if spec[key].startswith(spec['gds']):
+                new_spec[key] = file_name + spec[key][len(spec['gds']):]
+            else:
+                new_spec[key] = '{}_{}'.format(file_name, spec[key])
+    return new_spec
+
+def prebuild_recipes(all_nodes, cache_dir, max_workers = None, batch_size = 64):
+    """
+    Build every distinct polygon recipe of the sweep once and store it in the geometry cache.
+    The recipes are built batch_size at a time, so that the memory use does not grow with the size of the sweep.
+
+    Return: the number of distinct recipes
+    """
+    distinct = {}
+    for nodes in all_nodes:
+        for node in nodes:
+            for recipe in node['recipes']:
+                distinct.setdefault(recipe_key(recipe), recipe)
+    recipes = list(distinct.values())
+    for start in range(0, len(recipes), batch_size):
+        # The results are already in the cache; the copies in memory are dropped right away
+        build_cells(recipes[start:start + batch_size], max_workers = max_workers, cache_dir = cache_dir)
+    return len(recipes)
+
+def run_sweep(spec, variants, output_dir = '.', name = 'variant_{index:03d}', cache_dir = 'geometry_cache', max_workers = None):
+    """
+    Write the outputs of every variant into output_dir (see variant_outputs), plus 'sweep_index.json' listing the GDS file
+    and the overrides of every variant.
+    cache_dir: geometry cache shared by all the variants, relative to output_dir
+
+    Return: the list of GDS file names
+    """
+    os.makedirs(output_dir, exist_ok = True)
+    cache_dir = os.path.join(output_dir, cache_dir)
+    variant_specs = [apply_overrides(spec, overrides) for overrides in variants]
+    all_nodes = [compile_layout(variant_spec) for variant_spec in variant_specs]
+    prebuild_recipes(all_nodes, cache_dir, max_workers = max_workers)
+    file_names = []
+    for index, (variant_spec, nodes) in enumerate(zip(variant_specs, all_nodes)):
+        file_name = name.format(index = index)
+        # All the polygons come from the cache now
+        lib = build_layout(nodes, cache_dir = cache_dir, max_workers = 1)
+        write_outputs(lib, variant_outputs(variant_spec, file_name), output_dir, os.path.join(output_dir, file_name))
+        del lib
+        file_names.append(file_name)
+    with open(os.path.join(output_dir, 'sweep_index.json'), 'w') as index_file:
+        json.dump([{'gds': file_name, 'overrides': overrides} for file_name, overrides in zip(file_names, variants)], index_file, indent = 2)
+    return file_names
+
+def run_sweep_file(sweep_path, output_dir = '.', max_workers = None):
+    "Run the sweep described in a JSON sweep file; the spec path in it is relative to the sweep file"
+    with open(sweep_path) as sweep_file:
+        sweep = json.load(sweep_file)
+    spec = load_layout_spec(os.path.join(os.path.dirname(os.path.abspath(sweep_path)), sweep['spec']))
+    variants = sweep_variants(sweep.get('product'), sweep.get('variants'))
+    return run_sweep(spec, variants, output_dir, name = sweep.get('name', 'variant_{index:03d}'), max_workers = max_workers)
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    # Usage: python parameter_sweep.py sweep.json [output directory]
+    # Every variant gets the GDS file and the other outputs named by the layout spec (see variant_outputs)
+    if len(sys.argv) > 2:
+        run_sweep_file(sys.argv[1], sys.argv[2])
+    else:
+        run_sweep_file(sys.argv[1])
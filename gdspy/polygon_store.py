@@ -0,0 +1,140 @@
+###############################
+# DESCRIPTION
+###############################
+## Struct-of-arrays container for generated polygons, used instead of one gdspy object per shape.
+## A polygon store is a dictionary of preallocated arrays that grow by doubling:
+##   + vertices: one contiguous buffer of vertices, shape (capacity, 2)
+##   + offsets: polygon i is vertices[offsets[i]:offsets[i + 1]]
+##   + layers, datatypes: layer and datatype of every polygon
+##   + polygon_count, vertex_count: number of polygons and vertices in use
+## The builders of PMMA_pattern.py (rectangle_pattern, hexagon_pattern, horizontal_dot_matrix) fill a store directly
+## when they get one instead of a cell or a pattern, with one array operation per batch of shapes.
+## store_arrays gives views of the filled part in the format of parallel_build.cell_to_arrays (no copy), so a store can
+## be returned by a recipe, saved to the geometry cache, written by write_gds_polygons, or turned into PolygonSets
+## (parallel_build.arrays_to_polygon_sets) only when gdspy objects are needed.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import numpy as np
+import struct
+
+###############################
+# FUNCTIONS
+###############################
+
+def new_polygon_store(polygon_capacity = 1024, vertex_capacity = 4096):
+    "Return an empty polygon store with room for polygon_capacity polygons and vertex_capacity vertices"
+    return {'vertices': np.empty((vertex_capacity, 2)),
+            'offsets': np.zeros(polygon_capacity + 1, dtype = np.int64),
+            'layers': np.empty(polygon_capacity, dtype = np.int32),
+            'datatypes': np.empty(polygon_capacity, dtype = np.int32),
+            'polygon_count': 0,
+            'vertex_count': 0}
+
+def is_polygon_store(target):
+    return isinstance(target, dict) and 'vertex_count' in target
+
+def reserve(store, number_of_polygons, number_of_vertices):
+    "Make room for number_of_polygons more polygons with number_of_vertices vertices in total (the capacities are at least doubled)"
+    vertex_end = store['vertex_count'] + number_of_vertices
+    if vertex_end > len(store['vertices']):
+        vertices = np.empty((max(vertex_end, 2 * len(store['vertices'])), 2))
+        vertices[:store['vertex_count']] = store['vertices'][:store['vertex_count']]
+        store['vertices'] = vertices
+    polygon_end = store['polygon_count'] + number_of_polygons
+    if polygon_end > len(store['layers']):
+        capacity = max(polygon_end, 2 * len(store['layers']))
+        for name, size in [('offsets', capacity + 1), ('layers', capacity), ('datatypes', capacity)]:
+            array = np.zeros(size, dtype = store[name].dtype)
+            array[:len(store[name])] = store[name]
+            store[name] = array
+
+def add_polygons(store, polygons, layer = 0, datatype = 0):
+    """
+    polygons: array of shape (number of polygons, number of points, 2) for polygons with the same number of vertices
+        (e.g. dot_matrix_polygons), or a list of vertex arrays
+    layer, datatype: a number for all the polygons, or an array with one value per polygon
+
+    Return: store
+    """
+    if isinstance(polygons, np.ndarray) and polygons.ndim == 3:
+        counts = np.full(len(polygons), polygons.shape[1], dtype = np.int64)
+        vertices = polygons.reshape(-1, 2)
+    else:
+        counts = np.array([len(points) for points in polygons], dtype = np.int64)
+        vertices = np.concatenate(polygons) if len(polygons) > 0 else np.zeros((0, 2))
+    reserve(store, len(counts), len(vertices))
+    first_polygon = store['polygon_count']
+    first_vertex = store['vertex_count']
+    store['vertices'][first_vertex:first_vertex + len(vertices)] = vertices
+    store['offsets'][first_polygon + 1:first_polygon + len(counts) + 1] = first_vertex + np.cumsum(counts)
+    store['layers'][first_polygon:first_polygon + len(counts)] = layer
+    store['datatypes'][first_polygon:first_polygon + len(counts)] = datatype
+    store['polygon_count'] += len(counts)
+    store['vertex_count'] += len(vertices)
+    return store
+
+def add_polygon_set(store, polygon_set):
+    "Add the polygons of a PolygonSet (e.g. the result of gdspy.boolean, None adds nothing) with their layers and datatypes; return store"
+    if polygon_set is not None:
+        add_polygons(store, polygon_set.polygons, np.array(polygon_set.layers), np.array(polygon_set.datatypes))
+    return store
+
+def store_arrays(store):
+    "Return views of the polygons of the store in the format of parallel_build.cell_to_arrays (nothing is copied)"
+    return {'vertices': store['vertices'][:store['vertex_count']],
+            'offsets': store['offsets'][:store['polygon_count'] + 1],
+            'layers': store['layers'][:store['polygon_count']],
+            'datatypes': store['datatypes'][:store['polygon_count']]}
+
+def boundary_dtype(number_of_points):
+    "Return the record layout of a GDS BOUNDARY element with number_of_points vertices (same bytes as gdspy.PolygonSet.to_gds)"
+    return np.dtype([('header', '>u2', 4), ('layer', '>i2'), ('datatype_header', '>u2', 2), ('datatype', '>i2'),
+                     ('xy_header', '>u2', 2), ('xy', '>i4', (number_of_points + 1, 2)), ('end', '>u2', 2)])
+
+def write_gds_polygons(outfile, arrays, multiplier, chunk_size = 2**16):
+    """
+    Write polygons as GDS BOUNDARY elements, without creating gdspy objects.
+    arrays: polygons in the format of parallel_build.cell_to_arrays (e.g. store_arrays)
+    multiplier: unit / precision of the library
+    chunk_size: number of polygons converted at a time
+
+    Return: the number of polygons written
+    """
+    vertices = arrays['vertices']
+    offsets = arrays['offsets']
+    counts = np.diff(offsets)
+    # Polygons with the same number of vertices are written together as one array of records
+    for number_of_points in np.unique(counts).tolist():
+        index = np.flatnonzero(counts == number_of_points)
+        if number_of_points > 8190:
+            # Too large for one XY record: written one at a time, split like gdspy does
+            for i in index.tolist():
+                outfile.write(struct.pack('>4Hh2Hh', 4, 0x0800, 6, 0x0D02, arrays['layers'][i], 6, 0x0E02, arrays['datatypes'][i]))
+                xy = np.empty((number_of_points + 1, 2), dtype = '>i4')
+                xy[:-1] = np.round(vertices[offsets[i]:offsets[i + 1]] * multiplier)
+                xy[-1] = xy[0]
+                for start in range(0, len(xy), 8190):
+                    outfile.write(struct.pack('>2H', 4 + 8 * len(xy[start:start + 8190]), 0x1003))
+                    outfile.write(xy[start:start + 8190].tobytes())
+                outfile.write(struct.pack('>2H', 4, 0x1100))
+            continue
+        # In chunks, so that the records take little memory next to the vertices
+        for start in range(0, len(index), chunk_size):
+            chunk = index[start:start + chunk_size]
+            records = np.empty(len(chunk), dtype = boundary_dtype(number_of_points))
+            records['header'] = (4, 0x0800, 6, 0x0D02)
+            records['layer'] = arrays['layers'][chunk]
+            records['datatype_header'] = (6, 0x0E02)
+            records['datatype'] = arrays['datatypes'][chunk]
+            records['xy_header'] = (12 + 8 * number_of_points, 0x1003)
+            points = offsets[chunk, np.newaxis] + np.arange(number_of_points)
+            records['xy'][:, :-1] = np.round(vertices[points] * multiplier)
+            records['xy'][:, -1] = records['xy'][:, 0]
+            records['end'] = (4, 0x1100)
+            outfile.write(records.tobytes())
+    return len(counts)
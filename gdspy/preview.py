@@ -0,0 +1,302 @@
+###############################
+# DESCRIPTION
+###############################
+## Raster preview of a cell, used instead of write_svg for quick visual checks of large layouts.
+## The cell is rasterized on a grid of pixels, the gray level of a pixel being the exact fraction of its area covered by
+## the polygons (see coverage_raster), so gratings finer than a pixel come out as even grays instead of aliasing,
+## and written as a pyramid of zoom levels, each level half the size of the previous one:
+##   + as PNG tiles: <directory>/<level>/<row>_<column>.png
+##   + or as one memory-mapped NumPy array per level: <directory>/level_<level>.npy (np.load(path, mmap_mode = 'r'))
+## <directory>/preview.json gives the position and pixel size of every level.
+## The hierarchy is not flattened: every cell is rasterized once per orientation and its instances (references,
+## CellArrays, rotation_matrix copies) are copied into the image, so the time depends on the number of pixels and of
+## distinct cells, not on the number of flattened shapes. Instances are placed to the nearest sub-pixel (supersample).
+## Usage: python preview.py input.gds output_directory [--cell main] [--size 1024] [--output png]
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import argparse
+import gdspy
+import json
+import numpy as np
+import os
+import struct
+import zlib
+from hierarchy import reference_matrix, reference_offsets, top_cell
+
+###############################
+# FUNCTIONS
+###############################
+
+def matrix_key(matrix):
+    return tuple(np.round(matrix, 12).ravel())
+
+def cell_vertices(cell, cache, layers = None):
+    """
+    Return (vertices, counts): the vertices of the polygons and paths of the cell itself (not of its references)
+    on the given layers, concatenated, and the number of vertices of each polygon
+    """
+    key = ('vertices', cell.name)
+    if key not in cache:
+        polygons = []
+        for polygon_set in cell.polygons:
+            for points, layer in zip(polygon_set.polygons, polygon_set.layers):
+                if layers is None or layer in layers:
+                    polygons.append(points)
+        for path in cell.paths:
+            for (layer, datatype), path_polygons in path.get_polygons(by_spec = True).items():
+                if layers is None or layer in layers:
+                    polygons.extend(path_polygons)
+        counts = np.array([len(points) for points in polygons], dtype = np.int64)
+        cache[key] = (np.concatenate(polygons) if len(polygons) > 0 else np.zeros((0, 2)), counts)
+    return cache[key]
+
+def cell_references(cell, matrix):
+    "Return (referenced cell, matrix of the referenced cell, positions of its copies) for the references of the cell"
+    references = []
+    for reference in cell.references:
+        if isinstance(reference.ref_cell, gdspy.Cell):
+            child_matrix = matrix @ reference_matrix(reference.rotation, reference.magnification, reference.x_reflection)
+            references.append((reference.ref_cell, child_matrix, reference_offsets(reference) @ matrix.T))
+    return references
+
+def cell_bounds(cell, matrix, cache, layers = None):
+    """
+    Return the lower-left and upper-right corners of the cell transformed by matrix, or None if the cell is empty
+    (same as cell.get_bounding_box() for the identity, without transforming the polygons of every copy)
+    """
+    key = ('bounds', cell.name, matrix_key(matrix))
+    if key in cache:
+        return cache[key]
+    lower = []
+    upper = []
+    vertices, counts = cell_vertices(cell, cache, layers)
+    if len(vertices) > 0:
+        points = vertices @ matrix.T
+        lower.append(points.min(axis = 0))
+        upper.append(points.max(axis = 0))
+    for child, child_matrix, offsets in cell_references(cell, matrix):
+        bounds = cell_bounds(child, child_matrix, cache, layers)
+        if bounds is not None:
+            lower.append(bounds[0] + offsets.min(axis = 0))
+            upper.append(bounds[1] + offsets.max(axis = 0))
+    cache[key] = (np.min(lower, axis = 0), np.max(upper, axis = 0)) if len(lower) > 0 else None
+    return cache[key]
+
+def coverage_raster(polygons, origin, pixel_size, height, width):
+    """
+    polygons: list of vertex arrays (polygons with holes made of cut lines are handled as well)
+    origin: coordinates of the corner of pixel (0, 0)
+
+    Return: array (height, width) of the fraction of the area of every pixel covered by the polygons (overlaps count once).
+    Every edge is cut at the pixel borders; a piece inside a pixel with a height dy and a mean x position fx (from the
+    left border of its pixel, in pixels) covers dy * (1 - fx) of that pixel and dy of every pixel to its right, so the
+    coverage is a cumulative sum along the rows.
+    """
+    counts = np.array([len(points) for points in polygons])
+    points = (np.concatenate(polygons) - origin) / pixel_size
+    starts = np.cumsum(counts) - counts
+    next_vertex = np.arange(len(points)) + 1
+    next_vertex[starts + counts - 1] = starts
+    x0, y0 = points[:, 0], points[:, 1]
+    x1, y1 = points[next_vertex, 0], points[next_vertex, 1]
+    # Counterclockwise polygons, so that every polygon adds a positive coverage
+    orientation = np.repeat(np.sign(np.add.reduceat(x0 * y1 - x1 * y0, starts)), counts)
+    # Parameters t in (0, 1) where every edge crosses a pixel border
+    cuts = [np.zeros(len(points)), np.ones(len(points))]
+    edges = [np.arange(len(points)), np.arange(len(points))]
+    for u0, u1 in [(x0, x1), (y0, y1)]:
+        first = np.floor(np.minimum(u0, u1)).astype(np.int64) + 1
+        number = np.maximum(np.ceil(np.maximum(u0, u1)).astype(np.int64) - first, 0)
+        edge = np.repeat(np.arange(len(points)), number)
+        border = first[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(number) - number, number)
+        cuts.append((border - u0[edge]) / (u1[edge] - u0[edge]))
+        edges.append(edge)
+    cuts = np.concatenate(cuts)
+    edges = np.concatenate(edges)
+    order = np.lexsort((cuts, edges))
+    cuts = cuts[order]
+    edges = edges[order]
+    # Pieces between two consecutive cuts of the same edge
+    same_edge = edges[1:] == edges[:-1]
+    t0 = cuts[:-1][same_edge]
+    t1 = cuts[1:][same_edge]
+    edge = edges[:-1][same_edge]
+    dx = x1[edge] - x0[edge]
+    dy = (y1[edge] - y0[edge]) * orientation[edge]
+    x_middle = x0[edge] + (t0 + t1) / 2 * dx
+    y_middle = y0[edge] + (t0 + t1) / 2 * (y1[edge] - y0[edge])
+    rows = np.floor(y_middle).astype(np.int64)
+    columns = np.floor(x_middle).astype(np.int64)
+    piece_dy = dy * (t1 - t0)
+    fraction = x_middle - columns
+    keep = (rows >= 0) & (rows < height) & (columns < width) & (piece_dy != 0)
+    # Pieces left of the window cover whole pixels of the window
+    columns = np.maximum(columns, -1)
+    index = rows[keep] * (width + 2) + columns[keep] + 1
+    accumulated = np.bincount(index, weights = piece_dy[keep] * (1 - fraction[keep]), minlength = height * (width + 2))
+    accumulated += np.bincount(index + 1, weights = piece_dy[keep] * fraction[keep], minlength = height * (width + 2))[:height * (width + 2)]
+    coverage = -np.cumsum(accumulated.reshape(height, width + 2), axis = 1)[:, 1:width + 1]
+    return np.clip(coverage, 0, 1)
+
+def cell_stamp(cell, matrix, pixel_size, cache, layers = None):
+    """
+    cell: gdspy Cell
+    matrix: 2x2 transformation applied to the cell
+    cache: dictionary of the stamps (and vertices) already computed, filled by this function
+
+    Return: (coverage, first_row, first_column); coverage[i, j] is the covered fraction of pixel (first_row + i,
+    first_column + j), pixel (row, column) being the square [column, column + 1) x [row, row + 1) times pixel_size around
+    the cell origin.
+    A cell is rendered once per matrix; all its instances with this orientation use the same stamp.
+    """
+    key = ('stamp', cell.name, matrix_key(matrix))
+    if key in cache:
+        return cache[key]
+    vertices, counts = cell_vertices(cell, cache, layers)
+    points = vertices @ matrix.T
+    placements = []
+    for child, child_matrix, offsets in cell_references(cell, matrix):
+        child_stamp = cell_stamp(child, child_matrix, pixel_size, cache, layers)
+        if child_stamp[0].size > 0:
+            placements.append((child_stamp, np.round(offsets / pixel_size).astype(np.int64)))
+    # Extent of the stamp in pixels: (first row, first column) and (end row, end column)
+    lower = []
+    upper = []
+    if len(points) > 0:
+        lower.append(np.floor(points.min(axis = 0)[::-1] / pixel_size).astype(np.int64))
+        upper.append(np.ceil(points.max(axis = 0)[::-1] / pixel_size).astype(np.int64))
+    for (coverage, first_row, first_column), shifts in placements:
+        lower.append(np.array([first_row, first_column]) + shifts[:, ::-1].min(axis = 0))
+        upper.append(np.array([first_row, first_column]) + shifts[:, ::-1].max(axis = 0) + coverage.shape)
+    if len(lower) == 0:
+        cache[key] = (np.zeros((0, 0), dtype = np.float32), 0, 0)
+        return cache[key]
+    first_row, first_column = np.min(lower, axis = 0)
+    height, width = np.max(upper, axis = 0) - (first_row, first_column)
+    if len(points) > 0:
+        polygons = np.split(points, np.cumsum(counts)[:-1])
+        stamp = coverage_raster(polygons, np.array([first_column, first_row]) * pixel_size, pixel_size, height, width).astype(np.float32)
+    else:
+        stamp = np.zeros((height, width), dtype = np.float32)
+    for (coverage, child_row, child_column), shifts in placements:
+        coverage_height, coverage_width = coverage.shape
+        for column_shift, row_shift in shifts:
+            row = child_row + row_shift - first_row
+            column = child_column + column_shift - first_column
+            stamp[row:row + coverage_height, column:column + coverage_width] += coverage
+    # Overlapping instances count once
+    np.minimum(stamp, 1, out = stamp)
+    cache[key] = (stamp, first_row, first_column)
+    return cache[key]
+
+def block_mean(image, factor):
+    "Return the mean of the image over blocks of factor x factor pixels (the image is padded with zeros)"
+    height = -(-image.shape[0] // factor) * factor
+    width = -(-image.shape[1] // factor) * factor
+    padded = np.zeros((height, width))
+    padded[:image.shape[0], :image.shape[1]] = image
+    return padded.reshape(height // factor, factor, width // factor, factor).mean(axis = (1, 3))
+
+def render_cell(cell, size = 1024, supersample = 4, layers = None):
+    """
+    size: number of pixels along the longest side of the image
+    supersample: every pixel is rasterized as supersample x supersample sub-pixels
+
+    Return: (image, x_min, y_max, pixel_size); image is an array of uint8 (0: empty, 255: fully covered), row 0 at the top,
+    and (x_min, y_max) is the corner of its top left pixel.
+    """
+    cache = {}
+    bounding_box = cell_bounds(cell, np.eye(2), cache, layers)
+    if bounding_box is None:
+        return np.zeros((0, 0), dtype = np.uint8), 0.0, 0.0, 1.0
+    pixel_size = max(bounding_box[1] - bounding_box[0]) / size
+    sub_pixel_size = pixel_size / supersample
+    stamp, first_row, first_column = cell_stamp(cell, np.eye(2), sub_pixel_size, cache, layers)
+    # Window of sub-pixels over the bounding box, exactly size pixels along its longest side (parts of instances
+    # rounded to a sub-pixel out of the box are cut)
+    window_row, window_column = np.floor(bounding_box[0][::-1] / sub_pixel_size + 1e-9).astype(np.int64)
+    window_height, window_width = np.ceil((bounding_box[1] - bounding_box[0])[::-1] / pixel_size - 1e-9).astype(np.int64) * supersample
+    window = np.zeros((window_height, window_width), dtype = np.float32)
+    row = first_row - window_row
+    column = first_column - window_column
+    source = stamp[max(0, -row):max(0, window_height - row), max(0, -column):max(0, window_width - column)]
+    window[max(0, row):max(0, row) + source.shape[0], max(0, column):max(0, column) + source.shape[1]] = source
+    coverage = block_mean(window[::-1], supersample)
+    x_min = window_column * sub_pixel_size
+    y_max = (window_row + window_height) * sub_pixel_size
+    return np.round(coverage * 255).astype(np.uint8), x_min, y_max, pixel_size
+
+def zoom_levels(image, number_of_levels):
+    "Return [image, image at half size, image at quarter size, ...] with number_of_levels images"
+    levels = [image]
+    while len(levels) < number_of_levels and min(levels[-1].shape) > 1:
+        levels.append(np.round(block_mean(levels[-1], 2)).astype(np.uint8))
+    return levels
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def write_png(path, image):
+    "Write a 2D array of uint8 as an 8-bit grayscale PNG file"
+    height, width = image.shape
+    # Every row starts with the filter type 0 (no filter)
+    rows = np.hstack((np.zeros((height, 1), dtype = np.uint8), image))
+    with open(path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n')
+        png_file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        png_file.write(png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        png_file.write(png_chunk(b'IEND', b''))
+
+def write_preview(cell, directory, size = 1024, number_of_levels = 4, tile_size = 256, output = 'png', supersample = 4, layers = None):
+    """
+    Write the zoom levels of the preview of cell in directory (see the description at the top of this file).
+    size: number of pixels along the longest side of the finest level
+    output: 'png' for PNG tiles of tile_size x tile_size pixels, 'npy' for one memory-mapped array per level
+
+    Return: the index written to preview.json
+    """
+    image, x_min, y_max, pixel_size = render_cell(cell, size, supersample, layers)
+    os.makedirs(directory, exist_ok = True)
+    index = {'cell': cell.name, 'output': output, 'x_min': x_min, 'y_max': y_max, 'levels': []}
+    for level, level_image in enumerate(zoom_levels(image, number_of_levels)):
+        height, width = level_image.shape
+        index['levels'].append({'pixel_size': pixel_size * 2**level, 'height': height, 'width': width})
+        if output == 'npy':
+            array = np.lib.format.open_memmap(os.path.join(directory, 'level_{}.npy'.format(level)), mode = 'w+', dtype = np.uint8, shape = (height, width))
+            array[:] = level_image
+            array.flush()
+            del array
+            continue
+        os.makedirs(os.path.join(directory, str(level)), exist_ok = True)
+        for row in range(0, height, tile_size):
+            for column in range(0, width, tile_size):
+                write_png(os.path.join(directory, str(level), '{}_{}.png'.format(row // tile_size, column // tile_size)),
+                          level_image[row:row + tile_size, column:column + tile_size])
+        index['levels'][-1]['tile_size'] = tile_size
+    with open(os.path.join(directory, 'preview.json'), 'w') as index_file:
+        json.dump(index, index_file, indent = 2)
+    return index
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Raster preview of a cell of a GDS file')
+    parser.add_argument('input')
+    parser.add_argument('directory')
+    parser.add_argument('--cell', default = None, help = 'cell to render (default: the top cell, if there is only one)')
+    parser.add_argument('--size', type = int, default = 1024, help = 'number of pixels along the longest side of the finest level')
+    parser.add_argument('--output', choices = ['png', 'npy'], default = 'png')
+    arguments = parser.parse_args()
+    lib = gdspy.GdsLibrary(infile = arguments.input)
+    try:
+        cell = top_cell(lib, arguments.cell)
+    except ValueError as error:
+        parser.error(str(error))
+    write_preview(cell, arguments.directory, arguments.size, output = arguments.output)
@@ -0,0 +1,188 @@
+###############################
+# DESCRIPTION
+###############################
+## Timing of the build stages: every builder call, reference builder and output stage records its wall time,
+## CPU time, the peak resident memory of the process and the number of polygons and vertices it produced.
+## Profiling is off by default; it is switched on by the environment variable PMMA_PROFILE=<report path>, and the report is
+## written when the program exits, or for one build by the --profile <report path> option of PMMA_pattern.py (see profiled),
+## and the report is written at the end of the build.
+## The report is a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) with two more entries:
+##   + stages: totals per stage name (e.g. hexagon_cell_recipe, write_gds)
+##   + cells: totals per cell
+## Stages run in worker processes (parallel_build.py) are sent back with the polygons and merged into the report.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: the peak memory is not recorded
+    resource = None
+
+###############################
+# FUNCTIONS
+###############################
+
+report_path = None
+owner_pid = None
+events = []
+
+def enable(path):
+    "Switch profiling on; the report is written to path when this process exits, if PMMA_PROFILE_OWNER is its pid or unset"
+    global report_path, owner_pid
+    if report_path is None:
+        atexit.register(write_report)
+    report_path = path
+    owner_pid = int(os.environ.get('PMMA_PROFILE_OWNER', os.getpid()))
+
+@contextlib.contextmanager
+def profiled(path):
+    """
+    Profile the stages run in the with block and write the report to path at its end, even if the block fails.
+    The worker processes started in the block record their stages too, but leave the report to this process: they get
+    the path and the pid of this process from PMMA_PROFILE and PMMA_PROFILE_OWNER, which are restored afterwards.
+    """
+    global report_path, owner_pid
+    previous = (report_path, owner_pid)
+    previous_environment = {name: os.environ.get(name) for name in ['PMMA_PROFILE', 'PMMA_PROFILE_OWNER']}
+    first_event = len(events)
+    os.environ['PMMA_PROFILE'] = path
+    os.environ['PMMA_PROFILE_OWNER'] = str(os.getpid())
+    report_path = path
+    owner_pid = os.getpid()
+    try:
+        yield
+    finally:
+        write_report(path, take_events(first_event))
+        report_path, owner_pid = previous
+        for name, value in previous_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def is_enabled():
+    return report_path is not None
+
+def peak_rss_kb():
+    "Return the peak resident memory of this process in kB (0 when it cannot be measured)"
+    if resource is None:
+        return 0
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    if sys.platform == 'darwin':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def count_geometry(polygon_sets):
+    "Return (number of polygons, number of vertices) of a list of PolygonSet"
+    polygons = 0
+    vertices = 0
+    for polygon_set in polygon_sets:
+        polygons += len(polygon_set.polygons)
+        vertices += sum(len(points) for points in polygon_set.polygons)
+    return polygons, vertices
+
+@contextlib.contextmanager
+def stage(name, cell = None):
+    """
+    Record one stage: with stage('write_gds'): ...
+    The yielded dictionary can be filled with more values, e.g. polygons and vertices, which are added to the record.
+    """
+    record = {}
+    if report_path is None:
+        yield record
+        return
+    start = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record.update({'name': name,
+                       'cell': cell,
+                       'start': start,
+                       'wall': time.perf_counter() - wall,
+                       'cpu': time.process_time() - cpu,
+                       'peak_rss_kb': peak_rss_kb(),
+                       'pid': os.getpid()})
+        events.append(record)
+
+def take_events(first = 0):
+    """
+    Return the records of this process from index first on, and forget them (used to send the records of a worker back;
+    a forked worker starts with a copy of the records of its parent, which are not sent again)
+    """
+    taken = events[first:]
+    del events[first:]
+    return taken
+
+def add_events(new_events):
+    "Add records made in another process"
+    events.extend(new_events)
+
+def roll_up(records, field):
+    "Return the sums of wall, cpu, polygons, vertices and references and the largest peak memory of the records, grouped by field"
+    totals = {}
+    for record in records:
+        if record[field] is None:
+            continue
+        total = totals.setdefault(record[field], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'polygons': 0, 'vertices': 0, 'references': 0, 'peak_rss_kb': 0})
+        total['calls'] += 1
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['polygons'] += record.get('polygons', 0)
+        total['vertices'] += record.get('vertices', 0)
+        total['references'] += record.get('references', 0)
+        total['peak_rss_kb'] = max(total['peak_rss_kb'], record['peak_rss_kb'])
+    return totals
+
+def build_report(records = None):
+    "Return the report of the records (default: all the records of this process) as a dictionary in Chrome trace format"
+    if records is None:
+        records = events
+    trace_events = []
+    for record in records:
+        arguments = {key: value for key, value in record.items() if key not in ('name', 'start', 'wall', 'pid')}
+        trace_events.append({'name': record['name'] if record['cell'] is None else '{} ({})'.format(record['name'], record['cell']),
+                             'ph': 'X',
+                             'ts': record['start'] * 1e6,
+                             'dur': record['wall'] * 1e6,
+                             'pid': record['pid'],
+                             'tid': record['pid'],
+                             'args': arguments})
+    return {'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'stages': roll_up(records, 'name'),
+            'cells': roll_up(records, 'cell')}
+
+def write_report(path = None, records = None):
+    """
+    Write the report of the records (default: all the records of this process) to path (default: the path given to
+    enable); only the process that enabled profiling writes it
+    """
+    if path is None:
+        if report_path is None or os.getpid() != owner_pid:
+            return
+        path = report_path
+    with open(path, 'w') as report_file:
+        json.dump(build_report(records), report_file, indent = 1)
+
+###############################
+# MAIN CODES
+###############################
+
+# Run when the module is imported, in the main process and in the workers; a main process started with PMMA_PROFILE
+# keeps the report for itself
+if os.environ.get('PMMA_PROFILE'):
+    os.environ.setdefault('PMMA_PROFILE_OWNER', str(os.getpid()))
+    enable(os.environ['PMMA_PROFILE'])
@@ -0,0 +1,318 @@
+###############################
+# DESCRIPTION
+###############################
+## Proximity-effect correction of the e-beam exposure of PMMA.
+## The polygons of a cell are rasterized with NumPy and convolved (with FFTs) with the double-Gaussian point-spread function
+##     f(r) = 1 / (pi (1 + eta)) * (exp(-r^2 / alpha^2) / alpha^2 + eta * exp(-r^2 / beta^2) / beta^2)
+## alpha: forward-scattering range, beta: backscattering range, eta: backscattered / forward-scattered energy.
+## The forward term is computed on a fine grid (pixel_size), the backscattered term on a coarse grid (about beta / 10).
+## The energy is normalized so that the inside of a large pad exposed with dose 1 receives 1.
+## The dose of every polygon is iterated until the mean energy it absorbs equals the target, then the doses are
+## rounded to a few dose classes written as GDS datatypes (see dose_classes).
+## The layout is processed in square tiles with an overlap of 3 beta, so the memory use does not depend on its size.
+## alpha, beta and eta depend on the beam energy and the substrate and must come from a calibration.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import argparse
+import gdspy
+import json
+import numpy as np
+from hierarchy import top_cell
+
+###############################
+# FUNCTIONS
+###############################
+
+def polygon_spans(polygons, origin, pixel_size):
+    """
+    polygons: list of vertex arrays
+    origin: coordinates of the corner of pixel (0, 0)
+
+    Return: (rows, first_columns, end_columns, polygon_index) of the horizontal runs of pixels whose centers are inside
+    each polygon (even-odd rule); end_columns are excluded. Polygons with holes made of cut lines are handled as well.
+    """
+    counts = np.array([len(points) for points in polygons])
+    points = (np.concatenate(polygons) - origin) / pixel_size - 0.5
+    polygon_of_edge = np.repeat(np.arange(len(polygons)), counts)
+    # Index of the second vertex of every edge, wrapping around each polygon
+    next_vertex = np.arange(len(points)) + 1
+    ends = np.cumsum(counts)
+    next_vertex[ends - 1] = ends - counts
+    u0, v0 = points[:, 0], points[:, 1]
+    u1, v1 = points[next_vertex, 0], points[next_vertex, 1]
+    # An edge crosses the rows whose center v verifies min(v0, v1) <= v < max(v0, v1)
+    first_row = np.ceil(np.minimum(v0, v1)).astype(np.int64)
+    end_row = np.ceil(np.maximum(v0, v1)).astype(np.int64)
+    number_of_rows = np.maximum(end_row - first_row, 0)
+    edge = np.repeat(np.arange(len(points)), number_of_rows)
+    rows = first_row[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(number_of_rows) - number_of_rows, number_of_rows)
+    slope = (u1[edge] - u0[edge]) / (v1[edge] - v0[edge])
+    crossings = u0[edge] + (rows - v0[edge]) * slope
+    polygon_index = polygon_of_edge[edge]
+    # Pair the crossings of the same polygon and row from left to right
+    order = np.lexsort((crossings, rows, polygon_index))
+    crossings = crossings[order]
+    rows = rows[order][0::2]
+    polygon_index = polygon_index[order][0::2]
+    first_columns = np.ceil(crossings[0::2]).astype(np.int64)
+    end_columns = np.ceil(crossings[1::2]).astype(np.int64)
+    keep = end_columns > first_columns
+    return rows[keep], first_columns[keep], end_columns[keep], polygon_index[keep]
+
+def gaussian_kernel(spread, pixel_size, radius):
+    "Return exp(-r^2 / spread^2) sampled on a (2 radius + 1)^2 grid and normalized to a sum of 1"
+    coordinates = np.arange(-radius, radius + 1) * pixel_size
+    profile = np.exp(-coordinates**2 / max(spread, 1e-3 * pixel_size)**2)
+    kernel = np.outer(profile, profile)
+    return kernel / kernel.sum()
+
+def fast_length(length):
+    "Return the smallest number >= length with no prime factor other than 2, 3 and 5 (fast FFT sizes)"
+    best = 2 * length
+    power_of_5 = 1
+    while power_of_5 < best:
+        power_of_3 = power_of_5
+        while power_of_3 < best:
+            size = power_of_3
+            while size < length:
+                size *= 2
+            best = min(best, size)
+            power_of_3 *= 3
+        power_of_5 *= 5
+    return best
+
+def fft_convolve(image, kernel):
+    "Return the convolution of image with a centered kernel, same shape as image, with zero padding"
+    shape = (fast_length(image.shape[0] + kernel.shape[0] - 1), fast_length(image.shape[1] + kernel.shape[1] - 1))
+    result = np.fft.irfft2(np.fft.rfft2(image, shape) * np.fft.rfft2(kernel, shape), shape)
+    top = kernel.shape[0] // 2
+    left = kernel.shape[1] // 2
+    return result[top:top + image.shape[0], left:left + image.shape[1]]
+
+def span_raster(spans, doses, first_row, first_column, height, width, row_factor = 1):
+    """
+    Return the dose-weighted number of covered pixels of the window (height rows of row_factor fine rows, width fine columns),
+    accumulated per window row and fine column.
+    """
+    rows, first_columns, end_columns, polygon_index = spans
+    window_rows = rows // row_factor - first_row
+    starts = np.clip(first_columns - first_column, 0, width)
+    ends = np.clip(end_columns - first_column, 0, width)
+    keep = (window_rows >= 0) & (window_rows < height) & (ends > starts)
+    weights = doses[polygon_index[keep]]
+    index = np.concatenate((window_rows[keep] * (width + 1) + starts[keep], window_rows[keep] * (width + 1) + ends[keep]))
+    difference = np.bincount(index, weights = np.concatenate((weights, -weights)), minlength = height * (width + 1))
+    return np.cumsum(difference.reshape(height, width + 1), axis = 1)[:, :width]
+
+def tile_margins(window, alpha, beta, pixel_size, coarse_factor):
+    """
+    window: (first_row, end_row, first_column, end_column) in fine pixels of the polygons of a tile
+
+    Return: (fine window, (coarse first row, coarse first column, coarse height, coarse width)), the fine window having a
+    margin of 3 alpha and the coarse one a margin of 3 beta
+    """
+    first_row, end_row, first_column, end_column = window
+    margin = int(np.ceil(3 * alpha / pixel_size))
+    fine_window = (first_row - margin, end_row + margin, first_column - margin, end_column + margin)
+    coarse_margin = int(np.ceil(3 * beta / (coarse_factor * pixel_size)))
+    coarse_first_row = first_row // coarse_factor - coarse_margin
+    coarse_first_column = first_column // coarse_factor - coarse_margin
+    coarse_height = (end_row - 1) // coarse_factor + coarse_margin + 1 - coarse_first_row
+    coarse_width = (end_column - 1) // coarse_factor + coarse_margin + 1 - coarse_first_column
+    return fine_window, (coarse_first_row, coarse_first_column, coarse_height, coarse_width)
+
+def tile_spans(spans, windows, alpha, beta, pixel_size, coarse_factor):
+    """
+    windows: pixel window of every tile (see tile_energies)
+
+    Return: for every tile, the indices of the spans that reach its window with the margins of tile_margins (the spans
+    that can add energy to its polygons)
+    """
+    rows, first_columns, end_columns, polygon_index = spans
+    order = np.argsort(rows, kind = 'stable')
+    sorted_rows = rows[order]
+    buckets = []
+    for window in windows:
+        fine_window, (coarse_first_row, coarse_first_column, coarse_height, coarse_width) = tile_margins(window, alpha, beta, pixel_size, coarse_factor)
+        first_row = min(fine_window[0], coarse_first_row * coarse_factor)
+        end_row = max(fine_window[1], (coarse_first_row + coarse_height) * coarse_factor)
+        first_column = min(fine_window[2], coarse_first_column * coarse_factor)
+        end_column = max(fine_window[3], (coarse_first_column + coarse_width) * coarse_factor)
+        candidates = order[np.searchsorted(sorted_rows, first_row):np.searchsorted(sorted_rows, end_row)]
+        keep = (end_columns[candidates] > first_column) & (first_columns[candidates] < end_column)
+        buckets.append(np.sort(candidates[keep]))
+    return buckets
+
+def tile_energies(spans, own_spans, doses, assigned, window, alpha, beta, eta, pixel_size, coarse_factor):
+    """
+    Return the mean absorbed energy of the polygons in assigned (sorted array of polygon indices).
+    spans: the spans reaching the window of the tile (see tile_spans)
+    own_spans: boolean array, True for the spans of the polygons in assigned
+    window: (first_row, end_row, first_column, end_column) in fine pixels, containing all the pixels of these polygons
+    """
+    rows, first_columns, end_columns, polygon_index = spans
+    first_row, end_row, first_column, end_column = window
+    fine_window, (coarse_first_row, coarse_first_column, coarse_height, coarse_width) = tile_margins(window, alpha, beta, pixel_size, coarse_factor)
+    # Forward scattering on the fine grid, with a margin of 3 alpha
+    margin = first_row - fine_window[0]
+    fine_height = fine_window[1] - fine_window[0]
+    fine_width = fine_window[3] - fine_window[2]
+    fine_image = span_raster(spans, doses, fine_window[0], fine_window[2], fine_height, fine_width)
+    forward = fft_convolve(fine_image, gaussian_kernel(alpha, pixel_size, margin))
+    # Backscattering on the coarse grid, with a margin of 3 beta
+    coarse_size = coarse_factor * pixel_size
+    coarse_margin = first_row // coarse_factor - coarse_first_row
+    coarse_image = span_raster(spans, doses, coarse_first_row, coarse_first_column * coarse_factor,
+                               coarse_height, coarse_width * coarse_factor, row_factor = coarse_factor)
+    coarse_image = coarse_image.reshape(coarse_height, coarse_width, coarse_factor).sum(axis = 2) / coarse_factor**2
+    backward = fft_convolve(coarse_image, gaussian_kernel(beta, coarse_size, coarse_margin))
+    # Sum of both terms over the spans of the assigned polygons
+    span_rows = rows[own_spans]
+    span_starts = first_columns[own_spans]
+    span_ends = end_columns[own_spans]
+    span_polygons = polygon_index[own_spans]
+    forward_sums = np.concatenate((np.zeros((fine_height, 1)), np.cumsum(forward, axis = 1)), axis = 1)
+    fine_rows = span_rows - fine_window[0]
+    forward_energy = forward_sums[fine_rows, span_ends - fine_window[2]] - forward_sums[fine_rows, span_starts - fine_window[2]]
+    # The coarse map is integrated along the fine columns of each span
+    backward_sums = np.concatenate((np.zeros((coarse_height, 1)), np.cumsum(backward, axis = 1)), axis = 1) * coarse_factor
+    coarse_rows = span_rows // coarse_factor - coarse_first_row
+    def integral(columns):
+        coarse_columns = columns // coarse_factor - coarse_first_column
+        remainder = columns % coarse_factor
+        value = backward[coarse_rows, np.minimum(coarse_columns, coarse_width - 1)]
+        return backward_sums[coarse_rows, coarse_columns] + remainder * value
+    backward_energy = integral(span_ends) - integral(span_starts)
+    energy = (forward_energy + eta * backward_energy) / (1 + eta)
+    position = np.searchsorted(assigned, span_polygons)
+    total_energy = np.bincount(position, weights = energy, minlength = len(assigned))
+    pixel_count = np.bincount(position, weights = span_ends - span_starts, minlength = len(assigned))
+    return total_energy / np.maximum(pixel_count, 1)
+
+def proximity_correct(polygons, alpha = 0.01, beta = 10.0, eta = 0.5, pixel_size = 0.01, coarse_pixel_size = None,
+                      tile_size = 10.0, target = 1.0, iterations = 10, tolerance = 1e-3, min_dose = 0.5, max_dose = 5.0):
+    """
+    polygons: list of vertex arrays (a flattened cell), in um
+    alpha, beta, eta: parameters of the point-spread function (alpha and beta in um)
+    pixel_size: size of the fine pixels; the smallest features should be several pixels wide
+    coarse_pixel_size: size of the pixels used for backscattering (default beta / 10)
+    tile_size: side of the tiles; each polygon belongs to the tile containing the center of its bounding box
+    target: mean absorbed energy every polygon should receive
+    iterations, tolerance: the iteration stops when the largest relative dose change is below tolerance
+    min_dose, max_dose: limits of the dose factors
+
+    Return: (dose factors, mean absorbed energy) of every polygon
+    """
+    if coarse_pixel_size is None:
+        coarse_pixel_size = beta / 10
+    coarse_factor = max(1, int(round(coarse_pixel_size / pixel_size)))
+    all_points = np.concatenate(polygons)
+    origin = all_points.min(axis = 0)
+    spans = polygon_spans(polygons, origin, pixel_size)
+    rows, first_columns, end_columns, polygon_index = spans
+    # Pixel window of every polygon
+    number_of_polygons = len(polygons)
+    polygon_first_row = np.full(number_of_polygons, np.iinfo(np.int64).max)
+    polygon_end_row = np.zeros(number_of_polygons, dtype = np.int64)
+    polygon_first_column = np.full(number_of_polygons, np.iinfo(np.int64).max)
+    polygon_end_column = np.zeros(number_of_polygons, dtype = np.int64)
+    np.minimum.at(polygon_first_row, polygon_index, rows)
+    np.maximum.at(polygon_end_row, polygon_index, rows + 1)
+    np.minimum.at(polygon_first_column, polygon_index, first_columns)
+    np.maximum.at(polygon_end_column, polygon_index, end_columns)
+    # Polygons smaller than a pixel are left at dose 1
+    has_pixels = polygon_end_row > 0
+    centers = np.array([(points.min(axis = 0) + points.max(axis = 0)) / 2 for points in polygons])
+    tile_of_polygon = np.floor((centers - origin) / tile_size).astype(np.int64)
+    tiles = {}
+    for index in np.flatnonzero(has_pixels):
+        tiles.setdefault(tuple(tile_of_polygon[index]), []).append(index)
+    tiles = [np.array(assigned) for assigned in tiles.values()]
+    windows = [(polygon_first_row[assigned].min(), polygon_end_row[assigned].max(),
+                polygon_first_column[assigned].min(), polygon_end_column[assigned].max()) for assigned in tiles]
+    # The spans of every tile (with its margins) are selected once for all the iterations
+    tile_number = np.full(number_of_polygons, -1)
+    for number, assigned in enumerate(tiles):
+        tile_number[assigned] = number
+    buckets = []
+    for number, bucket in enumerate(tile_spans(spans, windows, alpha, beta, pixel_size, coarse_factor)):
+        bucket_spans = (rows[bucket], first_columns[bucket], end_columns[bucket], polygon_index[bucket])
+        buckets.append((bucket_spans, tile_number[bucket_spans[3]] == number))
+    doses = np.ones(number_of_polygons)
+    energies = np.zeros(number_of_polygons)
+    for iteration in range(iterations):
+        for assigned, window, (bucket_spans, own_spans) in zip(tiles, windows, buckets):
+            energies[assigned] = tile_energies(bucket_spans, own_spans, doses, assigned, window, alpha, beta, eta, pixel_size, coarse_factor)
+        # All the tiles use the doses of the previous iteration
+        new_doses = doses.copy()
+        new_doses[has_pixels] = np.clip(doses[has_pixels] * target / np.maximum(energies[has_pixels], 1e-12), min_dose, max_dose)
+        change = np.max(np.abs(new_doses - doses) / doses)
+        doses = new_doses
+        if change < tolerance:
+            break
+    return doses, energies
+
+def dose_classes(doses, number_of_classes = 16, first_datatype = 1):
+    """
+    Round the dose factors to number_of_classes values evenly spaced on a log scale between the smallest and largest dose.
+
+    Return: (datatype of every polygon, {datatype: dose factor})
+    """
+    dose_min = doses.min()
+    dose_max = doses.max()
+    if dose_max / dose_min < 1 + 1e-9:
+        return np.full(len(doses), first_datatype), {first_datatype: float(dose_min)}
+    class_doses = np.geomspace(dose_min, dose_max, number_of_classes)
+    position = np.log(doses / dose_min) / np.log(dose_max / dose_min) * (number_of_classes - 1)
+    classes = np.rint(position).astype(int)
+    table = {first_datatype + i: float(dose) for i, dose in enumerate(class_doses) if np.any(classes == i)}
+    return first_datatype + classes, table
+
+def proximity_correct_cell(cell, number_of_classes = 16, **kwargs):
+    """
+    Correct a cell (flattened) with proximity_correct; kwargs are passed to it.
+
+    Return: (new cell named '<cell>_pec' with the dose class of every polygon as its datatype, {datatype: dose factor})
+    """
+    polygons = []
+    layers = []
+    for (layer, datatype), layer_polygons in cell.get_polygons(by_spec = True).items():
+        polygons.extend(layer_polygons)
+        layers.extend([layer] * len(layer_polygons))
+    doses, energies = proximity_correct(polygons, **kwargs)
+    datatypes, table = dose_classes(doses, number_of_classes)
+    corrected_cell = gdspy.Cell(cell.name + '_pec', exclude_from_current = True)
+    layers = np.array(layers)
+    for layer, datatype in sorted(set(zip(layers.tolist(), datatypes.tolist()))):
+        index = np.flatnonzero((layers == layer) & (datatypes == datatype))
+        corrected_cell.add(gdspy.PolygonSet([polygons[i] for i in index], layer = layer, datatype = datatype))
+    return corrected_cell, table
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    # Usage: python proximity_correction.py input.gds output.gds [--cell main]
+    # The dose factor of every datatype is written to output.gds.doses.json
+    parser = argparse.ArgumentParser(description = 'Proximity-effect correction of a cell of a GDS file')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--cell', default = None, help = 'cell to correct (default: the top cell, if there is only one)')
+    arguments = parser.parse_args()
+    lib = gdspy.GdsLibrary(infile = arguments.input)
+    try:
+        cell = top_cell(lib, arguments.cell)
+    except ValueError as error:
+        parser.error(str(error))
+    corrected_cell, table = proximity_correct_cell(cell)
+    output_lib = gdspy.GdsLibrary()
+    output_lib.add(corrected_cell)
+    output_lib.write_gds(arguments.output)
+    with open(arguments.output + '.doses.json', 'w') as table_file:
+        json.dump(table, table_file, indent = 2)
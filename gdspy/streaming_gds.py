@@ -0,0 +1,128 @@
+###############################
+# DESCRIPTION
+###############################
+## Write a layout spec (see layout_spec.py) to GDSII one cell at a time, without a GdsLibrary holding the whole layout.
+## Each cell is written as soon as it is built and its polygons are dropped right after.
+## Recipes that are generator functions (e.g. dot_field_stream_recipe) are written polygon set by polygon set,
+## so even a single cell with millions of dots never needs to be in memory at once.
+## The polygons of the other recipes are written straight from their arrays (see polygon_store.write_gds_polygons).
+## No SVG image is written in this mode, because it would need the whole layout.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import datetime
+import gdspy
+import inspect
+import os
+import profiling
+import struct
+import sys
+from layout_spec import add_references, compile_layout, load_layout_spec
+from parallel_build import build_cells
+from polygon_store import write_gds_polygons
+
+###############################
+# FUNCTIONS
+###############################
+
+def write_cell_header(outfile, name, timestamp = None):
+    "Write the BGNSTR and STRNAME records of a cell (same records as gdspy.Cell.to_gds)"
+    now = datetime.datetime.today() if timestamp is None else timestamp
+    if len(name) % 2 != 0:
+        name = name + '\0'
+    outfile.write(struct.pack('>2H12h2H', 28, 0x0502,
+                              now.year, now.month, now.day, now.hour, now.minute, now.second,
+                              now.year, now.month, now.day, now.hour, now.minute, now.second,
+                              4 + len(name), 0x0606))
+    outfile.write(name.encode('ascii'))
+
+def write_cell_footer(outfile):
+    "Write the ENDSTR record of a cell"
+    outfile.write(struct.pack('>2H', 4, 0x0700))
+
+def write_streamed_cell(outfile, multiplier, name, elements, timestamp = None):
+    """
+    outfile: open binary file, after the library header
+    multiplier: unit / precision of the library
+    elements: iterable of PolygonSet, CellReference, CellArray or polygon arrays (format of parallel_build.cell_to_arrays);
+        each one is written as soon as it is produced
+
+    Return: the number of elements written
+    """
+    write_cell_header(outfile, name, timestamp)
+    count = 0
+    for element in elements:
+        if isinstance(element, dict):
+            write_gds_polygons(outfile, element, multiplier)
+        else:
+            element.to_gds(outfile, multiplier)
+        count += 1
+    write_cell_footer(outfile)
+    return count
+
+def node_elements(node, stub_lib, cache_dir = None):
+    """
+    Yield the polygons (polygon sets or arrays) and the references of one node of the build graph (see layout_spec.compile_layout).
+    stub_lib: library with an empty cell for every referenced cell; writing a reference only needs the cell name.
+    Ordinary recipes go through the geometry cache; generator recipes are consumed as they yield.
+    """
+    for recipe in node['recipes']:
+        cell_name, builder, kwargs = recipe
+        if inspect.isgeneratorfunction(builder):
+            yield from builder(gdspy.Cell(cell_name, exclude_from_current = True), **kwargs)
+        else:
+            yield from build_cells([recipe], max_workers = 1, cache_dir = cache_dir)[cell_name]
+    cell = gdspy.Cell(node['name'], exclude_from_current = True)
+    add_references(stub_lib, cell, node['references'])
+    yield from cell.references
+
+def write_layout_streaming(nodes, gds_path, cache_dir = None, unit = 1.0e-6, precision = 1.0e-9):
+    """
+    Write the cells of the build graph to gds_path one at a time.
+    Cells created by the reference builders (e.g. the row cells of rotated_row_array) are written once, after the cell that made them.
+
+    Return: the names of the cells written
+    """
+    multiplier = unit / precision
+    written = []
+    with open(gds_path, 'wb') as outfile:
+        writer = gdspy.GdsWriter(outfile, unit = unit, precision = precision)
+        for node in nodes:
+            stub_lib = gdspy.GdsLibrary()
+            referenced = set(cell_name for builder, cell_name, params in node['references'])
+            for cell_name in referenced:
+                stub_lib.add(gdspy.Cell(cell_name, exclude_from_current = True))
+            with profiling.stage('write_streamed_cell', node['name']) as record:
+                record['elements'] = write_streamed_cell(outfile, multiplier, node['name'], node_elements(node, stub_lib, cache_dir))
+            written.append(node['name'])
+            for cell_name, cell in stub_lib.cells.items():
+                if cell_name not in referenced and cell_name not in written:
+                    writer.write_cell(cell)
+                    written.append(cell_name)
+            del stub_lib
+        writer.close()
+    return written
+
+def stream_spec(spec, output_dir = '.', cache_dir = 'geometry_cache'):
+    """
+    Build the layout of a spec and stream it to its GDS file in output_dir.
+
+    Return: the names of the cells written
+    """
+    nodes = compile_layout(spec)
+    return write_layout_streaming(nodes, os.path.join(output_dir, spec['gds']), cache_dir = os.path.join(output_dir, cache_dir))
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    # Usage: python streaming_gds.py spec.json [output directory]
+    if len(sys.argv) > 2:
+        stream_spec(load_layout_spec(sys.argv[1]), sys.argv[2])
+    else:
+        stream_spec(load_layout_spec(sys.argv[1]))
@@ -0,0 +1,10 @@
+###############################
+# DESCRIPTION
+###############################
+## The modules of this folder import each other by plain name, so the folder is put on the path for the tests.
+###############################
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+###############################
+# DESCRIPTION
+###############################
+## Helpers shared by the tests: comparison of two patterns by the area of their XOR, and the area change expected from
+## the rounding of gdspy.boolean to its precision grid, and a small hierarchical library.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import PMMA_pattern
+import polygon_store
+from parallel_build import arrays_to_polygon_sets
+
+###############################
+# FUNCTIONS
+###############################
+
+def xor_area(pattern1, pattern2):
+    "Return the area of pattern1 XOR pattern2 (PolygonSets, lists of them or cells, None for an empty pattern)"
+    if isinstance(pattern1, gdspy.Cell):
+        pattern1 = pattern1.get_polygonsets()
+    if isinstance(pattern2, gdspy.Cell):
+        pattern2 = pattern2.get_polygonsets()
+    difference = gdspy.boolean(pattern1, pattern2, 'xor')
+    return 0.0 if difference is None else difference.area()
+
+def rounding_tolerance(pattern, precision = 1e-3):
+    """
+    Return the largest area change expected from rounding the vertices of pattern to the precision grid of gdspy.boolean
+    (every edge moves by up to precision / 2): precision / 2 times the perimeter of the polygons
+    """
+    perimeter = sum(np.sum(np.linalg.norm(np.roll(points, -1, axis = 0) - points, axis = 1)) for points in pattern.polygons)
+    return precision / 2 * perimeter
+
+def store_pattern(store):
+    "Return the polygons of a polygon store as a list of PolygonSets"
+    return arrays_to_polygon_sets(polygon_store.store_arrays(store))
+
+def small_library():
+    "Return a library with a rectangle matrix cell, a rotated copy of it and a top cell referencing both"
+    lib = gdspy.GdsLibrary()
+    rectangles = gdspy.Cell('rectangles', exclude_from_current = True)
+    PMMA_pattern.rectangle_pattern(0, 0, 0.5, 0.2, 0.3, 0.3, 4, 3, rectangles)
+    top = gdspy.Cell('top', exclude_from_current = True)
+    PMMA_pattern.rotation_matrix(top, rectangles, 0, 0, 1, 0, 90, 45, 5, 5, 2)
+    top.add(gdspy.Round((-3, -3), 0.5, 1e-4))
+    lib.add([rectangles, top])
+    return lib
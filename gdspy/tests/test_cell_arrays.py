@@ -0,0 +1,53 @@
+###############################
+# DESCRIPTION
+###############################
+## Equivalence of the hierarchical builders (rectangle_cell_array, the polygon store branch of rectangle_pattern,
+## rotation_cell_array) with the flat builders rectangle_pattern and rotation_matrix, measured by the area of the XOR of
+## the flattened patterns (see layout_checks.py).
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import PMMA_pattern
+import polygon_store
+from layout_checks import store_pattern, xor_area
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_rectangle_builders_match_rectangle_pattern():
+    parameters = dict(x_top = -1, y_top = 2, length = 0.3, width = 0.1, dx = 0.05, dy = 0.2, num_horizontal_patterns = 7, num_vertical_array = 4)
+    original = PMMA_pattern.rectangle_pattern(main_cell = gdspy.Cell('original', exclude_from_current = True), **parameters)
+    array_cell = PMMA_pattern.rectangle_cell_array(main_cell = gdspy.Cell('array', exclude_from_current = True),
+                                                   unit_cell = gdspy.Cell('unit', exclude_from_current = True), **parameters)
+    store = PMMA_pattern.rectangle_pattern(main_cell = polygon_store.new_polygon_store(), **parameters)
+    assert len(array_cell.get_polygons()) == 28
+    assert xor_area(original, array_cell) < 1e-6
+    assert xor_area(original, store_pattern(store)) < 1e-6
+
+def test_rotation_cell_array_matches_rotation_matrix():
+    pattern_cell = gdspy.Cell('pattern', exclude_from_current = True)
+    PMMA_pattern.rectangle_pattern(0, 0, 0.4, 0.1, 0.1, 0.1, 2, 2, pattern_cell)
+    parameters = dict(pattern_cell = pattern_cell, x_coor = 1, y_coor = -1, magnification_value = 1.5, start_angle = 0, final_angle = 60,
+                      rotation_angle_increment = 15, dx = 2, dy = 2.5, num_of_horizontal_copies = 3)
+    original = PMMA_pattern.rotation_matrix(main_cell = gdspy.Cell('original', exclude_from_current = True), **parameters)
+    lib = gdspy.GdsLibrary()
+    array_cell = PMMA_pattern.rotation_cell_array(lib = lib, main_cell = gdspy.Cell('array', exclude_from_current = True), **parameters)
+    assert len(array_cell.references) == 5
+    assert len(array_cell.get_polygons()) == len(original.get_polygons())
+    assert xor_area(original, array_cell) < 1e-6
+
+def test_rotation_cell_array_reuses_the_row_cells():
+    pattern_cell = gdspy.Cell('pattern', exclude_from_current = True).add(gdspy.Rectangle((0, 0), (1, 0.2)))
+    lib = gdspy.GdsLibrary()
+    main_cell = gdspy.Cell('main', exclude_from_current = True)
+    PMMA_pattern.rotation_cell_array(lib, main_cell, pattern_cell, 0, 0, 1, 0, 30, 15, 2, 2, 4)
+    PMMA_pattern.rotation_cell_array(lib, main_cell, pattern_cell, 0, 10, 1, 0, 30, 15, 2, 2, 4)
+    assert sorted(lib.cells) == ['pattern_0', 'pattern_15', 'pattern_30']
+    assert len(main_cell.get_polygons()) == 24
@@ -0,0 +1,51 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the geometric comparison of two layouts: choice of the compared cell and equivalence of identical layouts.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import compare_layouts
+import gdspy
+import numpy as np
+import pytest
+from layout_checks import small_library
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_compare_layouts_default_cells():
+    lib1 = small_library()
+    lib2 = small_library()
+    assert compare_layouts.default_cells(lib1, lib2) == ['top']
+    # The same top cells in both libraries are all compared
+    lib1.add(gdspy.Cell('other', exclude_from_current = True))
+    lib2.add(gdspy.Cell('other', exclude_from_current = True))
+    assert compare_layouts.default_cells(lib1, lib2) == ['other', 'top']
+    lib2.add(gdspy.Cell('extra', exclude_from_current = True))
+    with pytest.raises(ValueError):
+        compare_layouts.default_cells(lib1, lib2)
+    report = compare_layouts.compare_layouts(compare_layouts.flattened_layers(lib1, 'top'), compare_layouts.flattened_layers(lib2, 'top'), max_workers = 1)
+    assert report['equivalent']
+
+def test_compare_layouts_finds_a_moved_polygon():
+    lib1 = small_library()
+    lib2 = small_library()
+    lib2.cells['top'].add(gdspy.Rectangle((-10, -10), (-9, -9)))
+    report = compare_layouts.compare_layouts(compare_layouts.flattened_layers(lib1, 'top'), compare_layouts.flattened_layers(lib2, 'top'), max_workers = 1)
+    assert not report['equivalent']
+    assert len(report['regions']) == 1 and abs(report['regions'][0]['area'] - 1) < 1e-6
+
+def test_difference_regions_ignore_slivers_of_the_database_grid():
+    # XOR piece between two builds of the same dots rounded differently to the database unit (area of 2 units)
+    sliver = np.array([[162.24, -72.252], [162.253, -72.27], [162.249, -72.264], [162.248, -72.263], [162.24, -72.252],
+                       [162.202, -72.265], [162.205, -72.264]])
+    assert compare_layouts.difference_regions([sliver], 1e-3, 1e-3) == []
+    square = np.array([[0, 0], [0.01, 0], [0.01, 0.01], [0, 0.01]])
+    assert len(compare_layouts.difference_regions([square], 1e-3, 1e-3)) == 1
@@ -0,0 +1,45 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the deduplication pass: identical cells are merged into the one with the first name, repeated polygons
+## become references, and the flattened geometry does not change.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import deduplication
+import gdspy
+import numpy as np
+from layout_checks import small_library, xor_area
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_deduplication_keeps_the_geometry():
+    lib = gdspy.GdsLibrary()
+    cell_a = gdspy.Cell('a', exclude_from_current = True).add(gdspy.Rectangle((0, 0), (1, 1)))
+    cell_b = gdspy.Cell('b', exclude_from_current = True).add(gdspy.Rectangle((5, 5), (6, 6)))
+    top = gdspy.Cell('top', exclude_from_current = True)
+    top.add([gdspy.CellReference(cell_a, (0, 0)), gdspy.CellReference(cell_b, (10, 0), rotation = 90)])
+    lib.add([cell_a, cell_b, top])
+    polygons = top.get_polygons()
+    bounding_box = top.get_bounding_box()
+    # The cell with the first name is kept, whatever the order of the library
+    assert deduplication.deduplicate_library(lib, min_count = 0)['merged_cells'] == {'b': 'a'}
+    assert {reference.ref_cell.name for reference in top.references} == {'a'}
+    assert np.allclose(top.get_bounding_box(), bounding_box)
+    assert gdspy.boolean(polygons, top.get_polygons(), 'xor') is None
+
+def test_repeated_polygons_become_references():
+    lib = small_library()
+    polygons = lib.cells['top'].get_polygons()
+    report = deduplication.deduplicate_library(lib)
+    # The 12 rectangles of the matrix are one shape repeated on a regular grid
+    assert report['extracted_polygons'] == 12
+    assert len(lib.cells['rectangles'].polygons) == 0
+    assert xor_area(polygons, lib.cells['top'].get_polygons()) == 0
@@ -0,0 +1,72 @@
+###############################
+# DESCRIPTION
+###############################
+## Equivalence of the dot builders of PMMA_pattern.py (shared dot, batched and tiled dot matrices, polygon store) with
+## the original recursive builders, measured by the area of the XOR of both patterns (computed on the precision grid)
+## and by their areas (equal up to the rounding of the vertices to this grid, see layout_checks.rounding_tolerance).
+## The original dot is written out here as gdspy.Round((x, y), radius, tolerance), as in the first version of
+## dot_pattern, so a change of the dot geometry is caught as well.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import PMMA_pattern
+import polygon_store
+from layout_checks import rounding_tolerance, store_pattern, xor_area
+
+###############################
+# FUNCTIONS
+###############################
+
+def original_dot_matrix(x_coor, y_coor, radius, tolerance, dx, dy, number_of_horizontal_copies, number_of_vertical_copies, substrate_pattern):
+    "The dot matrix of the first version of horizontal_dot_matrix: one XOR per gdspy.Round dot"
+    for row in range(number_of_vertical_copies):
+        for column in range(number_of_horizontal_copies):
+            dot = gdspy.Round((x_coor + column * (2 * radius + dx), y_coor + row * (2 * radius + dy)), radius, tolerance)
+            substrate_pattern = gdspy.boolean(substrate_pattern, dot, 'xor')
+    return substrate_pattern
+
+def test_dot_polygon_is_the_original_dot():
+    dot = gdspy.Round((1.25, -0.5), 0.05, 1e-4).polygons[0]
+    assert np.array_equal(PMMA_pattern.dot_polygon(0.05, 1e-4) + (1.25, -0.5), dot)
+
+def test_dot_pattern_matches_the_original_dot():
+    substrate = gdspy.Rectangle((0, 0), (1, 1))
+    original = gdspy.boolean(substrate, gdspy.Round((0.5, 0.5), 0.05, 1e-4), 'xor')
+    assert np.array_equal(PMMA_pattern.dot_pattern(0.5, 0.5, 0.05, 1e-4, substrate).polygons[0], original.polygons[0])
+
+def test_horizontal_dot_matrix_matches_the_original():
+    parameters = dict(x_coor = 0.2, y_coor = 0.2, radius = 0.05, tolerance = 1e-4, dx = 0.1, dy = 0.12,
+                      number_of_horizontal_copies = 6, number_of_vertical_copies = 5)
+    original = original_dot_matrix(substrate_pattern = gdspy.Rectangle((0, 0), (2, 2)), **parameters)
+    pattern = PMMA_pattern.horizontal_dot_matrix(substrate_pattern = gdspy.Rectangle((0, 0), (2, 2)), **parameters)
+    assert xor_area(original, pattern) < 1e-5
+
+def test_batched_dot_matrix_matches_the_original():
+    parameters = dict(x_coor = 0.2, y_coor = 0.2, radius = 0.05, tolerance = 1e-4, dx = 0.1, dy = 0.12,
+                      number_of_horizontal_copies = 8, number_of_vertical_copies = 7)
+    original = original_dot_matrix(substrate_pattern = gdspy.Rectangle((0, 0), (2, 2)), **parameters)
+    batched = PMMA_pattern.batched_dot_matrix(substrate_pattern = gdspy.Rectangle((0, 0), (2, 2)), **parameters)
+    tiled = PMMA_pattern.batched_dot_matrix(substrate_pattern = gdspy.Rectangle((0, 0), (2, 2)), tile_size = 0.7, **parameters)
+    assert abs(batched.area() - original.area()) < rounding_tolerance(original)
+    assert xor_area(original, batched) < 1e-5
+    # The tile borders cut dots (at x = 1.4): the cut vertices are rounded to the grid, which leaves slivers much smaller
+    # than a dot, while a missing or misplaced dot would add the area of a dot
+    dot_area = gdspy.Round((0, 0), 0.05, 1e-4).area()
+    assert abs(tiled.area() - original.area()) < rounding_tolerance(original)
+    assert xor_area(original, tiled) < dot_area / 4
+
+def test_dot_matrix_polygons_in_a_store_are_the_original_dots():
+    parameters = dict(x_coor = 0, y_coor = 0, radius = 0.05, tolerance = 1e-4, dx = 0.1, dy = 0.1,
+                      number_of_horizontal_copies = 4, number_of_vertical_copies = 3)
+    store = PMMA_pattern.horizontal_dot_matrix(substrate_pattern = polygon_store.new_polygon_store(), **parameters)
+    # Without a substrate, the XOR of separate dots is their union
+    original = original_dot_matrix(substrate_pattern = None, **parameters)
+    assert store['polygon_count'] == 12
+    assert xor_area(original, store_pattern(store)) < 1e-5
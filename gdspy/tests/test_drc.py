@@ -0,0 +1,39 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the design-rule check on small cells with known violations of minimum width, minimum spacing and overlap.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import drc
+import gdspy
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_drc_finds_width_and_spacing_violations():
+    cell = gdspy.Cell('drc', exclude_from_current = True)
+    cell.add(gdspy.Rectangle((0, 0), (1, 1)))
+    # 0.03 from the first rectangle, and 0.02 wide
+    cell.add(gdspy.Rectangle((1.03, 0), (1.05, 1)))
+    # Far from the others and wide enough
+    cell.add(gdspy.Rectangle((3, 0), (4, 1)))
+    rules = [violation[0] for violation in drc.check_cell(cell, min_width = 0.05, min_spacing = 0.05)[0]]
+    assert sorted(rules) == ['spacing', 'width']
+
+def test_drc_finds_overlaps():
+    cell = gdspy.Cell('overlap', exclude_from_current = True)
+    cell.add([gdspy.Rectangle((0, 0), (1, 1)), gdspy.Rectangle((0.5, 0.5), (1.5, 1.5))])
+    assert [violation[0] for violation in drc.check_cell(cell)[0]] == ['overlap']
+
+def test_drc_ignores_cut_lines_and_references():
+    # A ring written as one polygon with a cut line, placed through a rotated reference: no violation
+    ring = gdspy.Cell('ring', exclude_from_current = True).add(gdspy.Round((0, 0), 1, inner_radius = 0.5, tolerance = 1e-3))
+    top = gdspy.Cell('top', exclude_from_current = True).add(gdspy.CellReference(ring, (5, 5), rotation = 30))
+    assert drc.check_cell(top) == {0: []}
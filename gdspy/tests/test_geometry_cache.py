@@ -0,0 +1,62 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the geometry cache: recipe keys, reuse of the stored polygons by build_cells and eviction of the least
+## recently used entries.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import geometry_cache
+import numpy as np
+import os
+import parallel_build
+import PMMA_pattern
+from parallel_build import build_cells
+
+###############################
+# FUNCTIONS
+###############################
+
+def rectangle_recipe(num_vertical_array = 2):
+    parameters = dict(x_top = 0, y_top = 0, length = 0.5, width = 0.2, dx = 0.1, dy = 0.1, num_horizontal_patterns = 3, num_vertical_array = num_vertical_array)
+    return ('rectangles', PMMA_pattern.rectangle_cell_recipe, parameters)
+
+def test_recipe_key_depends_on_the_parameters_only():
+    assert geometry_cache.recipe_key(rectangle_recipe()) == geometry_cache.recipe_key(rectangle_recipe())
+    assert geometry_cache.recipe_key(rectangle_recipe(2)) != geometry_cache.recipe_key(rectangle_recipe(3))
+    # The cell name is not part of the key
+    recipe = rectangle_recipe()
+    assert geometry_cache.recipe_key(('other_name',) + recipe[1:]) == geometry_cache.recipe_key(recipe)
+
+def test_build_cells_reuses_the_cache(tmp_path):
+    recipe = rectangle_recipe()
+    built = build_cells([recipe], max_workers = 1, cache_dir = str(tmp_path))
+    cached = geometry_cache.load_cached_arrays(str(tmp_path), geometry_cache.recipe_key(recipe))
+    assert cached is not None and len(cached['offsets']) == 7
+    rebuilt = build_cells([recipe], max_workers = 1, cache_dir = str(tmp_path))
+    assert np.array_equal(built['rectangles'][0]['vertices'], rebuilt['rectangles'][0]['vertices'])
+
+def test_build_cells_evicts_once(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(parallel_build, 'evict_cache', lambda cache_dir, max_cache_size: calls.append(max_cache_size))
+    recipes = [rectangle_recipe(num_vertical_array) for num_vertical_array in [1, 2, 3]]
+    build_cells(recipes, max_workers = 1, cache_dir = str(tmp_path), max_cache_size = 10**6)
+    assert calls == [10**6]
+    assert len(os.listdir(str(tmp_path))) == 3
+    # Nothing new to store: no eviction
+    build_cells(recipes, max_workers = 1, cache_dir = str(tmp_path), max_cache_size = 10**6)
+    assert calls == [10**6]
+
+def test_evict_cache_removes_the_oldest_entries(tmp_path):
+    arrays = {'vertices': np.zeros((1000, 2))}
+    for i, key in enumerate(['old', 'middle', 'new']):
+        geometry_cache.store_cached_arrays(str(tmp_path), key, arrays)
+        os.utime(os.path.join(str(tmp_path), key + '.npz'), (i, i))
+    entry_size = os.path.getsize(os.path.join(str(tmp_path), 'new.npz'))
+    geometry_cache.evict_cache(str(tmp_path), 2 * entry_size)
+    assert sorted(os.listdir(str(tmp_path))) == ['middle.npz', 'new.npz']
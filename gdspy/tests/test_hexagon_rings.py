@@ -0,0 +1,46 @@
+###############################
+# DESCRIPTION
+###############################
+## Equivalence of the analytic hexagon rings (hexagon_ring_pattern, hexagon_array without a starting pattern, polygon
+## store) with the XOR of nested hexagons of hexagon_pattern, measured by the area of the XOR of both patterns and by
+## their areas (see layout_checks.py).
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import PMMA_pattern
+import polygon_store
+from layout_checks import rounding_tolerance, store_pattern, xor_area
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_hexagon_ring_pattern_matches_hexagon_pattern():
+    for number_of_hexagons in [5, 6]:
+        original = PMMA_pattern.hexagon_pattern(1, 2, number_of_hexagons, 0.5, 0.2, None)
+        rings = PMMA_pattern.hexagon_ring_pattern(1, 2, number_of_hexagons, 0.5, 0.2)
+        store = PMMA_pattern.hexagon_pattern(1, 2, number_of_hexagons, 0.5, 0.2, polygon_store.new_polygon_store())
+        assert abs(rings.area() - original.area()) < rounding_tolerance(original)
+        assert xor_area(original, rings) < 1e-4
+        assert xor_area(original, store_pattern(store)) < 1e-4
+
+def test_hexagon_ring_polygons_are_one_polygon_per_ring():
+    rings, middle_hexagon = PMMA_pattern.hexagon_ring_polygons(0, 0, 7, 1, 0.1)
+    assert rings.shape == (4, 14, 2)
+    assert middle_hexagon is None
+    rings, middle_hexagon = PMMA_pattern.hexagon_ring_polygons(0, 0, 8, 1, 0.1)
+    assert rings.shape == (4, 14, 2) and middle_hexagon.shape == (6, 2)
+
+def test_hexagon_array_matches_the_original_rows():
+    # The row of hexagon_cell_recipe, with the analytic rings (pattern None) and with the XOR of hexagon_pattern
+    rings_cell = PMMA_pattern.hexagon_array(0, 0, 6, 0.5, 0.1, 0.05, 5, 0, 3, None, gdspy.Cell('rings', exclude_from_current = True))
+    original_cell = gdspy.Cell('original', exclude_from_current = True)
+    for i in range(3):
+        original_cell.add(PMMA_pattern.hexagon_pattern(5 * i, 0, 6, 0.5, 0.1 + 0.05 * i, None))
+    assert xor_area(original_cell, rings_cell) < 1e-4
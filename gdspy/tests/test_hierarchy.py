@@ -0,0 +1,31 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the hierarchy helpers: choice of the cell of a command line tool.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import pytest
+from hierarchy import top_cell
+from layout_checks import small_library
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_top_cell_is_unique_or_given():
+    lib = small_library()
+    assert top_cell(lib).name == 'top'
+    assert top_cell(lib, 'rectangles').name == 'rectangles'
+    lib.add(gdspy.Cell('other', exclude_from_current = True))
+    with pytest.raises(ValueError):
+        top_cell(lib)
+    with pytest.raises(ValueError):
+        top_cell(lib, 'missing')
+    assert top_cell(lib, 'top').name == 'top'
@@ -0,0 +1,251 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the OASIS writer with a small decoder of the records it writes (START, CELLNAME, CELL, RECTANGLE, POLYGON,
+## PLACEMENT, TEXT, CBLOCK and END, with their repetitions), so the files are checked without an OASIS library.
+## The file is also read back with gdstk when it is installed (it is not needed by the package itself).
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import pytest
+import zlib
+from hierarchy import reference_matrix
+from layout_checks import small_library, xor_area
+from oasis import write_oas
+
+###############################
+# FUNCTIONS
+###############################
+
+def read_unsigned(data, position):
+    "Return (value, next position) of the unsigned integer at position"
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+def read_signed(data, position):
+    value, position = read_unsigned(data, position)
+    return (-(value >> 1) if value & 1 else value >> 1), position
+
+def read_real(data, position):
+    "Return (value, real type, next position); only the types written by oasis.real are decoded"
+    real_type, position = read_unsigned(data, position)
+    if real_type in [0, 1]:
+        value, position = read_unsigned(data, position)
+        return (value if real_type == 0 else -value), real_type, position
+    assert real_type == 7
+    return float(np.frombuffer(data[position:position + 8], dtype = '<f8')[0]), real_type, position + 8
+
+def read_string(data, position):
+    length, position = read_unsigned(data, position)
+    return bytes(data[position:position + length]), position + length
+
+def read_g_delta(data, position):
+    value, position = read_unsigned(data, position)
+    if value & 1 == 0:
+        direction = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, 1), (-1, 1), (-1, -1), (1, -1)][(value >> 1) & 7]
+        return (direction[0] * (value >> 4), direction[1] * (value >> 4)), position
+    dx = -(value >> 2) if value & 2 else value >> 2
+    dy, position = read_signed(data, position)
+    return (dx, dy), position
+
+def read_repetition(data, position):
+    "Return (offsets of the copies, shape (n, 2), next position) for the repetition types written by oasis.py"
+    repetition_type, position = read_unsigned(data, position)
+    values = []
+    if repetition_type in [1, 2, 3]:
+        for i in range([4, 2, 2][repetition_type - 1]):
+            value, position = read_unsigned(data, position)
+            values.append(value)
+        columns, rows, x_spacing, y_spacing = {1: lambda: (values[0] + 2, values[1] + 2, values[2], values[3]),
+                                               2: lambda: (values[0] + 2, 1, values[1], 0),
+                                               3: lambda: (1, values[0] + 2, 0, values[1])}[repetition_type]()
+        i, j = np.meshgrid(np.arange(columns), np.arange(rows), indexing = 'ij')
+        return np.column_stack((i.ravel() * x_spacing, j.ravel() * y_spacing)), position
+    assert repetition_type == 10
+    count, position = read_unsigned(data, position)
+    deltas = [(0, 0)]
+    for i in range(count + 1):
+        delta, position = read_g_delta(data, position)
+        deltas.append(delta)
+    return np.cumsum(deltas, axis = 0), position
+
+def read_oas(data):
+    """
+    Decode the records written by oasis.write_oas.
+
+    Return: (grid steps per micron, real type of this number, [cell names], {cell number: {'shapes': [(layer, datatype,
+    vertices)], 'placements': [(cell number, x, y, rotation, magnification, x_reflection)], 'texts': [(text, x, y)]}})
+    with the repetitions expanded, in database units
+    """
+    assert data.startswith(b'%SEMI-OASIS\r\n')
+    position = len(b'%SEMI-OASIS\r\n')
+    record_type, position = read_unsigned(data, position)
+    assert record_type == 1
+    version, position = read_string(data, position)
+    assert version == b'1.0'
+    unit, unit_type, position = read_real(data, position)
+    offset_flag, position = read_unsigned(data, position)
+    assert offset_flag == 0
+    for i in range(12):
+        offset, position = read_unsigned(data, position)
+    names = []
+    cells = {}
+    modal = {}
+    pending = []
+    while True:
+        if len(pending) == 0:
+            record_type, position = read_unsigned(data, position)
+            if record_type == 34:
+                method, position = read_unsigned(data, position)
+                uncompressed_size, position = read_unsigned(data, position)
+                compressed_size, position = read_unsigned(data, position)
+                block = zlib.decompress(bytes(data[position:position + compressed_size]), -15)
+                assert method == 0 and len(block) == uncompressed_size
+                position += compressed_size
+                pending = [block, 0]
+                continue
+            source = (data, position)
+        else:
+            record_type, pending[1] = read_unsigned(pending[0], pending[1])
+            source = (pending[0], pending[1])
+        record_data, record_position = source
+        if record_type == 2:
+            padding, record_position = read_string(record_data, record_position)
+            return unit, unit_type, names, cells
+        if record_type == 3:
+            name, record_position = read_string(record_data, record_position)
+            names.append(name.decode())
+        elif record_type == 13:
+            number, record_position = read_unsigned(record_data, record_position)
+            cell = cells.setdefault(number, {'shapes': [], 'placements': [], 'texts': []})
+            modal = {}
+        elif record_type in [20, 21]:
+            info = record_data[record_position]
+            record_position += 1
+            assert info & 0b11000 == 0b11000
+            if info & 1:
+                modal['layer'], record_position = read_unsigned(record_data, record_position)
+            if info & 2:
+                modal['datatype'], record_position = read_unsigned(record_data, record_position)
+            if record_type == 20:
+                width, record_position = read_unsigned(record_data, record_position)
+                height = width
+                if info & 0x80 == 0:
+                    height, record_position = read_unsigned(record_data, record_position)
+                shape = np.array([[0, 0], [width, 0], [width, height], [0, height]])
+            else:
+                assert info & 0x20
+                list_type, record_position = read_unsigned(record_data, record_position)
+                count, record_position = read_unsigned(record_data, record_position)
+                assert list_type == 4
+                deltas = [(0, 0)]
+                for i in range(count):
+                    delta, record_position = read_g_delta(record_data, record_position)
+                    deltas.append(delta)
+                shape = np.cumsum(deltas, axis = 0)
+            x, record_position = read_signed(record_data, record_position)
+            y, record_position = read_signed(record_data, record_position)
+            offsets = np.zeros((1, 2), dtype = np.int64)
+            if info & 0b100:
+                offsets, record_position = read_repetition(record_data, record_position)
+            for offset in offsets:
+                cell['shapes'].append((modal['layer'], modal['datatype'], shape + (x, y) + offset))
+        elif record_type in [17, 18]:
+            info = record_data[record_position]
+            record_position += 1
+            assert info & 0b11110000 == 0b11110000
+            reference, record_position = read_unsigned(record_data, record_position)
+            magnification = 1
+            rotation = 90 * ((info >> 1) & 3) if record_type == 17 else 0
+            if record_type == 18 and info & 0b100:
+                magnification, real_type, record_position = read_real(record_data, record_position)
+            if record_type == 18 and info & 0b10:
+                rotation, real_type, record_position = read_real(record_data, record_position)
+            x, record_position = read_signed(record_data, record_position)
+            y, record_position = read_signed(record_data, record_position)
+            offsets = np.zeros((1, 2), dtype = np.int64)
+            if info & 0b1000:
+                offsets, record_position = read_repetition(record_data, record_position)
+            for offset in offsets:
+                cell['placements'].append((reference, x + offset[0], y + offset[1], rotation, magnification, bool(info & 1)))
+        elif record_type == 19:
+            info = record_data[record_position]
+            record_position += 1
+            text, record_position = read_string(record_data, record_position)
+            for i in range(2):
+                value, record_position = read_unsigned(record_data, record_position)
+            x, record_position = read_signed(record_data, record_position)
+            y, record_position = read_signed(record_data, record_position)
+            cell['texts'].append((text.decode(), x, y))
+        else:
+            raise AssertionError('Unexpected record type {}'.format(record_type))
+        if len(pending) == 0:
+            position = record_position
+        else:
+            pending[1] = record_position
+            if pending[1] == len(pending[0]):
+                pending = []
+
+def flattened_polygons(cells, number, scale):
+    "Return the polygons of a decoded cell with all its placements, in um"
+    polygons = [vertices / scale for layer, datatype, vertices in cells[number]['shapes']]
+    for reference, x, y, rotation, magnification, x_reflection in cells[number]['placements']:
+        matrix = reference_matrix(rotation, magnification, x_reflection)
+        polygons.extend(points @ matrix.T + (x / scale, y / scale) for points in flattened_polygons(cells, reference, scale))
+    return polygons
+
+def test_write_oas_records_decode_to_the_library(tmp_path):
+    lib = small_library()
+    # A regular grid of rectangles, a row of triangles and two single squares
+    shapes = gdspy.Cell('shapes', exclude_from_current = True)
+    for i in range(3):
+        for j in range(2):
+            shapes.add(gdspy.Rectangle((i * 2.0, j * 3.0), (i * 2.0 + 1.0, j * 3.0 + 0.5), layer = 1))
+        shapes.add(gdspy.Polygon([(i * 5.0, 10), (i * 5.0 + 1, 10), (i * 5.0, 11.5)], layer = 2, datatype = 3))
+    shapes.add([gdspy.Rectangle((-4, -4), (-3, -3)), gdspy.Rectangle((7, -9), (8, -8))])
+    shapes.add(gdspy.Label('mark', (1, 2)))
+    lib.add(shapes)
+    for compress in [False, True]:
+        path = str(tmp_path / 'small.oas')
+        write_oas(lib, path, compress = compress)
+        with open(path, 'rb') as oas_file:
+            unit, unit_type, names, cells = read_oas(oas_file.read())
+        # 1e-6 / 1e-9 is written as the integer 1000, not as a double close to it
+        assert unit == 1000 and unit_type == 0
+        assert names == list(lib.cells)
+        decoded_shapes = cells[names.index('shapes')]
+        assert len(decoded_shapes['shapes']) == 11
+        assert sorted((layer, datatype) for layer, datatype, vertices in decoded_shapes['shapes']).count((2, 3)) == 3
+        assert decoded_shapes['texts'] == [('mark', 1000, 2000)]
+        assert xor_area(flattened_polygons(cells, names.index('shapes'), unit), shapes.get_polygons()) == 0
+        top_polygons = flattened_polygons(cells, names.index('top'), unit)
+        assert len(top_polygons) == len(lib.cells['top'].get_polygons())
+        assert xor_area(top_polygons, lib.cells['top'].get_polygons()) < 1e-6
+
+def test_write_oas_round_trip(tmp_path):
+    lib = small_library()
+    path = str(tmp_path / 'small.oas')
+    write_oas(lib, path)
+    with open(path, 'rb') as oas_file:
+        content = oas_file.read()
+    assert content.startswith(b'%SEMI-OASIS\r\n')
+    gdstk = pytest.importorskip('gdstk')
+    oas_lib = gdstk.read_oas(path)
+    oas_top = [cell for cell in oas_lib.cells if cell.name == 'top'][0]
+    oas_polygons = [polygon.points for polygon in oas_top.get_polygons()]
+    difference = gdspy.boolean(lib.cells['top'].get_polygons(), oas_polygons, 'xor')
+    assert difference is None or difference.area() < 1e-4
@@ -0,0 +1,33 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the parameter sweep: overrides of the spec and output files of every variant.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import parameter_sweep
+import pytest
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_apply_overrides_copies_the_spec():
+    spec = {'cells': {'dots': {'polygons': [{'recipe': 'dot_field_recipe', 'params': {'dx': 0.1}}]}}}
+    new_spec = parameter_sweep.apply_overrides(spec, {'cells/dots/polygons/0/params/dx': 0.2})
+    assert new_spec['cells']['dots']['polygons'][0]['params']['dx'] == 0.2
+    assert spec['cells']['dots']['polygons'][0]['params']['dx'] == 0.1
+    with pytest.raises(KeyError):
+        parameter_sweep.apply_overrides(spec, {'cells/dots/polygons/0/params/dy': 0.2})
+
+def test_variant_outputs_are_named_after_the_variant():
+    spec = {'top_cell': 'main', 'gds': 'fab_pattern', 'oas': 'fab_pattern.oas', 'preview': 'fab_pattern_preview',
+            'write_time': 'times.json', 'deduplicate': True}
+    assert parameter_sweep.variant_outputs(spec, 'fab_pattern_002') == {
+        'top_cell': 'main', 'gds': 'fab_pattern_002', 'oas': 'fab_pattern_002.oas', 'preview': 'fab_pattern_002_preview',
+        'write_time': 'fab_pattern_002_times.json', 'deduplicate': True}
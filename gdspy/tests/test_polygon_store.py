@@ -0,0 +1,51 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the polygon store: growth of the arrays, GDS records identical to the ones of gdspy, and cache keys that
+## follow the polygon store and the other modules used by the recipes.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import geometry_cache
+import io
+import numpy as np
+import PMMA_pattern
+import polygon_store
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_add_polygons_grows_the_store():
+    store = polygon_store.new_polygon_store(polygon_capacity = 2, vertex_capacity = 4)
+    squares = np.array([[[0, 0], [1, 0], [1, 1], [0, 1]]], dtype = float) + np.arange(5)[:, np.newaxis, np.newaxis]
+    polygon_store.add_polygons(store, squares, layer = 1)
+    polygon_store.add_polygons(store, [np.array([[0, 0], [2, 0], [0, 2]], dtype = float)], layer = 2, datatype = 3)
+    arrays = polygon_store.store_arrays(store)
+    assert store['polygon_count'] == 6 and store['vertex_count'] == 23
+    assert np.array_equal(arrays['offsets'], [0, 4, 8, 12, 16, 20, 23])
+    assert np.array_equal(arrays['layers'], [1, 1, 1, 1, 1, 2]) and arrays['datatypes'][-1] == 3
+    assert np.array_equal(arrays['vertices'][16:20], squares[4])
+
+def test_write_gds_polygons_matches_gdspy():
+    polygons = [np.array([[0, 0], [1.5, 0], [1.5, 0.25], [0, 0.25]]), np.array([[0, 0], [2, 0], [0, 2]]), np.array([[3, 3], [4, 3], [4, 4], [3, 4]])]
+    store = polygon_store.add_polygons(polygon_store.new_polygon_store(), polygons, layer = 2, datatype = 1)
+    expected = io.BytesIO()
+    gdspy.PolygonSet(polygons, layer = 2, datatype = 1).to_gds(expected, 1000)
+    written = io.BytesIO()
+    # Grouped by number of vertices, so the records come out in another order
+    assert polygon_store.write_gds_polygons(written, polygon_store.store_arrays(store), 1000) == 3
+    expected_records = sorted(expected.getvalue().split(b'\x00\x04\x11\x00'))
+    written_records = sorted(written.getvalue().split(b'\x00\x04\x11\x00'))
+    assert written_records == expected_records
+
+def test_recipe_key_covers_the_modules_used_by_the_recipes():
+    assert 'def add_polygons' in geometry_cache.builder_source(PMMA_pattern.rectangle_cell_recipe)
+    # Imported inside the recipe
+    assert 'def tiled_boolean' in geometry_cache.builder_source(PMMA_pattern.dot_field_tiled_recipe)
@@ -0,0 +1,61 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the raster preview: exact area coverage of the pixels, size of the finest level and rendering of the
+## instances of a cell.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import preview
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_coverage_raster_is_the_covered_area():
+    square = np.array([[0.25, 0.25], [1.75, 0.25], [1.75, 1.5], [0.25, 1.5]])
+    for polygon in [square, square[::-1]]:
+        coverage = preview.coverage_raster([polygon], np.zeros(2), 1.0, 2, 2)
+        assert np.allclose(coverage, [[0.5625, 0.5625], [0.375, 0.375]])
+    ring = gdspy.Round((1, 1), 0.9, inner_radius = 0.5, tolerance = 1e-3)
+    coverage = preview.coverage_raster(ring.polygons, np.zeros(2), 0.1, 20, 20)
+    assert abs(coverage.sum() * 0.01 - ring.area()) < 1e-9
+    assert coverage[10, 10] == 0
+
+def test_grating_renders_as_uniform_gray():
+    # Lines of half the pixel width: every pixel is half covered, whatever the supersampling
+    cell = gdspy.Cell('grating', exclude_from_current = True)
+    for index in range(64):
+        cell.add(gdspy.Rectangle((index * 0.2, 0), (index * 0.2 + 0.1, 12.8)))
+    image, x_min, y_max, pixel_size = preview.render_cell(cell, size = 32, supersample = 2)
+    assert image.shape == (32, 32)
+    assert np.all(np.abs(image.astype(int) - 128) <= 1)
+
+def test_finest_level_has_size_pixels(tmp_path):
+    cell = gdspy.Cell('top', exclude_from_current = True)
+    cell.add(gdspy.Rectangle((0, 0), (10.24, 5.12)))
+    index = preview.write_preview(cell, str(tmp_path), size = 1024, number_of_levels = 2, output = 'npy')
+    assert (index['levels'][0]['height'], index['levels'][0]['width']) == (512, 1024)
+    assert np.all(np.load(str(tmp_path / 'level_0.npy')) == 255)
+
+def test_instances_render_like_the_flat_cell():
+    dot = gdspy.Cell('dot', exclude_from_current = True)
+    dot.add(gdspy.Round((0, 0), 0.3, number_of_points = 36))
+    array = gdspy.Cell('array', exclude_from_current = True)
+    array.add(gdspy.CellArray(dot, 4, 3, (1, 1)))
+    flat = gdspy.Cell('flat', exclude_from_current = True)
+    flat.add(gdspy.Round((column, row), 0.3, number_of_points = 36) for column in range(4) for row in range(3))
+    # Dots with vertices on the axes: the box is 3.6 wide, so pixels of 0.05 and a pitch of a whole number of sub-pixels
+    # (the instances are not shifted by the rounding)
+    hierarchical = preview.render_cell(array, size = 72)
+    flattened = preview.render_cell(flat, size = 72)
+    assert hierarchical[0].shape == flattened[0].shape
+    assert np.abs(hierarchical[0].astype(int) - flattened[0].astype(int)).max() <= 2
+    assert np.allclose(hierarchical[1:], flattened[1:])
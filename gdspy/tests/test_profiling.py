@@ -0,0 +1,48 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the build profiling: report of a profiled block, environment restored after it, peak memory units.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import json
+import os
+import profiling
+import pytest
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_profiled_writes_the_report_and_restores_the_environment(tmp_path, monkeypatch):
+    monkeypatch.delenv('PMMA_PROFILE', raising = False)
+    monkeypatch.setenv('PMMA_PROFILE_OWNER', '1')
+    path = str(tmp_path / 'profile.json')
+    with profiling.profiled(path):
+        assert profiling.is_enabled()
+        assert os.environ['PMMA_PROFILE'] == path
+        assert os.environ['PMMA_PROFILE_OWNER'] == str(os.getpid())
+        with profiling.stage('write_gds', 'main') as record:
+            record['polygons'] = 3
+    assert not profiling.is_enabled()
+    assert 'PMMA_PROFILE' not in os.environ
+    assert os.environ['PMMA_PROFILE_OWNER'] == '1'
+    with open(path) as report_file:
+        report = json.load(report_file)
+    assert report['stages']['write_gds']['polygons'] == 3
+    assert list(report['cells']) == ['main']
+
+def test_peak_rss_is_in_kb(monkeypatch):
+    pytest.importorskip('resource')
+    class Usage:
+        ru_maxrss = 4 * 1024**2
+    monkeypatch.setattr(profiling.resource, 'getrusage', lambda who: Usage)
+    monkeypatch.setattr(profiling.sys, 'platform', 'darwin')
+    assert profiling.peak_rss_kb() == 4 * 1024
+    monkeypatch.setattr(profiling.sys, 'platform', 'linux')
+    assert profiling.peak_rss_kb() == 4 * 1024**2
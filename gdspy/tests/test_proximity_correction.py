@@ -0,0 +1,44 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the proximity-effect correction: rasterized spans and dose classes on known inputs, and a large pad next to
+## a small isolated square, whose doses must even out the absorbed energies whatever the split into tiles.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import numpy as np
+import proximity_correction
+
+###############################
+# FUNCTIONS
+###############################
+
+def test_proximity_correction_raises_the_dose_of_small_features():
+    # A large pad and a small isolated square far from it
+    pad = np.array([[0, 0], [6, 0], [6, 6], [0, 6]], dtype = float)
+    square = np.array([[20, 20], [20.2, 20], [20.2, 20.2], [20, 20.2]])
+    doses, energies = proximity_correction.proximity_correct([pad, square], alpha = 0.05, beta = 2.0, eta = 0.7,
+                                                             pixel_size = 0.02, iterations = 20)
+    assert doses[1] > doses[0]
+    assert np.allclose(energies, 1.0, atol = 0.02)
+    # The tiles only change how the work is split
+    tiled_doses, tiled_energies = proximity_correction.proximity_correct([pad, square], alpha = 0.05, beta = 2.0, eta = 0.7,
+                                                                         pixel_size = 0.02, iterations = 20, tile_size = 5)
+    assert np.allclose(doses, tiled_doses) and np.allclose(energies, tiled_energies)
+
+def test_polygon_spans_cover_the_pixel_centers():
+    # A 1 x 0.5 rectangle on 0.1 pixels covers 10 x 5 pixel centers
+    rectangle = np.array([[0, 0], [1, 0], [1, 0.5], [0, 0.5]], dtype = float)
+    rows, first_columns, end_columns, polygon_index = proximity_correction.polygon_spans([rectangle], np.zeros(2), 0.1)
+    assert len(rows) == 5 and np.all(end_columns - first_columns == 10)
+
+def test_dose_classes_round_to_few_values():
+    doses = np.array([1.0, 1.01, 2.0, 3.9, 4.0])
+    datatypes, table = proximity_correction.dose_classes(doses, number_of_classes = 4)
+    assert datatypes[0] == datatypes[1] and datatypes[3] == datatypes[4]
+    assert np.isclose(table[datatypes[0]], 1.0) and np.isclose(table[datatypes[4]], 4.0)
@@ -0,0 +1,56 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the tiled boolean operations against gdspy.boolean on a dot field, of the binning of the polygons into
+## the tiles, and of the number of processes of the tile pools started in the build workers.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import os
+import parallel_build
+import PMMA_pattern
+import tiled_boolean
+
+###############################
+# FUNCTIONS
+###############################
+
+def worker_budget_recipe(cell):
+    "Recipe adding one square per process of the pools started in this process by default"
+    for i in range(parallel_build.default_workers() or 0):
+        cell.add(gdspy.Rectangle((i, 0), (i + 1, 1)))
+
+def test_tiled_boolean_matches_gdspy_boolean():
+    substrate = gdspy.Rectangle((0, 0), (3, 3))
+    dots = list(PMMA_pattern.dot_matrix_polygons(0.2, 0.2, 0.05, 1e-4, 0.1, 0.1, 14, 14))
+    expected = gdspy.boolean(substrate, dots, 'xor')
+    dot_area = gdspy.Round((0, 0), 0.05, 1e-4).area()
+    for stitch in [False, True]:
+        result = tiled_boolean.tiled_boolean(substrate, dots, 'xor', 1, max_workers = 1, stitch = stitch)
+        difference = gdspy.boolean(expected, result, 'xor')
+        # Slivers along the tile borders only (see tiled_boolean.py)
+        assert difference is None or difference.area() < dot_area / 4
+
+def test_tile_tasks_get_the_polygons_touching_their_tile():
+    tiles = tiled_boolean.tile_grid(0, 0, 4, 4, 2, 1e-3)
+    inside = np.array([[0.5, 0.5], [1, 0.5], [1, 1]])
+    crossing = np.array([[1.5, 1.5], [2.5, 1.5], [2.5, 2.5]])
+    tasks = tiled_boolean.tile_tasks([inside, crossing], [], 'or', tiles)
+    counts = {task[3][0]: len(task[0]) for task in tasks}
+    assert counts == {(0.0, 0.0): 2, (0.0, 2.0): 1, (2.0, 0.0): 1, (2.0, 2.0): 1}
+
+def test_build_workers_share_the_cores(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    recipes = [('cell_{}'.format(i), worker_budget_recipe, {}) for i in range(2)]
+    results = parallel_build.build_cells(recipes, max_workers = 2)
+    # 2 workers on 8 cores: the tile pools of each worker get 4 processes, and all the cores in the main process
+    assert [len(results['cell_{}'.format(i)][0]['offsets']) - 1 for i in range(2)] == [4, 4]
+    assert parallel_build.default_workers() is None
+    assert parallel_build.default_workers(3) == 3
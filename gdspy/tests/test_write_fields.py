@@ -0,0 +1,59 @@
+###############################
+# DESCRIPTION
+###############################
+## Checks of the write-field planning: polygons crossing a field border are cut along the field grid lines, every field
+## holds only geometry inside its area, and the shapes are ordered whatever the method.
+## Usage: python -m pytest -q (from the gdspy folder)
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+import write_fields
+from layout_checks import xor_area
+
+###############################
+# FUNCTIONS
+###############################
+
+def polygon_arrays(polygons):
+    "Return the polygons (list of arrays of vertices) in the format of parallel_build.cell_to_arrays"
+    offsets = np.zeros(len(polygons) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(points) for points in polygons])
+    return np.concatenate(polygons).astype(float), offsets
+
+def test_fields_hold_only_their_own_geometry():
+    # A line across 3 x 2 fields of 10 um, a ring across the corner of 4 fields, a dot inside one field and an L whose
+    # bounding box crosses a field it does not touch
+    polygons = [gdspy.Rectangle((0, 0), (25, 12)).polygons[0],
+                np.array([[0, 13], [25, 13], [25, 14], [1, 14], [1, 29], [0, 29]]),
+                gdspy.Round((20, 10), 3, inner_radius = 1, tolerance = 1e-3).polygons[0],
+                gdspy.Rectangle((2, 2), (3, 3)).polygons[0]]
+    vertices, offsets = polygon_arrays(polygons)
+    plan, report = write_fields.plan_write_fields(vertices, offsets, field_size = 10.0)
+    assert report['polygons'] == 4
+    assert report['stitched_polygons'] == 3
+    assert report['fields'] == 7
+    for (column, row), shapes, sources in plan:
+        points = np.concatenate(shapes)
+        assert np.all(points >= np.array([column, row]) * 10 - 1e-3)
+        assert np.all(points <= np.array([column + 1, row + 1]) * 10 + 1e-3)
+    pieces = [gdspy.PolygonSet(shapes) for field, shapes, sources in plan]
+    original = gdspy.PolygonSet(polygons)
+    assert xor_area(original, pieces) < 1e-2
+    assert abs(report['exposed_area_um2'] - original.area()) < 1e-2
+
+def test_shape_orderings_cover_every_shape():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 50, (300, 2))
+    polygons = [gdspy.Rectangle(corner, corner + 0.5).polygons[0] for corner in corners]
+    vertices, offsets = polygon_arrays(polygons)
+    for method, max_nearest in [('hilbert', 2000), ('nearest', 2000), ('nearest', 10)]:
+        plan, report = write_fields.plan_write_fields(vertices, offsets, field_size = 20.0, method = method, max_nearest = max_nearest)
+        sources = np.concatenate([sources for field, shapes, sources in plan])
+        assert len(sources) == report['shapes'] and np.unique(sources).tolist() == list(range(300))
+        assert report['beam_travel_um'] > 0
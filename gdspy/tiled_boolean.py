@@ -0,0 +1,153 @@
+###############################
+# DESCRIPTION
+###############################
+## Boolean operations on large regions, split into a grid of square tiles computed in parallel.
+## Each polygon goes to every tile its bounding box touches (the polygons are binned into the tiles once), both operands
+## are clipped to the tile and the operation is done on the clipped polygons only, so the time of a tile depends on its
+## area and not on the whole pattern.
+## The tiles run in a process pool and the pieces are put back together:
+##   + the tile borders lie on the precision grid of gdspy.boolean, so the pieces of a shape cut by a border abut
+##     exactly, without gaps or overlaps
+##   + with stitch = True, the pieces touching an inner tile border are merged back into whole polygons
+## The result differs from gdspy.boolean by slivers along the tile borders: where a slanted edge crosses a border, the
+## new vertex is rounded to the precision grid, which moves the edge by up to precision / 2 near the border. Stitching
+## rounds these pieces once more and removes the border vertices, so the XOR with gdspy.boolean is about 1.4 to 2 times
+## larger (0.0050 instead of 0.0036 um^2 for 10 hexagon rings cut by 3 um tiles, precision 1e-3); the total area is
+## the same. These differences are below the precision grid and disappear with the tolerance of compare_layouts.py.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from parallel_build import default_workers
+
+###############################
+# FUNCTIONS
+###############################
+
+def polygon_list(operand):
+    "Return the polygons of a PolygonSet, a list of PolygonSets and vertex arrays, or None, as a list of vertex arrays"
+    if operand is None:
+        return []
+    if isinstance(operand, gdspy.PolygonSet):
+        return list(operand.polygons)
+    polygons = []
+    for element in operand:
+        if isinstance(element, gdspy.PolygonSet):
+            polygons.extend(element.polygons)
+        else:
+            polygons.append(np.asarray(element, dtype = float))
+    return polygons
+
+def bounding_boxes(polygons):
+    "Return the lower-left and upper-right corners of the polygons, two arrays of shape (number of polygons, 2)"
+    lower = np.array([points.min(axis = 0) for points in polygons]).reshape(-1, 2)
+    upper = np.array([points.max(axis = 0) for points in polygons]).reshape(-1, 2)
+    return lower, upper
+
+def tile_grid(x_min, y_min, x_max, y_max, tile_size, precision):
+    "Return the corners ((x0, y0), (x1, y1)) of the tiles covering the box, with their borders on the precision grid"
+    tile_size = max(precision, np.round(tile_size / precision) * precision)
+    x_start = np.floor(x_min / precision) * precision
+    y_start = np.floor(y_min / precision) * precision
+    x_borders = x_start + np.arange(int(np.ceil((x_max - x_start) / tile_size)) + 1) * tile_size
+    y_borders = y_start + np.arange(int(np.ceil((y_max - y_start) / tile_size)) + 1) * tile_size
+    return [((x0, y0), (x1, y1)) for x0, x1 in zip(x_borders[:-1], x_borders[1:]) for y0, y1 in zip(y_borders[:-1], y_borders[1:])]
+
+def boolean_in_tile(task):
+    """
+    task: (polygons of operand 1, polygons of operand 2, operation, tile corners, precision, max_points)
+    (this is the task executed by the workers)
+
+    Return: the vertex arrays of (operand 1 clipped to the tile) operation (operand 2 clipped to the tile)
+    """
+    polygons1, polygons2, operation, tile, precision, max_points = task
+    box = gdspy.Rectangle(*tile)
+    clipped1 = gdspy.boolean(polygons1, box, 'and', precision = precision, max_points = 0)
+    clipped2 = gdspy.boolean(polygons2, box, 'and', precision = precision, max_points = 0)
+    # Bounding boxes touching the tile do not mean the polygons do; gdspy.boolean fails when both operands are empty
+    if clipped1 is None and clipped2 is None:
+        return []
+    result = gdspy.boolean(clipped1, clipped2, operation, precision = precision, max_points = max_points)
+    if result is None:
+        return []
+    return result.polygons
+
+def tile_tasks(polygons1, polygons2, operation, tiles, precision = 1e-3, max_points = 199):
+    """
+    tiles: tiles of a grid, as returned by tile_grid
+
+    Return the tasks of boolean_in_tile for the tiles touched by at least one polygon: every task gets the polygons
+    whose bounding box touches its tile, including the ones crossing its border
+    """
+    # Borders of the grid; the polygons are binned once into the columns and rows their bounding box touches
+    x_lower = np.unique([tile[0][0] for tile in tiles])
+    x_upper = np.unique([tile[1][0] for tile in tiles])
+    y_lower = np.unique([tile[0][1] for tile in tiles])
+    y_upper = np.unique([tile[1][1] for tile in tiles])
+    tile_index = {(np.searchsorted(x_lower, tile[0][0]), np.searchsorted(y_lower, tile[0][1])): i for i, tile in enumerate(tiles)}
+    selected = [([], []) for tile in tiles]
+    for operand, polygons in enumerate([polygons1, polygons2]):
+        if len(polygons) == 0:
+            continue
+        polygon_lower, polygon_upper = bounding_boxes(polygons)
+        first_column = np.searchsorted(x_upper, polygon_lower[:, 0], 'left')
+        end_column = np.searchsorted(x_lower, polygon_upper[:, 0], 'right')
+        first_row = np.searchsorted(y_upper, polygon_lower[:, 1], 'left')
+        end_row = np.searchsorted(y_lower, polygon_upper[:, 1], 'right')
+        for i in range(len(polygons)):
+            for column in range(first_column[i], end_column[i]):
+                for row in range(first_row[i], end_row[i]):
+                    task = tile_index.get((column, row))
+                    if task is not None:
+                        selected[task][operand].append(polygons[i])
+    return [(selected1, selected2, operation, tile, precision, max_points)
+            for (selected1, selected2), tile in zip(selected, tiles) if len(selected1) + len(selected2) > 0]
+
+def run_tile_tasks(tasks, max_workers = None):
+    """
+    Return the results of boolean_in_tile for the tasks, in a process pool unless max_workers = 1 or there is a single task.
+    In a build worker, max_workers = None is the share of the cores of the worker (see parallel_build.default_workers).
+    """
+    max_workers = default_workers(max_workers)
+    if max_workers == 1 or len(tasks) <= 1:
+        return list(map(boolean_in_tile, tasks))
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        return list(executor.map(boolean_in_tile, tasks, chunksize = max(1, len(tasks) // 64)))
+
+def tiled_boolean(operand1, operand2, operation, tile_size, max_workers = None, precision = 1e-3, max_points = 199,
+                  layer = 0, datatype = 0, stitch = False):
+    """
+    Same as gdspy.boolean(operand1, operand2, operation, precision, max_points, layer, datatype), computed tile by tile.
+    tile_size: side of the square tiles
+    max_workers: number of processes (default: all the cores); with max_workers = 1 everything runs in this process
+    stitch: merge the pieces cut by the tile borders back into whole polygons (one more boolean on these pieces only);
+        the polygons are fewer but move by up to the precision near the borders (see the top of this file)
+
+    Return: a PolygonSet, or None if the result is empty
+    """
+    polygons1 = polygon_list(operand1)
+    polygons2 = polygon_list(operand2)
+    if len(polygons1) + len(polygons2) == 0:
+        return None
+    lower, upper = bounding_boxes(polygons1 + polygons2)
+    tiles = tile_grid(lower[:, 0].min(), lower[:, 1].min(), upper[:, 0].max(), upper[:, 1].max(), tile_size, precision)
+    tile_results = run_tile_tasks(tile_tasks(polygons1, polygons2, operation, tiles, precision, max_points), max_workers)
+    pieces = [polygon for tile_result in tile_results for polygon in tile_result]
+    if len(pieces) == 0:
+        return None
+    if stitch:
+        inner_borders_x = np.unique([tile[0][0] for tile in tiles])[1:]
+        inner_borders_y = np.unique([tile[0][1] for tile in tiles])[1:]
+        def touches_border(points, borders, axis):
+            return np.any(np.abs(points[:, axis, np.newaxis] - borders[np.newaxis, :]) < precision / 2)
+        on_border = [touches_border(p, inner_borders_x, 0) or touches_border(p, inner_borders_y, 1) for p in pieces]
+        inside = [p for p, border in zip(pieces, on_border) if not border]
+        merged = gdspy.boolean([p for p, border in zip(pieces, on_border) if border], None, 'or', precision = precision, max_points = max_points)
+        pieces = inside + ([] if merged is None else merged.polygons)
+    return gdspy.PolygonSet(pieces, layer = layer, datatype = datatype)
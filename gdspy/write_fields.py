@@ -0,0 +1,253 @@
+###############################
+# DESCRIPTION
+###############################
+## Split a layout into e-beam write fields and order the shapes to reduce beam and stage travel.
+## Polygons crossing a field border are cut along the field grid lines (gdspy.slice) and counted as stitched, so that no
+## field holds geometry outside its area. Every piece then goes to the fixed-size write field containing the center of its
+## bounding box, found by hashing the center onto the field grid.
+## The fields are written row by row in a serpentine order (short stage moves), and the shapes of a field are ordered
+## along a Hilbert curve or with a greedy nearest-neighbour path (O(n^2), so only up to max_nearest shapes per field; the
+## larger fields are ordered along the Hilbert curve).
+## The report gives the beam travel (inside the fields), the stage travel (between fields) and an estimated write time:
+##     exposure = area * dose / beam current, plus a settling time per shape and per stage move.
+## The export is a GDS file with one cell per field (polygons in writing order) referenced by a top cell.
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import argparse
+import gdspy
+import json
+import numpy as np
+from hierarchy import top_cell
+
+###############################
+# FUNCTIONS
+###############################
+
+def polygon_bounding_boxes(vertices, offsets):
+    """
+    vertices, offsets: polygons in the format of parallel_build.cell_to_arrays
+
+    Return: (lower-left corners, upper-right corners) of the polygons, two arrays of shape (number of polygons, 2)
+    """
+    starts = offsets[:-1]
+    return np.minimum.reduceat(vertices, starts, axis = 0), np.maximum.reduceat(vertices, starts, axis = 0)
+
+def polygon_areas(vertices, offsets):
+    "Return the area of every polygon (shoelace formula on all the polygons at once)"
+    next_vertex = np.arange(1, len(vertices) + 1)
+    next_vertex[offsets[1:] - 1] = offsets[:-1]
+    cross = vertices[:, 0] * vertices[next_vertex, 1] - vertices[next_vertex, 0] * vertices[:, 1]
+    return np.abs(np.add.reduceat(cross, offsets[:-1])) / 2
+
+def hilbert_index(x, y, order = 16):
+    "Return the position along a Hilbert curve of order 'order' of the integer points (x, y), 0 <= x, y < 2**order"
+    x = x.astype(np.int64).copy()
+    y = y.astype(np.int64).copy()
+    index = np.zeros(len(x), dtype = np.int64)
+    s = 2**(order - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so that the curve is continuous
+        flip = ~ry & rx
+        x[flip] = s - 1 - x[flip]
+        y[flip] = s - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s //= 2
+    return index
+
+def nearest_neighbour_order(points, start):
+    "Return the order of points given by a greedy nearest-neighbour path starting at the point closest to start"
+    remaining = np.ones(len(points), dtype = bool)
+    order = np.zeros(len(points), dtype = np.int64)
+    position = start
+    for step in range(len(points)):
+        distance = np.where(remaining, np.sum((points - position)**2, axis = 1), np.inf)
+        nearest = np.argmin(distance)
+        order[step] = nearest
+        remaining[nearest] = False
+        position = points[nearest]
+    return order
+
+def assign_write_fields(lower, upper, field_size, origin):
+    """
+    lower, upper: bounding boxes of the polygons
+    origin: corner of the field (0, 0)
+
+    Return: (field (column, row) of every polygon, whether the polygon crosses a field border)
+    """
+    centers = (lower + upper) / 2
+    fields = np.floor((centers - origin) / field_size).astype(np.int64)
+    field_lower = origin + fields * field_size
+    stitched = np.any(lower < field_lower - 1e-9, axis = 1) | np.any(upper > field_lower + field_size + 1e-9, axis = 1)
+    return fields, stitched
+
+def split_at_field_borders(vertices, offsets, field_size, origin, precision = 1e-3):
+    """
+    vertices, offsets: polygons in the format of parallel_build.cell_to_arrays
+    origin: corner of the field (0, 0)
+    precision: passed to gdspy.slice
+
+    Return: (vertices, offsets, source) of the pieces, every polygon crossing a field border being cut along the field
+    grid lines; source is the index of the polygon each piece comes from
+    """
+    lower, upper = polygon_bounding_boxes(vertices, offsets)
+    fields, stitched = assign_write_fields(lower, upper, field_size, origin)
+    kept = np.flatnonzero(~stitched)
+    pieces = [vertices[offsets[i]:offsets[i + 1]] for i in kept]
+    source = kept.tolist()
+    for i in np.flatnonzero(stitched):
+        parts = [gdspy.PolygonSet([vertices[offsets[i]:offsets[i + 1]]])]
+        for axis in range(2):
+            # Grid lines strictly inside the bounding box
+            first = int(np.ceil((lower[i, axis] - origin[axis]) / field_size + 1e-9))
+            last = int(np.floor((upper[i, axis] - origin[axis]) / field_size - 1e-9))
+            positions = (origin[axis] + np.arange(first, last + 1) * field_size).tolist()
+            if len(positions) > 0:
+                # Regions of the slice outside the polygon are None
+                parts = [region for part in parts for region in gdspy.slice(part, positions, axis, precision) if region is not None]
+        cut = [points for part in parts for points in part.polygons]
+        pieces.extend(cut)
+        source.extend([i] * len(cut))
+    piece_offsets = np.zeros(len(pieces) + 1, dtype = np.int64)
+    piece_offsets[1:] = np.cumsum([len(points) for points in pieces])
+    return np.concatenate(pieces), piece_offsets, np.array(source, dtype = np.int64)
+
+def field_order(fields):
+    "Return the distinct fields (array of (column, row)) in serpentine order: rows bottom to top, alternating direction"
+    distinct = np.unique(fields, axis = 0)
+    column = np.where(distinct[:, 1] % 2 == 0, distinct[:, 0], -distinct[:, 0])
+    return distinct[np.lexsort((column, distinct[:, 1]))]
+
+def plan_write_fields(vertices, offsets, field_size = 100.0, method = 'hilbert', doses = None, base_dose = 300.0,
+                      beam_current = 1.0, shape_settling_time = 1e-6, stage_settling_time = 0.1, stage_speed = 1000.0,
+                      max_nearest = 2000, precision = 1e-3):
+    """
+    vertices, offsets: polygons in the format of parallel_build.cell_to_arrays, in um
+    field_size: side of the write fields in um
+    method: 'hilbert' or 'nearest', ordering of the shapes inside a field
+    max_nearest: largest number of shapes of a field ordered with method 'nearest', the larger fields use 'hilbert'
+    precision: of the cuts at the field borders, in um
+    doses: dose factor of every polygon (e.g. from proximity_correction), default 1
+    base_dose: in uC/cm^2
+    beam_current: in nA
+    shape_settling_time, stage_settling_time: in s, per shape and per stage move
+    stage_speed: in um/s
+
+    Return: (plan, report dictionary); plan is a list of (field (column, row), shapes, sources) in writing order, with the
+    shapes of the field in writing order (arrays of vertices, pieces of the polygons cut at the field borders) and the
+    index of the polygon every shape comes from
+    """
+    lower, upper = polygon_bounding_boxes(vertices, offsets)
+    origin = lower.min(axis = 0)
+    number_of_polygons = len(offsets) - 1
+    stitched = assign_write_fields(lower, upper, field_size, origin)[1]
+    vertices, offsets, source = split_at_field_borders(vertices, offsets, field_size, origin, precision)
+    lower, upper = polygon_bounding_boxes(vertices, offsets)
+    centers = (lower + upper) / 2
+    fields = assign_write_fields(lower, upper, field_size, origin)[0]
+    # Hash the fields to sort the polygons by field once
+    field_keys = fields[:, 1] * (fields[:, 0].max() + 1) + fields[:, 0]
+    by_field = np.argsort(field_keys, kind = 'stable')
+    sorted_keys = field_keys[by_field]
+    plan = []
+    beam_travel = 0.0
+    stage_travel = 0.0
+    stage_position = None
+    for field in field_order(fields):
+        key = field[1] * (fields[:, 0].max() + 1) + field[0]
+        members = by_field[np.searchsorted(sorted_keys, key):np.searchsorted(sorted_keys, key, side = 'right')]
+        field_center = origin + (field + 0.5) * field_size
+        points = centers[members]
+        if method == 'nearest' and len(members) <= max_nearest:
+            order = nearest_neighbour_order(points, field_center - field_size / 2)
+        elif method in ['nearest', 'hilbert']:
+            grid = np.clip((points - (field_center - field_size / 2)) / field_size * 2**16, 0, 2**16 - 1)
+            order = np.argsort(hilbert_index(grid[:, 0], grid[:, 1]), kind = 'stable')
+        else:
+            raise ValueError("Unknown shape ordering method '{}'".format(method))
+        members = members[order]
+        beam_travel += np.sum(np.linalg.norm(np.diff(centers[members], axis = 0), axis = 1))
+        if stage_position is not None:
+            stage_travel += np.linalg.norm(field_center - stage_position)
+        stage_position = field_center
+        plan.append((tuple(field.tolist()), [vertices[offsets[i]:offsets[i + 1]] for i in members], source[members]))
+    if doses is None:
+        doses = np.ones(number_of_polygons)
+    areas = polygon_areas(vertices, offsets)
+    # uC/cm^2 * um^2 = 1e-8 uC = 1e-5 nC; divided by nA gives seconds
+    exposure_time = np.sum(areas * np.asarray(doses)[source] * base_dose) * 1e-5 / beam_current
+    overhead_time = len(areas) * shape_settling_time + len(plan) * stage_settling_time + stage_travel / stage_speed
+    report = {'polygons': int(number_of_polygons),
+              'shapes': int(len(areas)),
+              'fields': len(plan),
+              'stitched_polygons': int(np.sum(stitched)),
+              'exposed_area_um2': float(np.sum(areas)),
+              'beam_travel_um': float(beam_travel),
+              'stage_travel_um': float(stage_travel),
+              'exposure_time_s': float(exposure_time),
+              'overhead_time_s': float(overhead_time),
+              'write_time_s': float(exposure_time + overhead_time)}
+    return plan, report
+
+def export_write_fields(cell, gds_path, field_size = 100.0, method = 'hilbert', **kwargs):
+    """
+    Write the polygons of cell (flattened) to gds_path, one cell per write field with its shapes in writing order.
+    kwargs: passed to plan_write_fields
+
+    Return: the report of plan_write_fields
+    """
+    polygons = []
+    layers = []
+    datatypes = []
+    for (layer, datatype), layer_polygons in cell.get_polygons(by_spec = True).items():
+        polygons.extend(layer_polygons)
+        layers.extend([layer] * len(layer_polygons))
+        datatypes.extend([datatype] * len(layer_polygons))
+    offsets = np.zeros(len(polygons) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(points) for points in polygons])
+    plan, report = plan_write_fields(np.concatenate(polygons), offsets, field_size, method, **kwargs)
+    lib = gdspy.GdsLibrary()
+    top_cell = gdspy.Cell(cell.name + '_fields', exclude_from_current = True)
+    lib.add(top_cell)
+    for (column, row), shapes, sources in plan:
+        field_cell = gdspy.Cell('{}_field_{}_{}'.format(cell.name, column, row), exclude_from_current = True)
+        lib.add(field_cell)
+        polygon_set = gdspy.PolygonSet(shapes)
+        polygon_set.layers = [layers[i] for i in sources]
+        polygon_set.datatypes = [datatypes[i] for i in sources]
+        field_cell.add(polygon_set)
+        top_cell.add(gdspy.CellReference(field_cell))
+    lib.write_gds(gds_path)
+    return report
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    # Usage: python write_fields.py input.gds output.gds [--cell main] [--field-size 100] [--method hilbert]
+    # The report is printed and written to output.gds.report.json
+    parser = argparse.ArgumentParser(description = 'Split a cell of a GDS file into e-beam write fields')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--cell', default = None, help = 'cell to split (default: the top cell, if there is only one)')
+    parser.add_argument('--field-size', type = float, default = 100.0, help = 'side of the write fields in um')
+    parser.add_argument('--method', choices = ['hilbert', 'nearest'], default = 'hilbert', help = 'ordering of the shapes of a field')
+    arguments = parser.parse_args()
+    input_lib = gdspy.GdsLibrary(infile = arguments.input)
+    try:
+        cell = top_cell(input_lib, arguments.cell)
+    except ValueError as error:
+        parser.error(str(error))
+    report = export_write_fields(cell, arguments.output, arguments.field_size, arguments.method)
+    with open(arguments.output + '.report.json', 'w') as report_file:
+        json.dump(report, report_file, indent = 2)
+    print(json.dumps(report, indent = 2))
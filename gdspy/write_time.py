@@ -0,0 +1,149 @@
+###############################
+# DESCRIPTION
+###############################
+## Estimate of the e-beam exposure of every cell of a library: exposed area, shot count and write time, per dose class.
+## The estimate follows the hierarchy instead of flattening it: the totals of a cell are computed once from its own
+## polygons (vectorized areas, see write_fields.polygon_areas) and added to the cells referencing it, times the number
+## of copies (a CellArray counts columns x rows copies, a magnification scales the area), so the time depends on the
+## number of distinct cells and not on the number of flattened shapes.
+## Dose classes are datatypes (as written by proximity_correction.proximity_correct_cell), each with a dose factor
+## from a dose table {datatype: dose factor}; datatypes missing from the table get the factor 1.
+## Shots: every polygon is fractured into about (number of vertices - 2) / 2 trapezoids, and into more shots if its area
+## is larger than max_shot_size^2 (magnified copies are counted with the shots of the original cell).
+## Write time = exposure (area * dose / beam current) + a settling time per shot + a stage settling time per write field,
+## the write fields being counted over the bounding box of the cell.
+## Usage: python write_time.py input.gds [doses.json] [report.json]
+###############################
+
+
+###############################
+# IMPORT PACKAGES
+###############################
+
+import gdspy
+import json
+import numpy as np
+import sys
+from preview import cell_bounds
+from write_fields import polygon_areas
+
+###############################
+# FUNCTIONS
+###############################
+
+def polygon_shots(offsets, areas, max_shot_size):
+    "Return the estimated number of shots of every polygon (see the description at the top of this file)"
+    trapezoids = np.maximum(1, (np.diff(offsets) - 2) // 2)
+    # Rounding errors of rotated copies must not add a shot to a polygon whose area is a whole number of shots
+    return np.maximum(trapezoids, np.ceil(areas / max_shot_size**2 - 1e-6)).astype(np.int64)
+
+def own_totals(cell, max_shot_size, layers = None):
+    """
+    Return: {datatype: array [polygons, shots, area]} of the polygons and paths of the cell itself (not of its references)
+    on the given layers
+    """
+    polygons = []
+    datatypes = []
+    for polygon_set in cell.polygons:
+        for points, layer, datatype in zip(polygon_set.polygons, polygon_set.layers, polygon_set.datatypes):
+            if layers is None or layer in layers:
+                polygons.append(points)
+                datatypes.append(datatype)
+    for path in cell.paths:
+        for (layer, datatype), path_polygons in path.get_polygons(by_spec = True).items():
+            if layers is None or layer in layers:
+                polygons.extend(path_polygons)
+                datatypes.extend([datatype] * len(path_polygons))
+    if len(polygons) == 0:
+        return {}
+    offsets = np.zeros(len(polygons) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(points) for points in polygons])
+    areas = polygon_areas(np.concatenate(polygons).astype(float), offsets)
+    shots = polygon_shots(offsets, areas, max_shot_size)
+    datatypes = np.array(datatypes)
+    totals = {}
+    for datatype in np.unique(datatypes).tolist():
+        members = datatypes == datatype
+        totals[datatype] = np.array([np.sum(members), np.sum(shots[members]), np.sum(areas[members])], dtype = float)
+    return totals
+
+def cell_totals(cell, cache, max_shot_size, layers = None):
+    """
+    cache: dictionary of the totals already computed, filled by this function
+
+    Return: {datatype: array [polygons, shots, area]} of the cell with all its references, as if it were flattened
+    """
+    if cell.name in cache:
+        return cache[cell.name]
+    totals = own_totals(cell, max_shot_size, layers)
+    for reference in cell.references:
+        if not isinstance(reference.ref_cell, gdspy.Cell):
+            continue
+        copies = reference.columns * reference.rows if isinstance(reference, gdspy.CellArray) else 1
+        magnification = 1 if reference.magnification is None else reference.magnification
+        for datatype, child_totals in cell_totals(reference.ref_cell, cache, max_shot_size, layers).items():
+            totals[datatype] = totals.get(datatype, 0) + child_totals * (copies, copies, copies * magnification**2)
+    cache[cell.name] = totals
+    return totals
+
+def exposure_summary(totals, dose_table, base_dose, beam_current, shot_settling_time):
+    "Return the report entries of {datatype: [polygons, shots, area]}: one entry for all the datatypes and one per dose class"
+    summary = {'polygons': 0, 'shots': 0, 'exposed_area_um2': 0.0, 'exposure_time_s': 0.0, 'shot_time_s': 0.0, 'dose_classes': {}}
+    for datatype, (polygons, shots, area) in sorted(totals.items()):
+        dose = dose_table.get(datatype, 1.0)
+        # uC/cm^2 * um^2 = 1e-8 uC = 1e-5 nC; divided by nA gives seconds
+        exposure_time = area * dose * base_dose * 1e-5 / beam_current
+        summary['dose_classes'][datatype] = {'dose_factor': dose, 'polygons': int(polygons), 'shots': int(shots),
+                                             'exposed_area_um2': float(area), 'exposure_time_s': float(exposure_time),
+                                             'shot_time_s': float(shots * shot_settling_time)}
+        summary['polygons'] += int(polygons)
+        summary['shots'] += int(shots)
+        summary['exposed_area_um2'] += float(area)
+        summary['exposure_time_s'] += float(exposure_time)
+        summary['shot_time_s'] += float(shots * shot_settling_time)
+    return summary
+
+def estimate_write_time(lib, dose_table = None, base_dose = 300.0, beam_current = 1.0, shot_settling_time = 1e-6,
+                        max_shot_size = 1.0, field_size = 100.0, stage_settling_time = 0.1, layers = None):
+    """
+    lib: GdsLibrary, in um
+    dose_table: {datatype: dose factor}, e.g. from proximity_correction.dose_classes
+    base_dose: in uC/cm^2
+    beam_current: in nA
+    shot_settling_time, stage_settling_time: in s, per shot and per write field
+    max_shot_size, field_size: in um
+
+    Return: {cell name: report}, with the exposed area, shots and times of the cell (flattened) in total and per dose class
+    """
+    dose_table = {} if dose_table is None else {int(datatype): dose for datatype, dose in dose_table.items()}
+    totals_cache = {}
+    bounds_cache = {}
+    report = {}
+    for name, cell in lib.cells.items():
+        summary = exposure_summary(cell_totals(cell, totals_cache, max_shot_size, layers), dose_table, base_dose, beam_current, shot_settling_time)
+        bounds = cell_bounds(cell, np.eye(2), bounds_cache, layers)
+        fields = 0 if bounds is None else int(np.prod(np.maximum(1, np.ceil((bounds[1] - bounds[0]) / field_size))))
+        summary['fields'] = fields
+        summary['stage_time_s'] = fields * stage_settling_time
+        summary['write_time_s'] = summary['exposure_time_s'] + summary['shot_time_s'] + summary['stage_time_s']
+        report[name] = summary
+    return report
+
+###############################
+# MAIN CODES
+###############################
+
+if __name__ == '__main__':
+    lib = gdspy.GdsLibrary(infile = sys.argv[1])
+    dose_table = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as dose_file:
+            dose_table = json.load(dose_file)
+    report = estimate_write_time(lib, dose_table)
+    print('{:30s} {:>10s} {:>12s} {:>14s} {:>12s}'.format('cell', 'polygons', 'shots', 'area (um^2)', 'time (s)'))
+    for name, summary in sorted(report.items()):
+        print('{:30s} {:>10d} {:>12d} {:>14.2f} {:>12.3f}'.format(name, summary['polygons'], summary['shots'],
+                                                                 summary['exposed_area_um2'], summary['write_time_s']))
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'w') as report_file:
+            json.dump(report, report_file, indent = 2)